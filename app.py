@@ -1,125 +1,217 @@
+import hashlib
 import json
 import os
-import random
-from io import BytesIO
+import shutil
+import threading
+import time
 
-import networkx as nx
 import numpy as np
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 from flask_cors import CORS  # Import the extension
-from networkx.readwrite import json_graph
-from pdfminer.high_level import extract_text
-
-from claude import (
-    apply_preconditions,
-    cluster_topics,
-    get_big_json,
-    get_preconditions,
-    regex_on_theorems,
-    remove_dups,
-)
+
+import metrics
+from compression import ENCODINGS, compress, min_size
+from course_edit import CourseEditor, EditError
+from course_store import CourseStore
+from dag import condensation
+from graph_cache import CourseCache
+from layout import DEFAULT_LAYOUT, LAYOUTS
+from merge import course_label, merge_courses
+from reachability import ReachabilityIndex
+from references import resolve_references
+from search import SearchIndex
+from topics import TopicIndex
 
 # "DEV" or "PROD"
 ENV = "DEV"
 saved_dir = "saved_course_jsons"
 temp_dir = "temp"
+# Upper bound on memory held by serialized course responses
+graph_cache_bytes = 128 * 1024 * 1024
+# Ingestion jobs run concurrently on this many background threads
+ingest_workers = 2
+# Idle event streams send a comment this often so proxies keep them open
+event_heartbeat_seconds = 15
+# Node attributes kept in compact graphs; the rest is fetched per theorem
+compact_node_keys = ["id", "name", "type", "topic", "x", "y"]
+# Most theorems returned by one batch detail request
+max_batch_theorems = 500
+# Most hits returned by one search
+max_search_results = 100
 
 
 app = Flask(__name__)
 app.config["CORS_HEADERS"] = "Content-Type"
 CORS(app, resources={r"/*": {"origins": "*"}})
+# Saved courses are served from memory-mapped .course files
+course_store = CourseStore(os.path.join(temp_dir, "course_store"), saved_dir)
+course_cache = CourseCache(graph_cache_bytes, course_store.recorded_digest)
+# Created with the first PDF job; see ingestion_job_manager
+job_manager = None
+job_manager_lock = threading.Lock()
+search_index = SearchIndex(os.path.join(temp_dir, "search.sqlite3"), saved_dir)
+# Edited courses keep their layered positions between edits and loads
+course_editor = CourseEditor(
+    saved_dir,
+    os.path.join(temp_dir, "course_positions"),
+    lambda path: course_store.open(path).digest,
+)
+
+
+def ingestion_stages():
+    # The pipeline pulls in the LLM client and PDF extraction, so it is only
+    # imported once a PDF arrives; workers that serve saved courses never
+    # load it
+    from pipeline import DEV_STAGES, PIPELINE_STAGES
+
+    return PIPELINE_STAGES if ENV == "PROD" else DEV_STAGES
+
+
+def ingestion_job_manager():
+    global job_manager
+    with job_manager_lock:
+        if job_manager is None:
+            from jobs import JobManager
+
+            job_manager = JobManager(ingestion_stages(), max_workers=ingest_workers)
+        return job_manager
+
+
+def find_job(job_id):
+    # Before the first job there is nothing to find
+    return None if job_manager is None else job_manager.get(job_id)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (job events) are timed until they start streaming
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.http_request_seconds.observe(
+        time.perf_counter() - g.request_started,
+        endpoint=endpoint,
+        method=request.method,
+        status=response.status_code,
+    )
+    if not response.is_streamed and response.content_length is not None:
+        metrics.http_response_bytes.observe(response.content_length, endpoint=endpoint)
+    return response
+
+
+def node_link_data(graph, edges, nodes):
+    """What networkx's node_link_data(G, edges="links") gives for a DiGraph
+    G built by adding edges and then nodes (id -> attributes), without
+    building G: nodes in the order they were first added, links grouped by
+    source in that order."""
+    successors = {}
+    for source, target in edges:
+        successors.setdefault(source, {})[target] = None
+        successors.setdefault(target, {})
+    order = dict.fromkeys(successors)
+    order.update(dict.fromkeys(nodes))
+    return dict(
+        directed=True,
+        multigraph=False,
+        graph=graph,
+        nodes=[dict(nodes.get(id, {}), id=id) for id in order],
+        links=[dict(source=s, target=t) for s in order for t in successors.get(s, ())],
+    )
 
 
 def build_graph_conn_comps(claude_list):
-    G = nx.DiGraph()
     # Check no two statements have same title
     # assert(len(list(set([thingy['id'] for thingy in claude_list]))) == len(claude_list))
 
-    ### CHECK NO CYCLES
-
     # BFS on each tree in forest, set starting y based on depth of each BFS
-    vertices = [thingy["id"] for thingy in claude_list]
-    edges = {thingy["id"]: [] for thingy in claude_list}
-    incoming_edges = {thingy["id"]: [] for thingy in claude_list}
-    root_node_dependencies = {thingy["id"]: [] for thingy in claude_list}
-    # list of (vertex_id, depth)
-    searched_set = {thingy["id"]: False for thingy in claude_list}
-    depths = {thingy["id"]: -1 for thingy in claude_list}
-    root_node_columns = {}
+    vertices = list(dict.fromkeys(thingy["id"] for thingy in claude_list))
+    position = {vertex: i for i, vertex in enumerate(vertices)}
+    edges = {vertex: [] for vertex in vertices}
+    incoming_edges = {vertex: [] for vertex in vertices}
+    searched_set = {vertex: False for vertex in vertices}
     conn_conp_number = {}
 
     # edge
-    for thingy in claude_list:
-        references = thingy["previous_results"]
-        for reference in references:
-            for thingy2 in claude_list:
-                if (
-                    reference.lower() == thingy2["id"].lower()
-                    or reference.lower() == thingy["name"].lower()
-                ):
-                    G.add_edge(thingy2["id"], thingy["id"])
-                    edges[thingy2["id"]].append(thingy["id"])
-                    incoming_edges[thingy["id"]].append(thingy2["id"])
-
-    conn_comps = []
-
-    def find_conn_comps(vertex):
-        searched_set[vertex] = True
-        comp = [vertex]
-        for next_vertex in edges[vertex] + incoming_edges[vertex]:
-            if not searched_set[next_vertex]:
-                comp.extend(find_conn_comps(next_vertex))
+    resolved_edges, unresolved = resolve_references(claude_list)
+    graph = {"unresolved_references": unresolved}
+    for source, target in resolved_edges:
+        edges[source].append(target)
+        incoming_edges[target].append(source)
+
+    # Reference cycles are collapsed into one component each (and reported),
+    # so everything below works on a DAG of components in topological order
+    component_of, components, component_edges = condensation(
+        len(vertices), [(position[s], position[t]) for s, t in resolved_edges]
+    )
+    graph["cycles"] = [
+        [vertices[v] for v in members] for members in components if len(members) > 1
+    ]
+
+    def find_conn_comps(start):
+        # Depth-first, in the same order the recursive version visited
+        searched_set[start] = True
+        comp = [start]
+        stack = [iter(edges[start] + incoming_edges[start])]
+        while stack:
+            for next_vertex in stack[-1]:
+                if not searched_set[next_vertex]:
+                    searched_set[next_vertex] = True
+                    comp.append(next_vertex)
+                    stack.append(iter(edges[next_vertex] + incoming_edges[next_vertex]))
+                    break
+            else:
+                stack.pop()
         return comp
 
-    for vertex in vertices:
-        if not incoming_edges[vertex]:
-            depths[vertex] = 1
-            root_node_dependencies[vertex] = [vertex]
-        if not searched_set[vertex]:
-            conn_comps.append(find_conn_comps(vertex))
-
-    def assign_max_depths(vertex):
-        if depths[vertex] != -1:
-            return depths[vertex]
-        print(vertex, incoming_edges[vertex], depths[vertex])
-        depths[vertex] = (
-            max(
-                [
-                    assign_max_depths(prev_vertex)
-                    for prev_vertex in incoming_edges[vertex]
-                ]
-            )
-            + 1
-        )
-        return depths[vertex]
-
-    def assign_root_node_dependencies(vertex):
-        if root_node_dependencies[vertex]:
-            return root_node_dependencies[vertex]
-        root_node_dependencies[vertex] = list(
-            set(
-                sum(
-                    [
-                        assign_root_node_dependencies(prev_vertex)
-                        for prev_vertex in incoming_edges[vertex]
-                    ],
-                    [],
-                )
-            )
-        )
-        return root_node_dependencies[vertex]
+    conn_comps = [find_conn_comps(v) for v in vertices if not searched_set[v]]
 
+    # Component edges are sorted by source, and sources come before targets
+    # in topological order, so one pass over them sees every component after
+    # all of its predecessors (Kahn order). Depth is the longest distance
+    # from a root component.
+    component_depths = [1] * len(components)
+    for source, target in component_edges:
+        component_depths[target] = max(
+            component_depths[target], component_depths[source] + 1
+        )
+    is_root = [True] * len(components)
+    for _, target in component_edges:
+        is_root[target] = False
+
+    # Roots get a column within their connected component and a bit index;
+    # root_bits[c] is the set of roots component c depends on
+    root_bits = [0] * len(components)
+    columns = []
     for i, comp in enumerate(conn_comps):
         column = 0
         for vertex in comp:
             conn_conp_number[vertex] = i
-            assign_max_depths(vertex)
-            assign_root_node_dependencies(vertex)
-            if depths[vertex] == 1:
-                root_node_columns[vertex] = column
+            c = component_of[position[vertex]]
+            if is_root[c]:
+                root_bits[c] |= 1 << len(columns)
+                columns.append(column)
                 column += 1
-
-    print(conn_comps)
+    for source, target in component_edges:
+        root_bits[target] |= root_bits[source]
+
+    columns = np.array(columns, dtype=float)
+    n_bytes = (len(columns) + 7) // 8
+    mean_root_columns = [
+        columns[
+            np.unpackbits(
+                np.frombuffer(bits.to_bytes(n_bytes, "little"), dtype=np.uint8),
+                count=len(columns),
+                bitorder="little",
+            ).view(bool)
+        ].mean()
+        for bits in root_bits
+    ]
+    depths = {
+        vertex: component_depths[component_of[position[vertex]]] for vertex in vertices
+    }
 
     # The idea:
     #  - Each connected component has its own space to work in
@@ -128,6 +220,7 @@ def build_graph_conn_comps(claude_list):
     #  - x coordinate determined by connected component and x coordinates of root nodes the theorem depends on
 
     # vertices
+    nodes = {}
     for thingy in claude_list:
 
         title = thingy["id"]
@@ -137,8 +230,7 @@ def build_graph_conn_comps(claude_list):
         statement = thingy["statement"]
         proof = thingy["proof"] if "proof" in thingy else ""
 
-        G.add_node(
-            title,
+        nodes[title] = dict(
             type=type,
             name=name,
             topic=topic,
@@ -146,60 +238,35 @@ def build_graph_conn_comps(claude_list):
             proof=proof,
             x=500
             + conn_conp_number[title] * 600
-            + np.mean(([root_node_columns[x] for x in root_node_dependencies[title]]))
-            * 200,
+            + mean_root_columns[component_of[position[title]]] * 200,
             y=200 * depths[title],
         )
 
     # Convert the graph to node-link JSON format
-    return json_graph.node_link_data(G, edges="links")
+    return node_link_data(graph, resolved_edges, nodes)
 
 
-def build_graph_bfs(claude_list):
-    G = nx.DiGraph()
+def build_graph_bfs(claude_list, layout=DEFAULT_LAYOUT, positions=None):
     # Check no two statements have same title
     # assert(len(list(set([thingy['id'] for thingy in claude_list]))) == len(claude_list))
 
-    # BFS on each tree in forest, set starting y based on depth of each BFS
-    edges = {thingy["id"]: [] for thingy in claude_list}
-    # list of (vertex_id, depth)
-    searched_set = {thingy["id"]: False for thingy in claude_list}
-    depths = {thingy["id"]: -1 for thingy in claude_list}
+    vertices = list(dict.fromkeys(thingy["id"] for thingy in claude_list))
     ancestors = {thingy["id"]: [] for thingy in claude_list}
     descendants = {thingy["id"]: [] for thingy in claude_list}
 
     # edge
-    for thingy in claude_list:
-        references = thingy["previous_results"]
-        for reference in references:
-            for thingy2 in claude_list:
-                if (
-                    reference.lower() == thingy2["id"].lower()
-                    or reference.lower() == thingy["name"].lower()
-                ):
-                    G.add_edge(thingy2["id"], thingy["id"])
-                    edges[thingy2["id"]].append(thingy["id"])
-                    ancestors[thingy["id"]].append(thingy2["id"])
-                    descendants[thingy2["id"]].append(thingy["id"])
-
-    def BFS(vertex):
-        queue = [(vertex, 1)]
-
-        while len(queue) > 0:
-            (current_vertex, current_depth) = queue.pop(0)
-            depths[current_vertex] = current_depth
-
-            for next_vertex in edges[current_vertex]:
-                if searched_set[next_vertex] == False:
-                    searched_set[next_vertex] = True
-                    queue.append((next_vertex, current_depth + 1))
+    resolved_edges, unresolved = resolve_references(claude_list)
+    graph = {"unresolved_references": unresolved}
+    for source, target in resolved_edges:
+        ancestors[target].append(source)
+        descendants[source].append(target)
 
-    for vertex, found in searched_set.items():
-        if not found:
-            searched_set[vertex] = True
-            BFS(vertex)
+    # positions: pinned coordinates of every vertex, e.g. of an edited course
+    if positions is None or set(positions) != set(vertices):
+        positions = LAYOUTS[layout](vertices, resolved_edges)
 
     # vertices
+    nodes = {}
     for thingy in claude_list:
 
         title = thingy["id"]
@@ -209,8 +276,7 @@ def build_graph_bfs(claude_list):
         statement = thingy["statement"]
         proof = thingy["proof"] if "proof" in thingy else ""
 
-        G.add_node(
-            title,
+        nodes[title] = dict(
             type=type,
             name=name,
             topic=topic,
@@ -218,45 +284,156 @@ def build_graph_bfs(claude_list):
             ancestors=ancestors[title],
             descendants=descendants[title],
             proof=proof,
-            x=800 + random.randint(-200, 200),
-            y=200 * depths[thingy["id"]],
+            x=positions[title][0],
+            y=positions[title][1],
         )
 
     # Convert the graph to node-link JSON format
-    return json_graph.node_link_data(G, edges="links")
+    return node_link_data(graph, resolved_edges, nodes)
+
+
+def build_graph(claude_list, layout, positions=None):
+    if layout == "conn_comps":
+        return build_graph_conn_comps(claude_list)
+    return build_graph_bfs(claude_list, layout, positions)
+
+
+def compact_graph(graph):
+    nodes = [
+        {key: node[key] for key in compact_node_keys if key in node}
+        for node in graph["nodes"]
+    ]
+    return dict(graph, nodes=nodes)
+
+
+def graph_response_body(claude_list, layout, compact=False, positions=None, **extra):
+    # extra: further top-level fields of the response
+    start = time.perf_counter()
+    graph = build_graph(claude_list, layout, positions)
+    unresolved = graph["graph"]["unresolved_references"]
+    if compact:
+        # Statements and proofs come from /courses/<name>/theorems instead
+        payload = dict(
+            success=True,
+            compact=True,
+            graph=compact_graph(graph),
+            unresolved_references=unresolved,
+            **extra,
+        )
+    else:
+        payload = dict(
+            success=True,
+            graph=graph,
+            theorem_list=claude_list,
+            unresolved_references=unresolved,
+            **extra,
+        )
+    body = app.json.dumps(payload).encode("utf-8")
+    metrics.graph_build_seconds.observe(
+        time.perf_counter() - start, layout=layout, compact=compact
+    )
+    metrics.graph_payload_bytes.observe(len(body), layout=layout, compact=compact)
+    return body
+
+
+def is_set(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def negotiated_encoding(body):
+    if len(body) < min_size:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def json_bytes_response(body, etag=None, encoding=None):
+    """JSON response for body, answering 304 when the client already has
+    etag. body is either already compressed with encoding or compressed
+    here if the client accepts it."""
+    if encoding is None:
+        encoding = negotiated_encoding(body)
+        if encoding is not None and etag is not None:
+            etag = f"{etag}-{encoding}"
+        compress_here = encoding is not None
+    else:
+        compress_here = False
+
+    if etag is not None and etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        if compress_here:
+            body = compress(body, encoding)
+        response = app.response_class(body, mimetype="application/json")
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+    if etag is not None:
+        response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def cached_course_response(path, variant, build):
+    return cached_courses_response([path], variant, build)
+
+
+def cached_courses_response(paths, variant, build):
+    # Saved courses rarely change, so clients revalidate with If-None-Match
+    body, etag = course_cache.get_many(paths, variant, build)
+    encoding = negotiated_encoding(body)
+    if encoding is None:
+        return json_bytes_response(body, etag)
+    # Compressed once per set of courses, variant and encoding
+    body, etag = course_cache.get_many(
+        paths, (variant, encoding), lambda: compress(body, encoding, best=True)
+    )
+    return json_bytes_response(body, etag, encoding)
 
 
 @app.route("/upload", methods=["POST"])
 # @cross_origin(origin="*", headers=["Content-Type"])
 def pdf_upload():
+    # "conn_comps" or any engine in layout.LAYOUTS
+    layout = request.form.get("layout", DEFAULT_LAYOUT)
+    if layout != "conn_comps" and layout not in LAYOUTS:
+        return jsonify(success=False, message=f"Unknown layout: {layout}"), 400
+    # Compact graphs leave statements and proofs to the theorem endpoints,
+    # so only saved courses can be served compact
+    compact = is_set(request.form.get("compact", False))
+
     if "pdf_file" in request.files:
-        pdf_file = request.files["pdf_file"]
-        pdf_bytes = pdf_file.read()
-        pdf_stream = BytesIO(pdf_bytes)
-        text = extract_text(pdf_stream)
-        if ENV == "PROD":
-            regex_on_theorems(text)
-            get_preconditions()
-            get_big_json()
-            apply_preconditions()
-            cluster_topics()
-            remove_dups()
-        file_path = os.path.join(temp_dir, "final_summary.json")
+        # Runs inline, but in its own workspace so concurrent uploads and
+        # jobs don't overwrite each other's stage files
+        from jobs import new_workspace
+        from pipeline import run_pipeline
+
+        workspace = new_workspace()
+        try:
+            request.files["pdf_file"].save(os.path.join(workspace, "upload.pdf"))
+            run_pipeline(ingestion_stages(), workspace)
+            with open(
+                os.path.join(workspace, "final_summary.json"),
+                "r",
+                encoding="utf-8",
+            ) as file:
+                claude_list = json.load(file)
+        finally:
+            # Not a registered job, so nothing would prune it later
+            shutil.rmtree(workspace, ignore_errors=True)
     else:
         file_path = os.path.join(saved_dir, request.form["saved_file_path"])
+        # A compact graph needs only the skeleton, not statements and proofs
+        return cached_course_response(
+            file_path,
+            (layout, compact),
+            lambda: graph_response_body(
+                course_store.open(file_path).elements(texts=not compact),
+                layout,
+                compact,
+                saved_positions(file_path, layout),
+            ),
+        )
 
-    with open(
-        file_path,
-        "r",
-        encoding="utf-8",
-    ) as file:
-        claude_list = json.load(file)
-
-    json_response = jsonify(
-        success=True,
-        graph=build_graph_bfs(claude_list),
-        theorem_list=claude_list,
-    )
+    json_response = json_bytes_response(graph_response_body(claude_list, layout))
 
     # json_response.headers.add('Access-Control-Allow-Origin', 'http://localhost:5000')
     # json_response.headers.add('Access-Control-Allow-Credentials', 'true')
@@ -264,11 +441,434 @@ def pdf_upload():
     return json_response
 
 
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    if "pdf_file" not in request.files:
+        return jsonify(success=False, message="No pdf_file in request"), 400
+    job_id = ingestion_job_manager().submit(request.files["pdf_file"].read())
+    if job_id is None:
+        return jsonify(success=False, message="Too many jobs queued, retry later"), 503
+    return jsonify(success=True, job_id=job_id), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify(success=False, message=f"Unknown job: {job_id}"), 404
+    workspace = job.pop("workspace")
+    body = app.json.dumps(dict(success=True, **job)).encode("utf-8")
+
+    if job["status"] == "done":
+        layout = request.args.get("layout", DEFAULT_LAYOUT)
+        if layout != "conn_comps" and layout not in LAYOUTS:
+            return jsonify(success=False, message=f"Unknown layout: {layout}"), 400
+        path = os.path.join(workspace, "final_summary.json")
+        result, _ = course_cache.get(
+            path, layout, lambda: graph_response_body(read_json(path), layout)
+        )
+        # Splice the cached graph payload in rather than re-parsing it
+        body = body[:-1] + b', "result": ' + result + b"}"
+    return json_bytes_response(body)
+
+
+@app.route("/jobs/<job_id>/metrics", methods=["GET"])
+def get_job_metrics(job_id):
+    """Per-stage wall time, LLM requests, API errors, parse failures and
+    token usage (prompt cache reads and writes included) of a job."""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify(success=False, message=f"Unknown job: {job_id}"), 404
+    report = metrics.job_report(job["workspace"])
+    return jsonify(success=True, job_id=job_id, status=job["status"], report=report)
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """Server-sent events for a job: "stage", "statements" (graph deltas),
+    "preconditions", "topics", "removed", "layout" (the final positions),
+    then "done" or "failed". A client reconnecting with Last-Event-ID
+    resumes after that event."""
+    log = None if job_manager is None else job_manager.event_log(job_id)
+    if log is None:
+        return jsonify(success=False, message=f"Unknown job: {job_id}"), 404
+    last_event_id = request.headers.get("Last-Event-ID", request.args.get("after"))
+    try:
+        after = max(int(last_event_id or 0), 0)
+    except ValueError:
+        return jsonify(success=False, message="Bad Last-Event-ID"), 400
+
+    def stream(after):
+        while True:
+            events, closed = log.read(after, timeout=event_heartbeat_seconds)
+            if not events and not closed:
+                yield ": keep-alive\n\n"
+                continue
+            for event_id, event, data in events:
+                yield f"id: {event_id}\nevent: {event}\ndata: {app.json.dumps(data)}\n\n"
+            after += len(events)
+            if closed:
+                return
+
+    response = app.response_class(stream(after), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def course_path(name):
+    # Only plain file names inside saved_dir, with or without ".json"
+    if not name.endswith(".json"):
+        name += ".json"
+    if os.path.basename(name) != name or name.startswith("."):
+        return None
+    path = os.path.join(saved_dir, name)
+    return path if os.path.isfile(path) else None
+
+
+def saved_positions(path, layout):
+    # Edits re-place only what they touch; their layout is pinned until the
+    # course changes some other way
+    if layout != "layered":
+        return None
+    return course_editor.pinned_positions(path)
+
+
+def edit_course(name, edits):
+    path = course_path(name)
+    if path is None:
+        return jsonify(success=False, message=f"Unknown course: {name}"), 404
+    try:
+        result = course_editor.apply(path, edits)
+    except EditError as e:
+        return jsonify(success=False, message=str(e)), e.status
+    return jsonify(success=True, course=os.path.basename(path), **result)
+
+
+@app.route("/courses/<name>", methods=["PATCH"])
+def patch_course(name):
+    """Apply {"edits": [...]} to a saved course in order, all or none. Each
+    edit is one of {"op": "add_theorem", "theorem": {...}}, {"op":
+    "update_theorem", "id": ..., "fields": {...}}, {"op": "delete_theorem",
+    "id": ...}, {"op": "add_edge" | "delete_edge", "source": ..., "target":
+    ...}. Answers with the nodes whose data, edges or position changed."""
+    edits = (request.get_json(silent=True) or {}).get("edits")
+    if not isinstance(edits, list):
+        return jsonify(success=False, message="Expected a JSON list of edits"), 400
+    return edit_course(name, edits)
+
+
+@app.route("/courses/<name>/theorems", methods=["POST"])
+def add_theorem(name):
+    return edit_course(
+        name, [{"op": "add_theorem", "theorem": request.get_json(silent=True)}]
+    )
+
+
+@app.route("/courses/<name>/theorems/<path:theorem_id>", methods=["PATCH"])
+def update_theorem(name, theorem_id):
+    fields = request.get_json(silent=True)
+    return edit_course(
+        name, [{"op": "update_theorem", "id": theorem_id, "fields": fields}]
+    )
+
+
+@app.route("/courses/<name>/theorems/<path:theorem_id>", methods=["DELETE"])
+def delete_theorem(name, theorem_id):
+    return edit_course(name, [{"op": "delete_theorem", "id": theorem_id}])
+
+
+@app.route("/courses/<name>/edges", methods=["POST", "DELETE"])
+def edit_edge(name):
+    # {"source": ..., "target": ...}: target depends on source
+    edge = request.get_json(silent=True) or {}
+    op = "add_edge" if request.method == "POST" else "delete_edge"
+    return edit_course(
+        name, [{"op": op, "source": edge.get("source"), "target": edge.get("target")}]
+    )
+
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def theorems_response(name, ids, single):
+    path = course_path(name)
+    if path is None:
+        return jsonify(success=False, message=f"Unknown course: {name}"), 404
+    # Only the requested statements and proofs are read from the course file
+    course = course_store.open(path)
+    etag = hashlib.sha256("\0".join([course.digest] + ids).encode()).hexdigest()[:32]
+
+    def serialized(theorem_id):
+        theorem = course.element(course.position[theorem_id])
+        return app.json.dumps(theorem).encode("utf-8")
+
+    if single:
+        if ids[0] not in course.position:
+            return jsonify(success=False, message=f"Unknown theorem: {ids[0]}"), 404
+        body = b'{"success": true, "theorem": ' + serialized(ids[0]) + b"}"
+        return json_bytes_response(body, etag)
+
+    ids = list(dict.fromkeys(ids))
+    found = [
+        app.json.dumps(theorem_id).encode("utf-8") + b": " + serialized(theorem_id)
+        for theorem_id in ids
+        if theorem_id in course.position
+    ]
+    missing = [theorem_id for theorem_id in ids if theorem_id not in course.position]
+    body = (
+        b'{"success": true, "theorems": {'
+        + b", ".join(found)
+        + b'}, "missing": '
+        + app.json.dumps(missing).encode("utf-8")
+        + b"}"
+    )
+    return json_bytes_response(body, etag)
+
+
+@app.route("/courses/<name>/theorems/<path:theorem_id>", methods=["GET"])
+def get_theorem(name, theorem_id):
+    return theorems_response(name, [theorem_id], single=True)
+
+
+@app.route("/courses/<name>/theorems", methods=["GET"])
+def get_theorems(name):
+    """Batch detail fetch: ?ids=Theorem 1.2,Lemma 3 and/or repeated ?id=."""
+    ids = request.args.getlist("id")
+    for value in request.args.getlist("ids"):
+        ids.extend(theorem_id for theorem_id in value.split(",") if theorem_id)
+    if not ids:
+        return jsonify(success=False, message="No theorem ids given"), 400
+    if len(ids) > max_batch_theorems:
+        return (
+            jsonify(
+                success=False,
+                message=f"At most {max_batch_theorems} theorems per request",
+            ),
+            400,
+        )
+    return theorems_response(name, ids, single=False)
+
+
+def reachability_index(path):
+    # Ids and resolved edges are in the course file's header
+    course = course_store.open(path)
+    return ReachabilityIndex(course.vertices(), course.edges())
+
+
+def course_reachability(name, *arg_names):
+    """(index, ids of the named query args) for a saved course, or an error
+    response."""
+    path = course_path(name)
+    if path is None:
+        return None, (jsonify(success=False, message=f"Unknown course: {name}"), 404)
+    index, _ = course_cache.get(
+        path,
+        "reachability",
+        lambda: reachability_index(path),
+        lambda index: index.nbytes,
+    )
+    ids = []
+    for arg_name in arg_names:
+        theorem_id = request.args.get(arg_name)
+        if theorem_id is None:
+            message = f"Missing query argument: {arg_name}"
+            return None, (jsonify(success=False, message=message), 400)
+        if theorem_id not in index:
+            message = f"Unknown theorem: {theorem_id}"
+            return None, (jsonify(success=False, message=message), 404)
+        ids.append(theorem_id)
+    return (index, *ids), None
+
+
+@app.route("/courses/<name>/prerequisites", methods=["GET"])
+def get_prerequisites(name):
+    """Everything ?id= depends on, transitively, in topological order."""
+    found, error = course_reachability(name, "id")
+    if error:
+        return error
+    index, theorem_id = found
+    return jsonify(
+        success=True, id=theorem_id, prerequisites=index.prerequisites(theorem_id)
+    )
+
+
+@app.route("/courses/<name>/consequences", methods=["GET"])
+def get_consequences(name):
+    """Everything that depends on ?id=, transitively, in topological order."""
+    found, error = course_reachability(name, "id")
+    if error:
+        return error
+    index, theorem_id = found
+    return jsonify(
+        success=True, id=theorem_id, consequences=index.consequences(theorem_id)
+    )
+
+
+@app.route("/courses/<name>/chain", methods=["GET"])
+def get_chain(name):
+    """Shortest dependency chain between ?source= and ?target=, in
+    whichever direction one depends on the other; null if unrelated."""
+    found, error = course_reachability(name, "source", "target")
+    if error:
+        return error
+    index, source, target = found
+    chain = index.shortest_chain(source, target)
+    if chain is None:
+        chain = index.shortest_chain(target, source)
+    return jsonify(success=True, source=source, target=target, chain=chain)
+
+
+@app.route("/courses/<name>/learning_path", methods=["GET"])
+def get_learning_path(name):
+    """Minimal set of results to learn before ?id=, in learning order,
+    skipping ?known= results (comma separated) and what they depend on."""
+    found, error = course_reachability(name, "id")
+    if error:
+        return error
+    index, theorem_id = found
+    known = [k for k in request.args.get("known", "").split(",") if k]
+    return jsonify(
+        success=True,
+        id=theorem_id,
+        learning_path=index.learning_path(theorem_id, known),
+        unknown=[k for k in known if k not in index],
+    )
+
+
+def topic_index(path):
+    # One skeleton per id, as the course file's edges use the first of each
+    course = course_store.open(path)
+    statements = [course.element(k, texts=False) for k in course.position.values()]
+    return TopicIndex(statements, course.edges())
+
+
+def course_topics(name):
+    """(path, topic index) of a saved course, or an error response."""
+    path = course_path(name)
+    if path is None:
+        return None, (jsonify(success=False, message=f"Unknown course: {name}"), 404)
+    index, _ = course_cache.get(
+        path, "topics", lambda: topic_index(path), lambda index: index.nbytes
+    )
+    return (path, index), None
+
+
+@app.route("/courses/<name>/topics", methods=["GET"])
+def get_topics(name):
+    """The course at topic level: one node per topic with its size, links
+    between topics with how many references they stand for. Expand a topic
+    with /courses/<name>/topics/<topic>."""
+    found, error = course_topics(name)
+    if error:
+        return error
+    path, index = found
+    return cached_course_response(
+        path,
+        "topic_graph",
+        lambda: app.json.dumps(
+            dict(success=True, view="topics", graph=index.topic_graph())
+        ).encode("utf-8"),
+    )
+
+
+@app.route("/courses/<name>/topics/<path:topic>", methods=["GET"])
+def get_topic(name, topic):
+    """The statements of one topic (compact, see /courses/<name>/theorems
+    for texts), the references between them and its boundary links to and
+    from other topics."""
+    found, error = course_topics(name)
+    if error:
+        return error
+    path, index = found
+    if topic not in index:
+        return jsonify(success=False, message=f"Unknown topic: {topic}"), 404
+    return cached_course_response(
+        path,
+        ("topic", topic),
+        lambda: app.json.dumps(
+            dict(success=True, topic=topic, **index.expand(topic))
+        ).encode("utf-8"),
+    )
+
+
+def merged_response_body(names, paths, layout, compact):
+    claude_list, cross_links = merge_courses(
+        [
+            (name, course_store.open(path).elements(texts=not compact))
+            for name, path in zip(names, paths)
+        ]
+    )
+    return graph_response_body(
+        claude_list,
+        layout,
+        compact,
+        courses=[course_label(name) for name in names],
+        cross_links=cross_links,
+    )
+
+
+@app.route("/courses/merged", methods=["GET"])
+def get_merged_courses():
+    """One graph of the saved courses given as ?course= (repeated; default
+    all of them). Ids are "<course>::<id>" and links between courses come
+    from shared named results and preconditions; see merge.merge_courses."""
+    layout = request.args.get("layout", DEFAULT_LAYOUT)
+    if layout != "conn_comps" and layout not in LAYOUTS:
+        return jsonify(success=False, message=f"Unknown layout: {layout}"), 400
+    compact = is_set(request.args.get("compact", False))
+    names = request.args.getlist("course") or sorted(
+        file for file in os.listdir(saved_dir) if file.endswith(".json")
+    )
+    paths = []
+    for name in names:
+        path = course_path(name)
+        if path is None:
+            return jsonify(success=False, message=f"Unknown course: {name}"), 404
+        paths.append(path)
+    paths = list(dict.fromkeys(paths))
+    names = [os.path.basename(path) for path in paths]
+    return cached_courses_response(
+        paths,
+        ("merged", tuple(names), layout, compact),
+        lambda: merged_response_body(names, paths, layout, compact),
+    )
+
+
+@app.route("/search", methods=["GET"])
+def search():
+    """Theorems of every saved course matching ?q=, best first. ?course=
+    restricts the search to one course, ?limit= caps the hits."""
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify(success=False, message="Missing query parameter: q"), 400
+    try:
+        limit = min(int(request.args.get("limit", 20)), max_search_results)
+    except ValueError:
+        return jsonify(success=False, message="limit must be an integer"), 400
+    course = request.args.get("course")
+    if course is not None and not course.endswith(".json"):
+        course += ".json"
+    hits = search_index.search(query, limit=max(limit, 0), course=course)
+    return jsonify(success=True, query=query, hits=hits)
+
+
 @app.route("/get_available_courses", methods=["GET"])
 def get_available_courses():
-    files = os.listdir(saved_dir)
-    files = [file for file in files if file.endswith(".json")]
-    return jsonify(files=files)
+    # Node counts, topics, types and modification times from the catalog
+    catalog = course_store.catalog()
+    return jsonify(files=list(catalog), courses=catalog)
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # Prometheus text exposition format
+    return app.response_class(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,504 @@
+"""Benchmarks for the ingestion pipeline.
+
+    python bench.py segmenter [notes.pdf notes.txt ...]
+
+compares the statement segmenter with the regex it replaced: timings on
+the given documents and on synthetic texts of growing size, and whether
+both give identical statements.
+
+    python bench.py preconditions [course.json ...]
+
+scores the local precondition matcher's shortlists against LLM-only
+precondition lists (the last ingestion's summary_preconditions.json and
+the saved courses, whose precondition list is the union of their
+statements' preconditions), and sizes apply_preconditions' batched
+requests against the old one-request-per-statement stage.
+
+    python bench.py course [--sizes 300 1000 3000]
+    python bench.py pipeline [--sizes 300] [--latency 0.2 --failure-rate 0.03]
+
+time the graph builders, remove_dups, regex_on_theorems and /upload round
+trips through the Flask test client on synthetic courses, and a whole
+ingestion against fake_llm's messages server, which answers after
+--latency and fails a share of requests with 429s and 529s. Both record
+their timings in --output (temp/bench_results.json) and exit 1 if any is
+more than --threshold slower than in --baseline, an earlier results file.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+from precondition_matcher import agreement, containment_scores, parse_precondition_list
+from statements import LEGACY_KINDS, STATEMENT_KINDS, segment
+
+# The lookahead regex regex_on_theorems used before statements.segment
+legacy_pattern = re.compile(
+    r"(?m)^(?:(?:Theorem|Proposition|Lemma|Example|Corollary|Definition) \d+.*?)(?=\n\n\n|^Proposition \d+|^Theorem \d+|^Lemma \d+|^Example \d+|^Corollary \d+|^Definition \d+|\Z)",
+    re.DOTALL,
+)
+
+# Synthetic courses: how often each kind of statement occurs, how ids are
+# abbreviated when a statement is restated, and the words texts are made of
+synthetic_kinds = {
+    "Definition": 3,
+    "Lemma": 3,
+    "Theorem": 3,
+    "Proposition": 2,
+    "Corollary": 1,
+    "Example": 1,
+}
+abbreviations = {
+    "Definition": "Def",
+    "Lemma": "Lem",
+    "Theorem": "Thm",
+    "Proposition": "Prop",
+    "Corollary": "Cor",
+    "Example": "Ex",
+}
+synthetic_words = (
+    "the function sequence series space set map operator measure limit bound "
+    "integral derivative norm metric point open closed compact dense finite "
+    "countable continuous uniform linear bounded convergent absolutely "
+    "monotone positive real complex vector subspace basis dimension kernel "
+    "image matrix eigenvalue inner product orthogonal projection partition "
+    "interval neighbourhood cover subsequence supremum infimum every some "
+    "there exists such that for all then hence whenever implies equal to"
+).split()
+condition_subjects = ["f", "g", "x", "A", "T", "u", "the sequence", "the set"]
+condition_predicates = [
+    "continuous on a closed interval",
+    "integrable on a bounded interval",
+    "a bounded linear operator",
+    "uniformly convergent",
+    "a compact subset of a metric space",
+    "differentiable on an open set",
+    "a Cauchy sequence in a complete space",
+    "a monotone bounded sequence",
+    "a measurable function",
+    "a finite dimensional vector space",
+    "a normal subgroup",
+    "a positive definite matrix",
+]
+# Timings are only regressions if they are also this many seconds slower
+min_regression_seconds = 0.005
+
+
+def legacy_statements(text):
+    return [match.strip() for match in legacy_pattern.findall(text)]
+
+
+def best_time(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def read_document(path):
+    if path.lower().endswith(".pdf"):
+        from pdf_text import iter_page_chunks
+
+        return "".join(iter_page_chunks(path))
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def synthetic_text(size, seed_path=os.path.join("temp", "data.json")):
+    # Real statements from the last ingestion, separated like pages of notes
+    with open(seed_path, "r", encoding="utf-8") as f:
+        statements = json.load(f)
+    parts, length, i = [], 0, 0
+    while length < size:
+        part = statements[i % len(statements)]
+        parts.append(part)
+        length += len(part) + 3
+        i += 1
+    return "\n\n\f".join(parts)
+
+
+def bench_segmenter(args):
+    inputs = [(path, read_document(path)) for path in args.documents]
+    inputs += [
+        (f"synthetic {size // 1000} kB", synthetic_text(size))
+        for size in (100_000, 1_000_000, 10_000_000)
+    ]
+    print(f"{'input':<28}{'regex':>10}{'legacy':>10}{'default':>10}  identical")
+    all_identical = True
+    for name, text in inputs:
+        regex_seconds, expected = best_time(legacy_statements, text)
+        legacy_seconds, statements = best_time(segment, text, LEGACY_KINDS)
+        default_seconds, _ = best_time(segment, text, STATEMENT_KINDS)
+        identical = expected == [statement["text"] for statement in statements]
+        all_identical = all_identical and identical
+        print(
+            f"{os.path.basename(name)[:27]:<28}{regex_seconds:>9.3f}s"
+            f"{legacy_seconds:>9.3f}s{default_seconds:>9.3f}s  {identical}"
+        )
+    return 0 if all_identical else 1
+
+
+def precondition_courses(paths):
+    # (name, statements, reference lists, precondition list) per course
+    if not paths:
+        with open(os.path.join("temp", "preconditions.txt"), "r") as f:
+            courses = [
+                (
+                    os.path.join("temp", "summary_preconditions.json"),
+                    parse_precondition_list(f.read()),
+                )
+            ]
+        saved = sorted(os.listdir("saved_course_jsons"))
+        courses += [(os.path.join("saved_course_jsons", name), None) for name in saved]
+    else:
+        courses = [(path, None) for path in paths]
+    for path, preconditions in courses:
+        with open(path, "r", encoding="utf-8") as f:
+            elems = [elem for elem in json.load(f) if "statement" in elem]
+        reference = [list(map(str, elem.get("preconditions") or [])) for elem in elems]
+        if preconditions is None:
+            preconditions = sorted({p for listed in reference for p in listed})
+        statements = [str(elem["statement"]) for elem in elems]
+        yield os.path.basename(path), statements, reference, preconditions
+
+
+def bench_preconditions(args):
+    from claude import precondition_requests, precondition_savings
+
+    print(
+        f"{'course':<28}{'requests':>10}{'calls':>8}{'prompt':>8}"
+        f"{'shortlist P':>13}{'shortlist R':>13}{'seconds':>9}"
+    )
+    for name, statements, reference, preconditions in precondition_courses(
+        args.courses
+    ):
+        seconds, _ = best_time(containment_scores, statements, preconditions)
+        hints, _, requests = precondition_requests(statements, preconditions)
+        savings = precondition_savings(requests, statements, json.dumps(preconditions))
+        # The LLM chooses from the whole list, so only the hints are local
+        local = agreement([[preconditions[c] for c in row] for row in hints], reference)
+        print(
+            f"{name[:27]:<28}{f'{len(requests)}/{len(statements)}':>10}"
+            f"{savings['request_reduction']:>7.1f}x"
+            f"{savings['prompt_reduction']:>7.1f}x{local['precision']:>13.2f}"
+            f"{local['recall']:>13.2f}{seconds:>9.3f}"
+        )
+    return 0
+
+
+def synthetic_course(nodes, references=2.0, depth=8, duplicate_rate=0.05, seed=0):
+    """A saved-course list of nodes statements in depth chapters. Each
+    refers to about references statements of earlier chapters, so no chain
+    of dependencies is longer than depth, and duplicate_rate of them restate
+    an earlier statement, half under its abbreviated id ("Thm. 1.2"), half
+    under a new one."""
+    rng = random.Random(seed)
+    conditions = [
+        f"{subject} is {predicate}"
+        for subject in condition_subjects
+        for predicate in condition_predicates
+    ]
+    conditions = rng.sample(conditions, min(len(conditions), max(8, nodes // 10)))
+
+    def sentence(low, high):
+        return " ".join(rng.choices(synthetic_words, k=rng.randint(low, high))) + "."
+
+    course, originals, numbers = [], [], {}
+    # Statements of the chapters before the current one
+    earlier = []
+    for i in range(nodes):
+        chapter = i * depth // nodes + 1
+        if chapter not in numbers:
+            numbers[chapter] = 0
+            earlier = [elem["id"] for elem in originals]
+        if originals and rng.random() < duplicate_rate:
+            original = rng.choice(originals)
+            kind, number = original["id"].split(" ")
+            if rng.random() < 0.5:
+                id = f"{abbreviations[kind]}. {number}"
+            else:
+                numbers[chapter] += 1
+                id = f"{kind} {chapter}.{numbers[chapter]}"
+            course.append(dict(original, id=id))
+            continue
+
+        kind = rng.choices(list(synthetic_kinds), list(synthetic_kinds.values()))[0]
+        numbers[chapter] += 1
+        required = rng.sample(conditions, rng.randint(0, 3))
+        statement = " ".join(
+            [f"{rng.choice(['Let', 'Suppose', 'Assume'])} {c}." for c in required]
+            + ["Then", sentence(12, 30)]
+        )
+        cited = rng.sample(
+            earlier, min(len(earlier), round(rng.uniform(0, 2 * references)))
+        )
+        proof = ""
+        if kind != "Definition":
+            proof = " ".join(
+                ([f"By {' and '.join(cited)},"] if cited else [])
+                + [sentence(15, 60), "This completes the proof."]
+            )
+        elem = {
+            "type": kind.lower(),
+            "id": f"{kind} {chapter}.{numbers[chapter]}",
+            "name": " ".join(rng.choices(synthetic_words, k=2)).title(),
+            "topic": f"chapter {chapter}",
+            "previous_results": cited,
+            "preconditions": required,
+            "statement": statement,
+            "proof": proof,
+        }
+        course.append(elem)
+        originals.append(elem)
+    return course
+
+
+def synthetic_notes(course):
+    # The lecture notes a course was read from, three statements a page
+    parts = []
+    for k, elem in enumerate(course):
+        header = f"{elem['type'].capitalize()} {elem['id'].split(' ')[-1]}."
+        text = f"{header} {elem['statement']}"
+        if elem["proof"]:
+            text += f"\nProof. {elem['proof']}"
+        parts.append(text + ("\n\f\n" if k % 3 == 2 else "\n\n"))
+    return "".join(parts)
+
+
+def generated_course(args, nodes):
+    return synthetic_course(
+        nodes, args.references, args.depth, args.duplicates, args.seed
+    )
+
+
+def record_results(args, timings, details):
+    """Add the timings and details to the results file, then compare the
+    timings with the baseline. Returns the exit status."""
+    results = {"timings": {}, "details": {}}
+    if os.path.exists(args.output):
+        with open(args.output, "r") as f:
+            results = json.load(f)
+    results["timings"].update(timings)
+    results["details"].update(details)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print("Results written to", args.output)
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)["timings"]
+    regressions = 0
+    for name, seconds in timings.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if (
+            seconds > before * (1 + args.threshold)
+            and seconds - before > min_regression_seconds
+        ):
+            regressions += 1
+            print(f"REGRESSION {name}: {before:.4f}s -> {seconds:.4f}s")
+    print(regressions, "regressions against", args.baseline)
+    return 1 if regressions else 0
+
+
+def bench_course(args):
+    import app
+    from claude import regex_on_theorems, remove_dups
+    from course_store import CourseStore
+    from graph_cache import CourseCache
+
+    # The app serves saved courses from a scratch directory
+    workspace = tempfile.mkdtemp()
+    saved = os.path.join(workspace, "saved")
+    os.makedirs(saved)
+    app.saved_dir = saved
+    app.course_store = CourseStore(os.path.join(workspace, "store"), saved)
+    client = app.app.test_client()
+
+    def upload(name, cold):
+        if cold:
+            app.course_cache = CourseCache(
+                app.graph_cache_bytes, app.course_store.recorded_digest
+            )
+        response = client.post("/upload", data={"saved_file_path": name})
+        if response.status_code != 200:
+            raise RuntimeError(f"/upload answered {response.status_code}")
+        return len(response.data)
+
+    names = [
+        "regex_on_theorems",
+        "build_graph_bfs",
+        "build_graph_conn_comps",
+        "remove_dups",
+        "upload_cold",
+        "upload_warm",
+    ]
+    timings, details = {}, {}
+    rows = []
+    try:
+        for nodes in args.sizes:
+            course = generated_course(args, nodes)
+            notes = synthetic_notes(course)
+            name = f"synthetic_{nodes}.json"
+            with open(os.path.join(saved, name), "w") as f:
+                json.dump(course, f)
+            with open(os.path.join(workspace, "topic_modded_summary.json"), "w") as f:
+                json.dump(course, f)
+            # Converted to a .course file before anything is timed
+            upload(name, cold=True)
+
+            measured = [
+                best_time(regex_on_theorems, notes, workspace, repeat=args.repeat),
+                best_time(app.build_graph_bfs, course, repeat=args.repeat),
+                best_time(app.build_graph_conn_comps, course, repeat=args.repeat),
+                best_time(remove_dups, workspace, repeat=args.repeat),
+                best_time(upload, name, True, repeat=args.repeat),
+                best_time(upload, name, False, repeat=args.repeat),
+            ]
+            for key, (seconds, _) in zip(names, measured):
+                timings[f"course/{nodes}/{key}"] = seconds
+            with open(os.path.join(workspace, "dedup_report.json"), "r") as f:
+                kept = json.load(f)["kept"]
+            details[f"course/{nodes}"] = dict(
+                statements=len(course),
+                segmented=len(json.loads(measured[0][1])),
+                kept_after_dedup=kept,
+                response_bytes=measured[4][1],
+            )
+            rows.append((nodes, [seconds for seconds, _ in measured]))
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f"{'nodes':>7}" + "".join(f"{name:>24}" for name in names))
+    for nodes, seconds in rows:
+        print(f"{nodes:>7}" + "".join(f"{s:>23.4f}s" for s in seconds))
+    return record_results(args, timings, details)
+
+
+def bench_pipeline(args):
+    import llm
+    from claude import regex_on_theorems
+    from fake_llm import FakeMessagesServer, pipeline_reply
+    from llm_cache import LLMCache
+    from pipeline import PIPELINE_STAGES, load_manifest, run_pipeline
+
+    # The LLM stages from data.json on, against a fresh cache and the fake
+    # messages server; the limiter only bounds concurrency
+    stages = [stage for stage in PIPELINE_STAGES if stage.name != "extract_text"]
+    llm.configure(args.concurrency, 10**6, 10**9)
+    os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+    timings, details = {}, {}
+    rows = []
+    for nodes in args.sizes:
+        workspace = tempfile.mkdtemp()
+        server = FakeMessagesServer(
+            args.latency,
+            args.rate_limit_rate,
+            args.retry_after,
+            pipeline_reply,
+            args.seed,
+            args.failure_rate,
+        )
+        try:
+            regex_on_theorems(synthetic_notes(generated_course(args, nodes)), workspace)
+            llm.cache = LLMCache(os.path.join(workspace, "llm_cache.sqlite3"))
+            with server:
+                # Read by every client the stages create
+                os.environ["ANTHROPIC_BASE_URL"] = server.base_url
+                start = time.perf_counter()
+                run_pipeline(stages, workspace)
+                seconds = time.perf_counter() - start
+            manifest = load_manifest(workspace)
+            with open(os.path.join(workspace, "final_summary.json"), "r") as f:
+                statements = len(json.load(f))
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+        timings[f"pipeline/{nodes}/total"] = seconds
+        for stage in stages:
+            timings[f"pipeline/{nodes}/{stage.name}"] = manifest[stage.name]["seconds"]
+        details[f"pipeline/{nodes}"] = dict(
+            latency=args.latency,
+            rate_limit_rate=args.rate_limit_rate,
+            failure_rate=args.failure_rate,
+            concurrency=args.concurrency,
+            requests=server.requests,
+            rate_limited=server.rate_limited,
+            failed=server.failed,
+            statements=statements,
+            statements_per_second=round(statements / seconds, 2),
+        )
+        errors = server.rate_limited + server.failed
+        rows.append((nodes, seconds, server.requests, errors, statements))
+
+    print(
+        f"{'nodes':>7}{'seconds':>10}{'requests':>10}{'errors':>10}"
+        f"{'statements':>12}{'per second':>12}"
+    )
+    for nodes, seconds, requests, errors, statements in rows:
+        print(
+            f"{nodes:>7}{seconds:>9.2f}s{requests:>10}{errors:>10}"
+            f"{statements:>12}{statements / seconds:>12.1f}"
+        )
+    return record_results(args, timings, details)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    segmenter = commands.add_parser(
+        "segmenter", help="statement segmenter against the legacy regex"
+    )
+    segmenter.add_argument("documents", nargs="*", help="PDF or text files")
+    segmenter.set_defaults(run=bench_segmenter)
+    preconditions = commands.add_parser(
+        "preconditions", help="precondition matcher against LLM-only output"
+    )
+    preconditions.add_argument(
+        "courses", nargs="*", help="summaries with LLM-assigned preconditions"
+    )
+    preconditions.set_defaults(run=bench_preconditions)
+
+    # Options of the synthetic courses and of the results file
+    suite = argparse.ArgumentParser(add_help=False)
+    suite.add_argument("--references", type=float, default=2.0)
+    suite.add_argument("--depth", type=int, default=8)
+    suite.add_argument("--duplicates", type=float, default=0.05)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--output", default=os.path.join("temp", "bench_results.json"))
+    suite.add_argument("--baseline", help="results file to compare against")
+    suite.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%"
+    )
+    course = commands.add_parser(
+        "course", parents=[suite], help="graph, dedup and /upload timings"
+    )
+    course.add_argument("--sizes", type=int, nargs="+", default=[300, 1000, 3000])
+    course.add_argument("--repeat", type=int, default=3)
+    course.set_defaults(run=bench_course)
+    pipeline = commands.add_parser(
+        "pipeline", parents=[suite], help="ingestion against a fake LLM"
+    )
+    pipeline.add_argument("--sizes", type=int, nargs="+", default=[300])
+    pipeline.add_argument("--latency", type=float, default=0.2)
+    pipeline.add_argument("--rate-limit-rate", type=float, default=0.02)
+    pipeline.add_argument("--failure-rate", type=float, default=0.03)
+    pipeline.add_argument("--retry-after", type=float, default=0.5)
+    pipeline.add_argument("--concurrency", type=int, default=8)
+    pipeline.set_defaults(run=bench_pipeline)
+    args = parser.parse_args()
+    raise SystemExit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,39 @@
 import ast
+import hashlib
 import json
 import os
 import re
 
-import anthropic
 from json_repair import repair_json
-from tqdm import tqdm
 
-client = anthropic.Anthropic(
-    # defaults to os.environ.get("ANTHROPIC_API_KEY")
-    api_key="",
+import metrics
+from dedup import deduplicate
+from llm import create_message, create_messages, estimate_tokens, request_key
+from precondition_matcher import (
+    agreement,
+    containment_scores,
+    parse_precondition_list,
+    shortlists,
 )
+from references import normalize_reference
+from statements import STATEMENT_KINDS, iter_statements
+
 temp_dir = "temp"
 
 
-def regex_on_theorems(text):
-    def extract_statements(text):
-        pattern = re.findall(
-            r"(?m)^(?:(?:Theorem|Proposition|Lemma|Example|Corollary|Definition) \d+.*?)(?=\n\n\n|^Proposition \d+|^Theorem \d+|^Lemma \d+|^Example \d+|^Corollary \d+|^Definition \d+|\Z)",
-            text,
-            re.DOTALL,
-        )
-        return [match.strip() for match in pattern]
+def regex_on_theorems(text, workspace=temp_dir, kinds=STATEMENT_KINDS):
+    # text can also be an iterable of chunks, consumed as they arrive
+    chunks = [text] if isinstance(text, str) else text
 
-    # Extract theorems, propositions, lemmas, examples, and corollaries
-    flashcards = extract_statements(text)
+    # Extract theorems, propositions, lemmas, examples, corollaries, ...
+    statements = list(iter_statements(chunks, kinds))
+    flashcards = [statement.pop("text") for statement in statements]
 
-    with open(os.path.join(temp_dir, "data.json"), "w", encoding="utf-8") as json_file:
+    with open(os.path.join(workspace, "data.json"), "w", encoding="utf-8") as json_file:
         json.dump(flashcards, json_file, ensure_ascii=False, indent=4)
+    # Kind, number, offsets and page of each entry of data.json
+    with open(os.path.join(workspace, "statements.json"), "w") as json_file:
+        json.dump(statements, json_file, indent=4)
 
     print("Flashcards saved to data.json")
 
@@ -35,9 +41,9 @@ def regex_on_theorems(text):
     return json_string
 
 
-def get_preconditions():
+def get_preconditions(workspace=temp_dir):
 
-    with open(os.path.join(temp_dir, "data.json"), "r", encoding="utf-8") as file:
+    with open(os.path.join(workspace, "data.json"), "r", encoding="utf-8") as file:
         json_data = json.load(file)
 
     # Convert the JSON object to a formatted string
@@ -59,39 +65,130 @@ def get_preconditions():
 
     # print(batch)
 
-    message = client.messages.create(
-        model="claude-3-7-sonnet-20250219",
-        max_tokens=8192,
-        temperature=0,
-        system=[
-            {
-                "type": "text",
-                "text": system_prompt,
-                "cache_control": {"type": "ephemeral"},
-            }
-        ],
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": 'Given all the theorems, propositions, corollaries, and lemmas I\'ve given you, I want you to extract a list of preconditions from all the theorems, propositions, corolloaries, and lemmas as in the examples I gave you. You will need to output a Python list and absolutely nothing else, where each element in the list is a string precondition. For example: ["function on a closed interval", "partition with mesh tending to zero"]. Be as comprehensive as possible, but remember the goal is to find common preconditions among theorems, so if you see a precondition that you think is too specific and won\'t apply to other theorems, exclude it from the final list.',
-                    }
-                ],
-            }
-        ],
+    message = create_message(
+        dict(
+            model="claude-3-7-sonnet-20250219",
+            max_tokens=8192,
+            temperature=0,
+            system=[
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": 'Given all the theorems, propositions, corollaries, and lemmas I\'ve given you, I want you to extract a list of preconditions from all the theorems, propositions, corolloaries, and lemmas as in the examples I gave you. You will need to output a Python list and absolutely nothing else, where each element in the list is a string precondition. For example: ["function on a closed interval", "partition with mesh tending to zero"]. Be as comprehensive as possible, but remember the goal is to find common preconditions among theorems, so if you see a precondition that you think is too specific and won\'t apply to other theorems, exclude it from the final list.',
+                        }
+                    ],
+                }
+            ],
+        )
     )
 
     raw_string = message.content[0].text
 
-    with open(os.path.join(temp_dir, "preconditions.txt"), "w+") as f:
+    with open(os.path.join(workspace, "preconditions.txt"), "w+") as f:
         f.write(raw_string)
 
 
-def get_big_json():
-
-    with open(os.path.join(temp_dir, "data.json"), "r", encoding="utf-8") as file:
+def content_defined_batches(items, batch_size, weight=None, budget=None):
+    """Split items into batches of about batch_size whose boundaries depend
+    only on the items themselves, so inserting or editing one statement
+    changes one batch instead of shifting every later one. With weight and
+    budget, a batch is also cut before its total weight would exceed budget."""
+    batches = []
+    batch = []
+    total = 0
+    for item in items:
+        cost = weight(item) if weight is not None else 0
+        if budget is not None and batch and total + cost > budget:
+            batches.append(batch)
+            batch, total = [], 0
+        batch.append(item)
+        total += cost
+        digest = hashlib.sha256(str(item).encode("utf-8")).digest()
+        if (
+            int.from_bytes(digest[:4], "big") % batch_size == 0
+            or len(batch) >= 2 * batch_size
+        ):
+            batches.append(batch)
+            batch, total = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# get_big_json packs statements into batches whose estimated output fits in
+# summary_output_budget tokens, well under max_tokens since estimates vary
+summary_max_tokens = 8192
+summary_output_budget = 6000
+# Estimated output tokens of one summarized statement: the fields around it
+# plus its text rewritten in LaTeX (~3 characters per token) and escaped
+summary_tokens_per_statement = 120
+summary_tokens_per_char = 0.45
+# Attempts per statement before it is reported as failed; attempts that
+# were cut off at max_tokens and split into smaller batches don't count
+summary_attempts = 3
+summary_keys = ["type", "id", "name", "topic", "previous_results", "statement", "proof"]
+statement_key_pattern = re.compile(r"^\s*([A-Za-z]+)\.?\s+(\d+(?:\.\d+)*)")
+
+
+def estimated_summary_tokens(statement):
+    return summary_tokens_per_statement + int(summary_tokens_per_char * len(statement))
+
+
+def statement_key(statement):
+    # Normalized "kind number" a statement starts with, to match the LLM's ids
+    match = statement_key_pattern.match(statement)
+    return normalize_reference(" ".join(match.groups())) if match else None
+
+
+def salvage_objects(raw_string):
+    """The complete JSON objects in a reply that should be a list of them,
+    even when it was cut off or has a malformed tail. Returns (objects,
+    share of the reply they span)."""
+    clean_string = raw_string.replace("```json\n", "").replace("\n```", "")
+    clean_string = clean_string.replace("\\", "\\\\")
+    decoder = json.JSONDecoder(strict=False)
+    objects = []
+    position = clean_string.find("[") + 1
+    end = 0
+    while True:
+        while position < len(clean_string) and clean_string[position] in " \t\r\n,":
+            position += 1
+        if position >= len(clean_string) or clean_string[position] != "{":
+            break
+        try:
+            elem, position = decoder.raw_decode(clean_string, position)
+        except ValueError:
+            break
+        objects.append(elem)
+        end = position
+    if not objects:
+        # Not a list of objects at all: let json_repair make what it can of it
+        try:
+            repaired = json.loads(repair_json(clean_string), strict=False)
+        except ValueError:
+            return [], 0.0
+        repaired = repaired if isinstance(repaired, list) else [repaired]
+        objects = [
+            elem
+            for elem in repaired
+            if isinstance(elem, dict) and all(key in elem for key in summary_keys)
+        ]
+        end = len(clean_string) if objects else 0
+    return objects, end / max(len(clean_string), 1)
+
+
+def get_big_json(workspace=temp_dir, on_event=None):
+
+    with open(os.path.join(workspace, "data.json"), "r", encoding="utf-8") as file:
         json_data = json.load(file)
 
     # Convert the JSON object to a formatted string
@@ -112,32 +209,26 @@ def get_big_json():
 
     batch_size = 5
 
-    for i in tqdm(range(0, len(json_data), batch_size)):
-
-        batch = str(json_data[i : i + batch_size])
-        # print(batch)
-        not_valid = True
-        repetition_count = 0
-        while not_valid and repetition_count < 3:
-            message = client.messages.create(
-                model="claude-3-7-sonnet-20250219",
-                max_tokens=8192,
-                temperature=0.05,
-                system=[
-                    {
-                        "type": "text",
-                        "text": system_prompt,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ],
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": batch
-                                + """. For each of these theorems provide the following information in this exact JSON format:
+    def summary_request(batch):
+        return dict(
+            model="claude-3-7-sonnet-20250219",
+            max_tokens=summary_max_tokens,
+            temperature=0.05,
+            system=[
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": str(batch)
+                            + """. For each of these theorems provide the following information in this exact JSON format:
                                     [{
                                     "type": "theorem" | "proposition" | "lemma" | "example" | "definition" | "corollary",
                                     "id": "The unique identifier of the statement, exactly as it appears (e.g., \"Lemma 40\", \"Theorem 2.42\")",
@@ -151,70 +242,354 @@ def get_big_json():
                                     }, ...]
 
                                     The final output should be a JSON of a list and nothing else.""",
-                            }
-                        ],
-                    }
-                ],
+                        }
+                    ],
+                }
+            ],
+        )
+
+    # Statement indices, batched on content and on estimated output tokens
+    batches, start = [], 0
+    for batch in content_defined_batches(
+        json_data, batch_size, estimated_summary_tokens, summary_output_budget
+    ):
+        batches.append(list(range(start, start + len(batch))))
+        start += len(batch)
+
+    keys = [statement_key(str(statement)) for statement in json_data]
+    results = [None] * len(json_data)
+    attempts = [0] * len(json_data)
+    outcomes = {}
+    sent = set()
+    totals = dict(
+        requests=0, truncated=0, splits=0, output_tokens=0, discarded_output_tokens=0
+    )
+
+    def parse_batch(j, batch, message):
+        if message is None:
+            outcomes[j] = "unreachable"
+            return
+        raw_string = message.content[0].text if message.content else ""
+        truncated = message.stop_reason == "max_tokens"
+        objects, used = salvage_objects(raw_string)
+        outcomes[j] = "truncated" if truncated else "complete"
+        totals["truncated"] += truncated
+        totals["output_tokens"] += message.usage.output_tokens
+        totals["discarded_output_tokens"] += round(
+            message.usage.output_tokens * (1 - used)
+        )
+        if not objects or not truncated and len(objects) < len(batch):
+            print("Attempt", attempts[batch[0]], "CLAUDE USELESS: ", raw_string)
+            metrics.record_parse_failure()
+
+        # Objects are matched to statements by id. One whose id no statement
+        # starts with takes the next statement no object claims, or else
+        # belongs with the statement before it
+        objects = [elem for elem in objects if isinstance(elem, dict)]
+        ids = [normalize_reference(str(elem.get("id"))) for elem in objects]
+        unmatched = [k for k in batch if results[k] is None]
+        by_key = {}
+        for k in unmatched:
+            by_key.setdefault(keys[k], []).append(k)
+        free = [k for k in unmatched if keys[k] is None or keys[k] not in ids]
+        matched, previous = {}, None
+        for elem, id in zip(objects, ids):
+            # Notes can start several statements with the same id
+            same = by_key.get(id, []) if id is not None else []
+            k = next((k for k in same if k not in matched), same[-1] if same else None)
+            if k is None:
+                k = free.pop(0) if free else previous
+            if k is not None:
+                matched.setdefault(k, []).append(elem)
+                previous = k
+        for k, elems in matched.items():
+            results[k] = elems
+        # Stream each batch out as soon as it has parsed
+        if on_event is not None and matched:
+            on_event(
+                "statements", [elem for elems in matched.values() for elem in elems]
             )
-            try:
-                raw_string = message.content[0].text
-                clean_string = raw_string.replace("```json\n", "").replace("\n```", "")
-                clean_string = clean_string.replace("\\", "\\\\")
-                good_json_string = repair_json(clean_string)
-
-                if good_json_string != "":
-                    theorem_json = json.loads(good_json_string, strict=False)
-                    output = output + theorem_json
-                    not_valid = False
-            except:
-                repetition_count += 1
-                print("Attempt", repetition_count, "CLAUDE USELESS: ", clean_string)
-
-    with open(os.path.join(temp_dir, "summary.json"), "w+") as f:
-        json.dump(output, f, indent=4)
 
+    # Batches go out concurrently. A batch cut off at max_tokens keeps the
+    # objects it completed and its missing statements are split in two;
+    # otherwise only the missing statements are sent again
+    pending = batches
+    while pending:
+        requests = [summary_request([json_data[k] for k in batch]) for batch in pending]
+        # The whole-document system prompt only helps map names back to ids,
+        # so leave it out of the cache key: a batch stays cached when other
+        # parts of the notes are edited
+        cache_keys = [request_key(dict(request, system=None)) for request in requests]
+        for batch in pending:
+            for k in batch:
+                attempts[k] += 1
+        outcomes.clear()
+        create_messages(
+            requests,
+            cache_keys=cache_keys,
+            refresh=[key in sent for key in cache_keys],
+            on_result=lambda j, message: parse_batch(j, pending[j], message),
+        )
+        sent.update(cache_keys)
+        totals["requests"] += len(requests)
+
+        retry = []
+        for j, batch in enumerate(pending):
+            missing = [k for k in batch if results[k] is None]
+            if outcomes.get(j) == "truncated" and len(missing) > 1:
+                totals["splits"] += 1
+                for k in missing:
+                    attempts[k] -= 1
+                half = len(missing) // 2
+                retry += [missing[:half], missing[half:]]
+            else:
+                missing = [k for k in missing if attempts[k] < summary_attempts]
+                if missing:
+                    retry.append(missing)
+        pending = retry
+
+    output = [theorem for result in results if result for theorem in result]
+
+    report = dict(
+        statements=len(json_data),
+        summarized=sum(result is not None for result in results),
+        failed=[
+            dict(index=k, id=keys[k], attempts=attempts[k])
+            for k in range(len(json_data))
+            if results[k] is None
+        ],
+        **totals,
+        per_statement=[
+            dict(
+                index=k,
+                id=keys[k],
+                attempts=attempts[k],
+                entries=len(results[k]) if results[k] is not None else 0,
+            )
+            for k in range(len(json_data))
+        ],
+    )
+    with open(os.path.join(workspace, "summary_report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    if report["failed"]:
+        print(len(report["failed"]), "statements could not be summarized")
+
+    with open(os.path.join(workspace, "summary.json"), "w+") as f:
+        json.dump(output, f, indent=4)
 
-def apply_preconditions():
-    with open(os.path.join(temp_dir, "summary.json"), "r", encoding="utf-8") as file:
-        json_data = json.load(file)
 
-    with open(os.path.join(temp_dir, "preconditions.txt"), "r") as f:
-        preconditions = f.read()
+# Statements sent to the LLM together in one request. Each request carries
+# the precondition list once, in its cached system prompt, where the old
+# stage sent it with every statement: on the saved courses that is 17-20x
+# fewer requests but only 4.5-9x fewer prompt characters (5.4x on the last
+# ingestion), as the statements, sent once either way, are most of what
+# is left. precondition_report.json records both for each run.
+precondition_batch_size = 20
 
-    system_prompt = (
-        """
+precondition_system_prompt = """
     You are a mathematician expert that is going to help me list preconditions to apply various theorems, propositions, corollaries, and lemmas.
-    Here is a list of preconditions: """
-        + preconditions
-        + """. For each theorem I give you, I want you to give me a Python list containing the preconditions required by the theorem. Note you can only use preconditions in the list I just gave you, and your output must be stricly a Python list and nothing else. Here are examples to help you understand what I mean: the preconditions for the theorem \"
+    I will give you a numbered list of preconditions, then numbered statements. For each statement, choose the preconditions from the list that the statement actually requires. Each statement comes with the numbers of the preconditions closest to it in wording, best first; they are only a hint and may be wrong, and any precondition on the list can be chosen. Here are examples to help you understand what I mean: the preconditions for the theorem \"
         Proposition 1.13. Suppose that f is integrable on [a, b]. Then, for any c with a < c < b, f is Riemann integrable on [a, c] and on [c, b]. Moreover R b f = R c f +
         Rb f.\" is a "function is integrable on a closed interval". The precondition for both \"Continuous functions f : [a, b] → R are integrable.\" and \"Lemma 2.3. Suppose that f : [a, b] → R is a continuous function with f > 0 pointwise and R b f = 0. Then f (x) = 0 for x ∈ [a, b].\" is "function is continuous on a closed interval".  The preconditions for \"
         Proposition 3.3. Let f : [a,b] → R be a function. Let P(i), i = 1,2,... be
         a sequence of partitions with mesh(P(i)) → 0. Then f is integrable if and only if
         limi→∞ Σ(f, P(i), ξ⃗(i)) is equal to some constant c, independently of the choice of
-        ξ⃗(i). If this is so, then R b f = c.\" are \"function on a closed interval\" and \"partition with mesh tending to zero\". Note that a precondition may be required by a theorem but not stated in an identical manner so be careful not to miss any preconditions. At the same time, a theorem may use the same words as a precondition but not actually require the precondition, so be careful."""
+        ξ⃗(i). If this is so, then R b f = c.\" are \"function on a closed interval\" and \"partition with mesh tending to zero\". Note that a precondition may be required by a theorem but not stated in an identical manner so be careful not to miss any preconditions. At the same time, a theorem may use the same words as a precondition but not actually require the precondition, so be careful.
+    Your output must be strictly a JSON list with one list of the numbers of the chosen preconditions per statement, in the order of the statements, and nothing else."""
+
+
+def precondition_request(listing, statements, hints):
+    # One request choosing the preconditions of a few statements
+    text = "\n\n".join(
+        f"Statement {n}:\n{statement}\nLikely preconditions: {json.dumps(numbers)}"
+        for n, (statement, numbers) in enumerate(zip(statements, hints), 1)
+    )
+    return dict(
+        model="claude-3-7-sonnet-20250219",
+        max_tokens=8192,
+        temperature=0,
+        system=[
+            {
+                "type": "text",
+                "text": precondition_system_prompt,
+                "cache_control": {"type": "ephemeral"},
+            },
+            # The same list for every request of a course, so cached too
+            {"type": "text", "text": listing, "cache_control": {"type": "ephemeral"}},
+        ],
+        messages=[{"role": "user", "content": [{"type": "text", "text": text}]}],
+    )
+
+
+def precondition_requests(statements, precondition_list):
+    """(shortlists, batches, requests): the matcher's shortlist for each
+    statement, batches of statement positions and a request per batch."""
+    hints = shortlists(containment_scores(statements, precondition_list))
+    listing = "Preconditions:\n" + "\n".join(
+        f"{n}. {precondition}" for n, precondition in enumerate(precondition_list, 1)
+    )
+    batches = [
+        list(range(start, min(start + precondition_batch_size, len(statements))))
+        for start in range(0, len(statements), precondition_batch_size)
+    ]
+    requests = [
+        precondition_request(
+            listing,
+            [statements[k] for k in batch],
+            [[c + 1 for c in hints[k]] for k in batch],
+        )
+        for batch in batches
+    ]
+    return hints, batches, requests
+
+
+def precondition_savings(requests, statements, preconditions):
+    """Requests and prompt size of the batched requests against the old
+    stage's, which sent every statement on its own with the whole
+    precondition list (preconditions, as the LLM listed them) in its
+    prompt."""
+    characters = sum(
+        sum(len(block["text"]) for block in request["system"])
+        + len(request["messages"][0]["content"][0]["text"])
+        for request in requests
     )
+    characters_without = sum(
+        len(precondition_system_prompt) + len(preconditions) + len(statement)
+        for statement in statements
+    )
+    return {
+        "requests": len(requests),
+        "requests_without_batching": len(statements),
+        "request_reduction": round(len(statements) / max(len(requests), 1), 2),
+        "prompt_characters": characters,
+        "prompt_characters_without_batching": characters_without,
+        "prompt_tokens": sum(map(estimate_tokens, requests)),
+        "prompt_tokens_without_batching": sum(
+            (len(precondition_system_prompt) + len(preconditions) + len(s)) // 4 + 1
+            for s in statements
+        ),
+        "prompt_reduction": round(characters_without / max(characters, 1), 2),
+    }
+
+
+def chosen_preconditions(chosen, precondition_list):
+    # The preconditions a reply chose for one statement, by number (or by
+    # their exact text, from a sloppy reply), in list order
+    if not isinstance(chosen, list):
+        raise ValueError("expected a list of precondition numbers")
+    numbers, texts = set(), set()
+    for choice in chosen:
+        if isinstance(choice, int) and not isinstance(choice, bool):
+            numbers.add(choice)
+        elif isinstance(choice, str) and choice.strip().isdigit():
+            numbers.add(int(choice))
+        else:
+            texts.add(str(choice))
+    return [
+        precondition
+        for n, precondition in enumerate(precondition_list, 1)
+        if n in numbers or precondition in texts
+    ]
+
+
+def apply_preconditions(workspace=temp_dir):
+    with open(os.path.join(workspace, "summary.json"), "r", encoding="utf-8") as file:
+        json_data = json.load(file)
+
+    with open(os.path.join(workspace, "preconditions.txt"), "r") as f:
+        preconditions = f.read()
+    precondition_list = parse_precondition_list(preconditions)
 
     n = str(len(json_data))
     print("Starting Claude precondition analysis of " + n + " Statements and nodes")
 
-    batch_size = 1
+    # Every precondition is confirmed by the LLM: statements go in batches,
+    # each pointed at the candidates the local matcher ranks highest
+    indices = [i for i, elem in enumerate(json_data) if "statement" in elem]
+    statements = [str(json_data[i]["statement"]) for i in indices]
+    hints, batches, requests = precondition_requests(statements, precondition_list)
+    print(f"{len(statements)} statements sent to Claude in {len(requests)} requests")
+
+    pending = list(range(len(batches)))
+    for repetition_count in range(1, 4):
+        messages = create_messages(
+            [requests[b] for b in pending], refresh=repetition_count > 1
+        )
+        failed = []
+        for b, message in zip(pending, messages):
+            raw_string = None
+            try:
+                raw_string = message.content[0].text
+                chosen_lists = json.loads(repair_json(raw_string))
+                if not isinstance(chosen_lists, list) or len(chosen_lists) != len(
+                    batches[b]
+                ):
+                    raise ValueError("expected one list per statement")
+                # Parsed whole before any of it is applied
+                chosen_lists = [
+                    chosen_preconditions(chosen, precondition_list)
+                    for chosen in chosen_lists
+                ]
+                for k, chosen in zip(batches[b], chosen_lists):
+                    json_data[indices[k]]["preconditions"] = chosen
+            except Exception:
+                failed.append(b)
+                print("Attempt", repetition_count, "CLAUDE USELESS: ", raw_string)
+                metrics.record_parse_failure()
+        pending = failed
+        if not pending:
+            break
+
+    # Statements of batches that failed every attempt get no preconditions
+    # (nothing unconfirmed goes into the output) and are listed in the report
+    unanswered = {k for b in pending for k in batches[b]}
+    answered = [k for k in range(len(indices)) if k not in unanswered]
+    with open(os.path.join(workspace, "precondition_report.json"), "w") as f:
+        json.dump(
+            {
+                "statements": len(indices),
+                "preconditions": len(precondition_list),
+                "failed_requests": len(pending),
+                "unanswered": [
+                    json_data[indices[k]].get("id") for k in sorted(unanswered)
+                ],
+                **precondition_savings(requests, statements, preconditions),
+                # How well the local matcher alone would have done, taking
+                # its shortlists as the answer: precision/recall against
+                # what the LLM chose for the answered statements
+                "matcher_agreement": agreement(
+                    [[precondition_list[c] for c in hints[k]] for k in answered],
+                    [json_data[indices[k]]["preconditions"] for k in answered],
+                ),
+            },
+            f,
+            indent=4,
+        )
+
+    with open(os.path.join(workspace, "summary_preconditions.json"), "w+") as f:
+        json.dump(json_data, f, indent=4)
+
+
+def cluster_topics(workspace=temp_dir):
+    with open(os.path.join(workspace, "summary_preconditions.json"), "r") as f:
+        data = json.load(f)
+        topics = [elem["topic"].lower() for elem in data if "topic" in elem]
+
+    # Sorted so the prompt (and its cache key) is the same on every run
+    topics = sorted(set(topics))
+    not_valid = True
+    repetition_count = 0
 
-    for i in tqdm(range(0, len(json_data), batch_size)):
-        if "statement" not in json_data[i]:
-            continue
-        batch = str(json_data[i]["statement"])
-        not_valid = True
-        repetition_count = 0
-        while not_valid and repetition_count < 3:
-            message = client.messages.create(
+    while not_valid and repetition_count < 3:
+        message = create_message(
+            dict(
                 model="claude-3-7-sonnet-20250219",
                 max_tokens=8192,
-                temperature=0,
+                temperature=0.05,
                 system=[
                     {
                         "type": "text",
-                        "text": system_prompt,
+                        "text": "You are an experienced mathematician helping me to group topics.",
                         "cache_control": {"type": "ephemeral"},
                     }
                 ],
@@ -224,60 +599,17 @@ def apply_preconditions():
                         "content": [
                             {
                                 "type": "text",
-                                "text": batch,
+                                "text": f"Here is a list of topics from my lecture notes: {str(topics)}. You'll note that some of these topics might have a lot of overlap. As such I want you to cluster these topics into at most 10 synthesized topics and at least 4 synthesized topics that encompass all the topics in my list. You should output a single Python list of tuples where each tuple is a synthesized topic, and a list of all the topics from my original list that fall under the synthesized topic. Note that the lists contained in the second place of each tuple should be pairwise disjoint. Also note your output should be only a Python list and nothing else. ",
                             }
                         ],
                     }
                 ],
-            )
-            try:
-                raw_string = message.content[0].text
-                precondition_list = ast.literal_eval(raw_string)
-                json_data[i]["preconditions"] = precondition_list
-                not_valid = False
-
-            except:
-                repetition_count += 1
-                print("Attempt", repetition_count, "CLAUDE USELESS: ", raw_string)
-
-    with open(os.path.join(temp_dir, "summary_preconditions.json"), "w+") as f:
-        json.dump(json_data, f, indent=4)
-
-
-def cluster_topics():
-    with open(os.path.join(temp_dir, "summary_preconditions.json"), "r") as f:
-        data = json.load(f)
-        topics = [elem["topic"].lower() for elem in data if "topic" in elem]
-
-    topics = list(set(topics))
-    not_valid = True
-    repetition_count = 0
-
-    while not_valid and repetition_count < 3:
-        message = client.messages.create(
-            model="claude-3-7-sonnet-20250219",
-            max_tokens=8192,
-            temperature=0.05,
-            system=[
-                {
-                    "type": "text",
-                    "text": "You are an experienced mathematician helping me to group topics.",
-                    "cache_control": {"type": "ephemeral"},
-                }
-            ],
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"Here is a list of topics from my lecture notes: {str(topics)}. You'll note that some of these topics might have a lot of overlap. As such I want you to cluster these topics into at most 10 synthesized topics and at least 4 synthesized topics that encompass all the topics in my list. You should output a single Python list of tuples where each tuple is a synthesized topic, and a list of all the topics from my original list that fall under the synthesized topic. Note that the lists contained in the second place of each tuple should be pairwise disjoint. Also note your output should be only a Python list and nothing else. ",
-                        }
-                    ],
-                }
-            ],
+            ),
+            # A cached response that failed to parse must not be reused
+            refresh=repetition_count > 0,
         )
 
+        raw_string = None
         try:
             raw_string = message.content[0].text
             print(raw_string)
@@ -291,19 +623,21 @@ def cluster_topics():
                 if "topic" in elem:
                     elem["topic"] = original_topic_to_synthesized[elem["topic"].lower()]
 
-            with open(os.path.join(temp_dir, "topic_modded_summary.json"), "w+") as f:
+            with open(os.path.join(workspace, "topic_modded_summary.json"), "w+") as f:
                 json.dump(data, f, indent=4)
             not_valid = False
         except Exception as e:
             repetition_count += 1
             print("Attempt", repetition_count, "CLAUDE USELESS: ", raw_string)
+            metrics.record_parse_failure()
 
 
-def remove_dups():
-    with open(os.path.join(temp_dir, "topic_modded_summary.json"), "r") as f:
+def remove_dups(workspace=temp_dir, merge_policy=None):
+    with open(os.path.join(workspace, "topic_modded_summary.json"), "r") as f:
         data = json.load(f)
 
     final_elems = []
+    incomplete = []
     required_keys = [
         "type",
         "id",
@@ -322,19 +656,21 @@ def remove_dups():
                 break
         if not ignore:
             final_elems.append(elem)
+        else:
+            incomplete.append(elem.get("id"))
 
-    final_final_elems = []
+    # Same statement under normalized-equal ids or near-identical wording
+    final_final_elems, merges = deduplicate(final_elems, merge_policy)
 
-    for elem in final_elems:
-        found = False
-        for i, elem2 in enumerate(final_final_elems):
-            if elem2["id"] == elem["id"]:
-                found = True
-                if len(elem["proof"]) > len(elem2["proof"]):
-                    final_final_elems[i] = elem
-                break
-        if not found:
-            final_final_elems.append(elem)
-
-    with open(os.path.join(temp_dir, "final_summary.json"), "w+") as f:
+    with open(os.path.join(workspace, "final_summary.json"), "w+") as f:
         json.dump(final_final_elems, f, indent=4)
+
+    report = {
+        "entries": len(data),
+        "incomplete": incomplete,
+        "kept": len(final_final_elems),
+        "merged": merges,
+    }
+    with open(os.path.join(workspace, "dedup_report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"{len(final_final_elems)} of {len(data)} entries kept, {len(merges)} merged")
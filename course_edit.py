@@ -0,0 +1,530 @@
+"""Edits to saved courses, applied to a live copy of the course's graph.
+
+An EditableCourse holds a course's statements, its reference index, the
+resolved edges and the layered layout. An edit re-resolves only the
+references whose index keys it touched, re-layers only the statements
+downstream of edges that changed and places only the statements that are
+new or changed layer; every other statement keeps its coordinates. The
+course JSON is then replaced atomically and the positions are pinned in a
+side file, so the next full load of the course serves the same picture.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import threading
+
+from layout import layered_layout, x_center, x_spacing, y_spacing
+from references import normalize_reference, split_reference
+
+# Fields a theorem added without them gets
+theorem_defaults = {
+    "type": "theorem",
+    "name": "",
+    "topic": "",
+    "previous_results": [],
+    "preconditions": [],
+    "statement": "",
+    "proof": "",
+}
+
+
+class EditError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def reference_keys(reference):
+    # The index keys resolve_reference tries, in order
+    keys = [reference, normalize_reference(reference)]
+    split = split_reference(reference)
+    if split is not None:
+        keys.append(split[0])
+    return keys
+
+
+def check_theorem(thingy):
+    # Ids and names go into the reference index, previous_results is walked
+    if not isinstance(thingy.get("id"), str):
+        raise EditError("A theorem id must be a string")
+    if not isinstance(thingy.get("name", ""), str):
+        raise EditError("A theorem name must be a string")
+    if not isinstance(thingy.get("previous_results", []), list):
+        raise EditError("previous_results must be a list")
+    return thingy
+
+
+def write_atomically(path, data):
+    # Written beside the target and renamed over it, so readers see the old
+    # file or the new one; the .tmp suffix keeps it out of *.json listings
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class EditableCourse:
+    """A course's graph kept up to date under edits. Statement ids must be
+    unique. Edges follow resolve_references: the index claims of raw ids,
+    then normalized ids, then names, the earliest statement winning each
+    key."""
+
+    def __init__(self, claude_list, positions=None):
+        self.elems = {}
+        self.order = {}
+        for thingy in claude_list:
+            if thingy["id"] in self.elems:
+                raise EditError(
+                    f"Duplicate id {thingy['id']!r}; fix the course file first", 409
+                )
+            self.order[thingy["id"]] = len(self.order)
+            self.elems[thingy["id"]] = thingy
+        self.next_order = len(self.order)
+
+        # key -> sorted claims (layer, order, id); the first one wins
+        self.claims = {}
+        for id in self.elems:
+            for key, claim in self.index_claims(id):
+                self.claims.setdefault(key, []).append(claim)
+        for claimed in self.claims.values():
+            claimed.sort()
+        # key -> ids of statements with a reference that tries it
+        self.lookups = {}
+        self.keys_tried = {}
+        self.predecessors = {id: {} for id in self.elems}
+        self.successors = {id: {} for id in self.elems}
+        self.unresolved = {}
+        for id in self.elems:
+            self.resolve(id)
+
+        if positions is None or set(positions) != set(self.elems):
+            positions = layered_layout(list(self.elems), self.edges())
+        self.positions = {id: tuple(position) for id, position in positions.items()}
+        self.layers = {
+            id: round(y / y_spacing) for id, (_, y) in self.positions.items()
+        }
+        self.acyclic = self.layers_follow_edges()
+        # layer -> x coordinates in order and the ids at them
+        self.rows = {}
+        for id in self.elems:
+            self.row_insert(id)
+
+    def edges(self):
+        return [
+            (source, target)
+            for target in self.elems
+            for source in self.predecessors[target]
+        ]
+
+    def layers_follow_edges(self):
+        # False if the course has a cycle, which longest_path_layers breaks
+        # with a choice that depends on the whole graph
+        return all(self.layers[s] < self.layers[t] for s, t in self.edges())
+
+    def index_claims(self, id):
+        thingy, order = self.elems[id], self.order[id]
+        claims = [(id, (0, order, id)), (normalize_reference(id), (1, order, id))]
+        if thingy.get("name"):
+            claims.append((normalize_reference(thingy["name"]), (2, order, id)))
+        return claims
+
+    def winner(self, key):
+        claimed = self.claims.get(key)
+        return claimed[0][2] if claimed else None
+
+    def lookup(self, reference):
+        for key in reference_keys(reference):
+            source = self.winner(key)
+            if source is not None:
+                return source
+        return None
+
+    def resolve(self, id):
+        """Resolve id's references again and update its in-edges. Returns
+        the sources of the edges removed and added."""
+        for key in self.keys_tried.pop(id, ()):
+            self.lookups[key].discard(id)
+        sources, unresolved, keys = {}, [], set()
+        for reference in self.elems[id].get("previous_results", []):
+            keys.update(reference_keys(str(reference)))
+            source = self.lookup(str(reference))
+            if source is None:
+                unresolved.append(reference)
+            elif source != id:
+                sources[source] = None
+        for key in keys:
+            self.lookups.setdefault(key, set()).add(id)
+        self.keys_tried[id] = keys
+        self.unresolved[id] = unresolved
+
+        old = self.predecessors[id]
+        removed = [source for source in old if source not in sources]
+        added = [source for source in sources if source not in old]
+        for source in removed:
+            del self.successors[source][id]
+        for source in added:
+            self.successors[source][id] = None
+        self.predecessors[id] = sources
+        return removed, added
+
+    def set_elements(self, changes, changed):
+        """Replace, add (new id) or delete (None) statements, keeping the
+        index and edges up to date. Adds to changed: "elements" (ids whose
+        statement changed), "edges" (targets whose in-edges changed),
+        "links" (edge changes) and "removed"."""
+        touched_keys = set()
+        for id, thingy in changes.items():
+            if id in self.elems:
+                for key, claim in self.index_claims(id):
+                    self.claims[key].remove(claim)
+                    touched_keys.add(key)
+            if thingy is None:
+                continue
+            if id not in self.elems:
+                self.order[id] = self.next_order
+                self.next_order += 1
+                self.predecessors[id] = {}
+                self.successors[id] = {}
+            self.elems[id] = thingy
+            for key, claim in self.index_claims(id):
+                bisect.insort(self.claims.setdefault(key, []), claim)
+                touched_keys.add(key)
+
+        stale = {id for id, thingy in changes.items() if thingy is not None}
+        for id, thingy in changes.items():
+            if thingy is not None or id not in self.elems:
+                continue
+            for source in self.predecessors.pop(id):
+                del self.successors[source][id]
+                changed["links"].append(("removed", source, id))
+            # Dependants lose the edge now and may resolve elsewhere below
+            for target in self.successors.pop(id):
+                del self.predecessors[target][id]
+                changed["links"].append(("removed", id, target))
+                changed["edges"].add(target)
+                stale.add(target)
+            for key in self.keys_tried.pop(id, ()):
+                self.lookups[key].discard(id)
+            self.row_remove(id)
+            del self.elems[id], self.order[id], self.unresolved[id]
+            self.layers.pop(id, None)
+            changed["removed"].add(id)
+            changed["elements"].discard(id)
+            changed["edges"].discard(id)
+
+        for key in touched_keys:
+            stale.update(self.lookups.get(key, ()))
+        for id in stale:
+            if id not in self.elems:
+                continue
+            removed, added = self.resolve(id)
+            for source in removed:
+                changed["links"].append(("removed", source, id))
+            for source in added:
+                changed["links"].append(("added", source, id))
+            if removed or added or id not in self.positions:
+                changed["edges"].add(id)
+        changed["elements"].update(id for id in changes if id in self.elems)
+
+    def relayer(self, dirty):
+        """Recompute the layers of dirty statements and everything
+        downstream of them, and place those that are new or changed layer.
+        Returns the ids that moved, or None if the layout was redone from
+        scratch because the course contains a cycle."""
+        downstream, stack = set(), [id for id in dirty if id in self.elems]
+        while stack:
+            id = stack.pop()
+            if id not in downstream:
+                downstream.add(id)
+                stack.extend(self.successors[id])
+
+        # Kahn's algorithm inside the downstream set; statements outside it
+        # keep their layers
+        pending = {
+            id: sum(source in downstream for source in self.predecessors[id])
+            for id in downstream
+        }
+        ready = sorted(
+            (id for id, count in pending.items() if count == 0), key=self.order.get
+        )
+        ordered = []
+        while ready:
+            id = ready.pop()
+            ordered.append(id)
+            for target in self.successors[id]:
+                pending[target] -= 1
+                if pending[target] == 0:
+                    ready.append(target)
+        if not self.acyclic or len(ordered) < len(downstream):
+            self.relayout()
+            return None
+
+        layers = {}
+        for id in ordered:
+            layers[id] = 1 + max(
+                (layers.get(s, self.layers.get(s)) for s in self.predecessors[id]),
+                default=0,
+            )
+        moved = [
+            id
+            for id in ordered
+            if id not in self.positions or layers[id] != self.layers[id]
+        ]
+        for id in moved:
+            self.row_remove(id)
+        for id in moved:
+            # Over the mean x of its predecessors, at the nearest free slot
+            xs = [self.positions[s][0] for s in self.predecessors[id]]
+            desired = sum(xs) / len(xs) if xs else x_center
+            self.layers[id] = layers[id]
+            self.positions[id] = (
+                self.free_slot(layers[id], desired),
+                y_spacing * layers[id],
+            )
+            self.row_insert(id)
+        return moved
+
+    def relayout(self):
+        self.positions = layered_layout(list(self.elems), self.edges())
+        self.layers = {
+            id: round(y / y_spacing) for id, (_, y) in self.positions.items()
+        }
+        self.acyclic = self.layers_follow_edges()
+        self.rows = {}
+        for id in self.elems:
+            self.row_insert(id)
+
+    def row_insert(self, id):
+        xs, ids = self.rows.setdefault(self.layers[id], ([], []))
+        i = bisect.bisect(xs, self.positions[id][0])
+        xs.insert(i, self.positions[id][0])
+        ids.insert(i, id)
+
+    def row_remove(self, id):
+        if id not in self.positions:
+            return
+        xs, ids = self.rows[self.layers[id]]
+        i = bisect.bisect_left(xs, self.positions[id][0])
+        while ids[i] != id:
+            i += 1
+        del xs[i], ids[i]
+        del self.positions[id]
+
+    def free_slot(self, layer, desired):
+        """The x nearest desired at least x_spacing from every statement
+        already in the layer."""
+        xs = self.rows.get(layer, ([], []))[0]
+        i = bisect.bisect(xs, desired)
+        right, j = desired, i
+        if j > 0:
+            right = max(right, xs[j - 1] + x_spacing)
+        while j < len(xs) and xs[j] - right < x_spacing:
+            right = xs[j] + x_spacing
+            j += 1
+        left, j = desired, i
+        if j < len(xs):
+            left = min(left, xs[j] - x_spacing)
+        while j > 0 and left - xs[j - 1] < x_spacing:
+            left = xs[j - 1] - x_spacing
+            j -= 1
+        return float(left if desired - left < right - desired else right)
+
+    def node(self, id):
+        # As build_graph_bfs writes it
+        thingy = self.elems[id]
+        return {
+            "type": thingy["type"],
+            "name": thingy["name"],
+            "topic": thingy["topic"],
+            "statement": thingy["statement"],
+            "ancestors": list(self.predecessors[id]),
+            "descendants": list(self.successors[id]),
+            "proof": thingy.get("proof", ""),
+            "x": self.positions[id][0],
+            "y": self.positions[id][1],
+            "id": id,
+        }
+
+    def operation_changes(self, edit):
+        """The statement changes one edit makes, as {id: statement or None}."""
+        op = edit.get("op")
+        if op == "add_theorem":
+            thingy = edit.get("theorem")
+            if not isinstance(thingy, dict):
+                raise EditError("add_theorem needs a theorem")
+            thingy = check_theorem(dict(theorem_defaults, **thingy))
+            if thingy["id"] in self.elems:
+                raise EditError(f"Theorem already exists: {thingy['id']}", 409)
+            return {thingy["id"]: thingy}
+        if op in ("update_theorem", "delete_theorem"):
+            id = edit.get("id")
+            if not isinstance(id, str):
+                raise EditError("A theorem id must be a string")
+            if id not in self.elems:
+                raise EditError(f"Unknown theorem: {id}", 404)
+            if op == "delete_theorem":
+                return {id: None}
+            fields = edit.get("fields")
+            if not isinstance(fields, dict) or fields.get("id", id) != id:
+                raise EditError("update_theorem needs fields, and ids can't change")
+            return {id: check_theorem(dict(self.elems[id], **fields))}
+        if op in ("add_edge", "delete_edge"):
+            source, target = edit.get("source"), edit.get("target")
+            for id in (source, target):
+                if not isinstance(id, str):
+                    raise EditError("source and target must be theorem ids")
+                if id not in self.elems:
+                    raise EditError(f"Unknown theorem: {id}", 404)
+            references = list(self.elems[target].get("previous_results", []))
+            if op == "add_edge":
+                if source == target:
+                    raise EditError("A theorem can't depend on itself")
+                if source in self.predecessors[target]:
+                    return {}
+                references.append(source)
+            else:
+                kept = [r for r in references if self.lookup(str(r)) != source]
+                if len(kept) == len(references):
+                    raise EditError(f"No edge from {source} to {target}", 404)
+                references = kept
+            return {target: dict(self.elems[target], previous_results=references)}
+        raise EditError(f"Unknown edit op: {op}")
+
+    def apply(self, edits):
+        """Apply a list of edits (dicts with an "op") in order. Returns what
+        changed for the response. After an EditError the course is left
+        half edited and must be reloaded."""
+        changed = self.new_changes()
+        for edit in edits:
+            if not isinstance(edit, dict):
+                raise EditError("Each edit must be an object")
+            self.set_elements(self.operation_changes(edit), changed)
+
+        moved, nodes, links_added, links_removed = self.settle(changed)
+        return dict(
+            relayout="local" if moved is not None else "full",
+            nodes=[self.node(id) for id in nodes],
+            removed=sorted(changed["removed"] - set(self.elems)),
+            links_added=[{"source": s, "target": t} for s, t in links_added],
+            links_removed=[{"source": s, "target": t} for s, t in links_removed],
+            unresolved_references=[
+                {"id": id, "reference": reference}
+                for id in nodes
+                for reference in self.unresolved[id]
+            ],
+        )
+
+    def put(self, statements):
+        """Add statements, replacing those whose id is already here, as one
+        batch, e.g. as they stream in. Returns what settle returns."""
+        changed = self.new_changes()
+        self.set_elements({thingy["id"]: thingy for thingy in statements}, changed)
+        return self.settle(changed)
+
+    @staticmethod
+    def new_changes():
+        # What set_elements records across a batch
+        return {"elements": set(), "edges": set(), "links": [], "removed": set()}
+
+    def settle(self, changed):
+        """Re-layer after a batch of set_elements. Returns the ids that
+        moved (None after a full relayout), the ids whose data, edges or
+        position changed, and the edges added and removed."""
+        moved = self.relayer(changed["edges"])
+        if moved is None:
+            nodes = list(self.elems)
+        else:
+            nodes = set(moved) | changed["elements"] | changed["edges"]
+            for _, source, target in changed["links"]:
+                nodes.update((source, target))
+            nodes = sorted((id for id in nodes if id in self.elems), key=self.order.get)
+        links = {}
+        for change, source, target in changed["links"]:
+            # An edge removed and added back within the batch is unchanged
+            links[(source, target)] = links.get((source, target), 0) + (
+                1 if change == "added" else -1
+            )
+        links_added = [
+            (s, t)
+            for (s, t), count in links.items()
+            if count > 0 and t in self.elems and s in self.elems
+        ]
+        links_removed = [(s, t) for (s, t), count in links.items() if count < 0]
+        return moved, nodes, links_added, links_removed
+
+
+class CourseEditor:
+    """EditableCourses for the JSON courses in courses_dir, loaded on their
+    first edit and reloaded if their file changes behind the editor's back.
+    Positions of edited courses are pinned in positions_dir."""
+
+    def __init__(self, courses_dir, positions_dir, digest=None):
+        self.courses_dir = courses_dir
+        self.positions_dir = positions_dir
+        # digest(path) -> the SHA-256 of a course file, e.g. from the store
+        self.digest = digest or self.file_digest
+        self.courses = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_digest(path):
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def positions_path(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.positions_dir, name + ".json")
+
+    def pinned_positions(self, path):
+        """The layered positions of a course edited here, if the course has
+        not changed since; None otherwise."""
+        try:
+            with open(self.positions_path(path), "r") as f:
+                pinned = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if pinned["digest"] != self.digest(path):
+            return None
+        return {id: tuple(position) for id, position in pinned["positions"].items()}
+
+    def course(self, path):
+        stat = os.stat(path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        loaded = self.courses.get(path)
+        if loaded is not None and loaded[0] == fingerprint:
+            return loaded[1]
+        with open(path, "r", encoding="utf-8") as f:
+            claude_list = json.load(f)
+        course = EditableCourse(claude_list, self.pinned_positions(path))
+        self.courses[path] = (fingerprint, course)
+        return course
+
+    def apply(self, path, edits):
+        """Apply edits to the course at path and persist it. Raises
+        EditError (with an HTTP status) if any edit is invalid, in which
+        case nothing changes."""
+        with self.lock:
+            course = self.course(path)
+            try:
+                result = course.apply(edits)
+                data = json.dumps(list(course.elems.values()), indent=4)
+                data = data.encode("utf-8")
+                write_atomically(path, data)
+            except Exception:
+                # The course may be half edited; the file still has it as it
+                # was before this batch, so it is reloaded from there
+                del self.courses[path]
+                raise
+            digest = hashlib.sha256(data).hexdigest()
+            os.makedirs(self.positions_dir, exist_ok=True)
+            write_atomically(
+                self.positions_path(path),
+                json.dumps(dict(digest=digest, positions=course.positions)).encode(),
+            )
+            stat = os.stat(path)
+            self.courses[path] = ((stat.st_mtime_ns, stat.st_size), course)
+            return dict(result, digest=digest)
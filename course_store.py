@@ -0,0 +1,346 @@
+"""Compact on-disk format for saved courses.
+
+A .course file holds a small JSON header (metadata, key orders, where each
+section starts), then 8-byte aligned sections: packed string tables for
+the ids, names, types, topics, the other fields, statements and proofs,
+the resolved edges and each statement's key order. Files are
+memory-mapped, so opening a course parses only the header, every value is
+decoded when asked for, and every server process shares the same pages.
+
+    python course_store.py [build]          convert every saved course
+    python course_store.py export NAME OUT  write a course back as JSON
+    python course_store.py verify           check both directions agree
+"""
+
+import argparse
+import functools
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from references import resolve_references
+
+# magic, header length
+prefix = struct.Struct("<8sQ")
+magic = b"COURSE02"
+# Fields stored as string tables of their own, the rest of each statement
+# is stored as one JSON object in the "other" table
+column_fields = ["id", "name", "type", "topic"]
+text_fields = ["statement", "proof"]
+# How a string table stores a value: its UTF-8 bytes, or JSON for
+# anything that isn't a string (including a missing field, as null)
+raw_kind, json_kind = 0, 1
+# The catalog re-scans the courses directory at least this often
+catalog_refresh_interval = 5.0
+
+
+def pack_strings(values):
+    """Kinds, end offsets and concatenated bytes of values, a string
+    table from which any one value can be decoded alone."""
+    kinds = np.zeros(len(values), dtype="u1")
+    data = []
+    for k, value in enumerate(values):
+        if isinstance(value, str):
+            data.append(value.encode("utf-8"))
+        else:
+            kinds[k] = json_kind
+            data.append(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    ends = np.cumsum([len(item) for item in data], dtype="<u8")
+    return kinds, ends, b"".join(data)
+
+
+def write_course(json_path, store_path):
+    stat = os.stat(json_path)
+    with open(json_path, "rb") as f:
+        raw = f.read()
+    claude_list = json.loads(raw)
+
+    key_orders = {}
+    key_order = []
+    tables = {field: [] for field in column_fields + text_fields + ["other"]}
+    for thingy in claude_list:
+        key_order.append(key_orders.setdefault(tuple(thingy), len(key_orders)))
+        for field in column_fields + text_fields:
+            tables[field].append(thingy.get(field))
+        tables["other"].append(
+            {
+                key: value
+                for key, value in thingy.items()
+                if key not in column_fields and key not in text_fields
+            }
+        )
+
+    # Edges as (source, target) positions of the first statement with each id
+    position = {}
+    for k, thingy in enumerate(claude_list):
+        position.setdefault(thingy["id"], k)
+    edges, unresolved = resolve_references(claude_list)
+    sections = {
+        "edges": np.array(
+            [(position[source], position[target]) for source, target in edges],
+            dtype="<i4",
+        ).reshape(-1, 2),
+        "key_order": np.array(key_order, dtype="<u4"),
+    }
+    for field, values in tables.items():
+        kinds, ends, data = pack_strings(values)
+        sections[field + ".kinds"] = kinds
+        sections[field + ".ends"] = ends
+        sections[field + ".data"] = np.frombuffer(data, dtype="u1")
+
+    topics = {}
+    types = {}
+    for thingy in claude_list:
+        if "topic" in thingy:
+            topics[thingy["topic"]] = topics.get(thingy["topic"], 0) + 1
+        types[thingy.get("type")] = types.get(thingy.get("type"), 0) + 1
+    # Sections start at these offsets after the header, 8-byte aligned
+    layout = {}
+    end = 0
+    for name, array in sections.items():
+        end += -end % 8
+        layout[name] = [array.dtype.str, end, array.size]
+        end += array.nbytes
+    header = dict(
+        json=dict(mtime_ns=stat.st_mtime_ns, size=len(raw)),
+        digest=hashlib.sha256(raw).hexdigest(),
+        metadata=dict(
+            nodes=len(claude_list),
+            edges=len(edges),
+            unresolved_references=len(unresolved),
+            topics=topics,
+            types=types,
+            modified=stat.st_mtime,
+            size=len(raw),
+        ),
+        key_orders=[list(keys) for keys in key_orders],
+        unresolved_references=unresolved,
+        sections=layout,
+    )
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    header_bytes += b" " * (-(prefix.size + len(header_bytes)) % 8)
+
+    os.makedirs(os.path.dirname(store_path) or ".", exist_ok=True)
+    temporary = f"{store_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(prefix.pack(magic, len(header_bytes)))
+        f.write(header_bytes)
+        written = 0
+        for name, array in sections.items():
+            f.write(b"\0" * (layout[name][1] - written))
+            f.write(array.tobytes())
+            written = layout[name][1] + array.nbytes
+    os.replace(temporary, store_path)
+
+
+class Course:
+    """A memory-mapped .course file. Opening it parses only the header;
+    ids, the other fields and texts are decoded from the mapping when asked
+    for."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, header_length = prefix.unpack_from(self.buffer)
+        if file_magic != magic:
+            raise ValueError(f"Not a course file: {path}")
+        start = prefix.size + header_length
+        header = json.loads(self.buffer[prefix.size : start])
+        # Where each section starts in the mapping, and its array
+        self.starts = {}
+        self.arrays = {}
+        for name, (dtype, offset, size) in header["sections"].items():
+            self.starts[name] = start + offset
+            self.arrays[name] = np.frombuffer(self.buffer, dtype, size, start + offset)
+        self.edge_array = self.arrays["edges"].reshape(-1, 2)
+        self.key_order = self.arrays["key_order"]
+
+        self.fingerprint = (header["json"]["mtime_ns"], header["json"]["size"])
+        self.digest = header["digest"]
+        self.metadata = header["metadata"]
+        self.key_orders = header["key_orders"]
+        self.unresolved_references = header["unresolved_references"]
+
+    def __len__(self):
+        return len(self.key_order)
+
+    def value(self, field, k):
+        # Value k of one of the string tables
+        ends = self.arrays[field + ".ends"]
+        start = self.starts[field + ".data"]
+        data = self.buffer[
+            start + (int(ends[k - 1]) if k else 0) : start + int(ends[k])
+        ]
+        if self.arrays[field + ".kinds"][k] == raw_kind:
+            return data.decode("utf-8")
+        return json.loads(data)
+
+    @functools.cached_property
+    def ids(self):
+        if self.arrays["id.kinds"].any():
+            return [self.value("id", k) for k in range(len(self))]
+        # All strings: decode the table in one pass
+        ends = self.arrays["id.ends"].tolist()
+        start = self.starts["id.data"]
+        data = self.buffer[start : start + (ends[-1] if ends else 0)]
+        return [data[a:b].decode("utf-8") for a, b in zip([0] + ends[:-1], ends)]
+
+    @functools.cached_property
+    def position(self):
+        position = {}
+        for k, id in enumerate(self.ids):
+            position.setdefault(id, k)
+        return position
+
+    def element(self, k, texts=True):
+        """Statement k as in the JSON file. With texts=False its statement
+        and proof are empty strings and they are not decoded."""
+        elem = {}
+        other = None
+        for key in self.key_orders[self.key_order[k]]:
+            if key in column_fields:
+                elem[key] = self.ids[k] if key == "id" else self.value(key, k)
+            elif key in text_fields:
+                elem[key] = self.value(key, k) if texts else ""
+            else:
+                if other is None:
+                    other = self.value("other", k)
+                elem[key] = other[key]
+        return elem
+
+    def elements(self, texts=True):
+        return [self.element(k, texts) for k in range(len(self))]
+
+    def vertices(self):
+        return list(self.position)
+
+    def edges(self):
+        return [(self.ids[s], self.ids[t]) for s, t in self.edge_array.tolist()]
+
+
+class CourseStore:
+    """.course files for the JSON courses in courses_dir, kept in store_dir
+    and rebuilt whenever their JSON file changes, plus a catalog of every
+    course's metadata (also written to store_dir/catalog.json)."""
+
+    def __init__(self, store_dir, courses_dir):
+        self.store_dir = store_dir
+        self.courses_dir = os.path.abspath(courses_dir)
+        self.courses = {}
+        self.lock = threading.Lock()
+        self.catalog_entries = None
+        self.catalog_state = None
+        self.catalog_checked = 0.0
+
+    def store_path(self, json_path):
+        name = os.path.splitext(os.path.basename(json_path))[0]
+        return os.path.join(self.store_dir, name + ".course")
+
+    def open(self, json_path):
+        """The Course for a JSON course file, converted first if its .course
+        file is missing or older than the JSON."""
+        json_path = os.path.abspath(json_path)
+        stat = os.stat(json_path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        course = self.courses.get(json_path)
+        if course is not None and course.fingerprint == fingerprint:
+            return course
+        with self.lock:
+            course = self.courses.get(json_path)
+            if course is not None and course.fingerprint == fingerprint:
+                return course
+            store_path = self.store_path(json_path)
+            try:
+                course = Course(store_path)
+            except (OSError, ValueError):
+                course = None
+            if course is None or course.fingerprint != fingerprint:
+                write_course(json_path, store_path)
+                course = Course(store_path)
+            self.courses[json_path] = course
+            return course
+
+    def recorded_digest(self, path, fingerprint):
+        """CourseCache digest hint: the content hash recorded at conversion,
+        so a cold load of a saved course never reads its JSON."""
+        path = os.path.abspath(path)
+        if os.path.dirname(path) != self.courses_dir:
+            return None
+        course = self.open(path)
+        return course.digest if course.fingerprint == fingerprint[1:] else None
+
+    def catalog(self):
+        """File name -> metadata (nodes, edges, topics, types, modified, ...)
+        of every course in courses_dir."""
+        state = os.stat(self.courses_dir).st_mtime_ns
+        if (
+            self.catalog_entries is not None
+            and self.catalog_state == state
+            and time.monotonic() - self.catalog_checked < catalog_refresh_interval
+        ):
+            return self.catalog_entries
+        entries = {}
+        for name in sorted(os.listdir(self.courses_dir)):
+            if name.endswith(".json"):
+                entries[name] = self.open(os.path.join(self.courses_dir, name)).metadata
+        if entries != self.catalog_entries:
+            os.makedirs(self.store_dir, exist_ok=True)
+            path = os.path.join(self.store_dir, "catalog.json")
+            with open(f"{path}.{os.getpid()}.tmp", "w") as f:
+                json.dump(entries, f, indent=4)
+            os.replace(f"{path}.{os.getpid()}.tmp", path)
+        self.catalog_entries = entries
+        self.catalog_state = state
+        self.catalog_checked = time.monotonic()
+        return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--courses", default="saved_course_jsons")
+    parser.add_argument("--store", default=os.path.join("temp", "course_store"))
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("build", help="convert every saved course")
+    export = commands.add_parser("export", help="write a course back as JSON")
+    export.add_argument("name")
+    export.add_argument("output")
+    commands.add_parser("verify", help="check every course round-trips")
+    args = parser.parse_args()
+    store = CourseStore(args.store, args.courses)
+
+    if args.command == "export":
+        name = args.name if args.name.endswith(".json") else args.name + ".json"
+        course = store.open(os.path.join(args.courses, name))
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(course.elements(), f, indent=4)
+        return 0
+
+    catalog = store.catalog()
+    for name, metadata in catalog.items():
+        print(f"{name}: {metadata['nodes']} statements, {metadata['edges']} edges")
+    if args.command != "verify":
+        return 0
+    failed = 0
+    for name in catalog:
+        path = os.path.join(args.courses, name)
+        with open(path, "r", encoding="utf-8") as f:
+            expected = json.load(f)
+        course = store.open(path)
+        edges, _ = resolve_references(expected)
+        # Compared as JSON so that key order counts too
+        same = json.dumps(course.elements()) == json.dumps(expected)
+        same = same and course.edges() == edges
+        failed += not same
+        print(name, "round-trips" if same else "DIFFERS")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+def strongly_connected_components(successors):
+    """Tarjan's algorithm with an explicit stack, so deep chains don't hit
+    the recursion limit. successors[v] lists the heads of v's out-edges
+    (vertices are 0..n-1). Components come out in reverse topological
+    order: every edge between components points to an earlier one."""
+    n = len(successors)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        # (vertex, position in its successor list)
+        work = [(root, 0)]
+        while work:
+            v, i = work[-1]
+            if i < len(successors[v]):
+                work[-1] = (v, i + 1)
+                w = successors[v][i]
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, 0))
+                elif on_stack[w]:
+                    low[v] = min(low[v], index[w])
+                continue
+
+            work.pop()
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(sorted(component))
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+    return components
+
+
+def condensation(n, edges):
+    """Collapse the cycles of a graph on vertices 0..n-1 given as (source,
+    target) pairs.
+
+    Returns (component_of, components, component_edges): the component of
+    each vertex, the components (sorted vertex lists) numbered in
+    topological order, and the deduplicated edges between components."""
+    successors = [[] for _ in range(n)]
+    for source, target in edges:
+        successors[source].append(target)
+    components = strongly_connected_components(successors)[::-1]
+
+    component_of = [0] * n
+    for c, members in enumerate(components):
+        for v in members:
+            component_of[v] = c
+    component_edges = sorted(
+        {
+            (component_of[source], component_of[target])
+            for source, target in edges
+            if component_of[source] != component_of[target]
+        }
+    )
+    return component_of, components, component_edges
@@ -0,0 +1,232 @@
+import re
+import zlib
+
+import numpy as np
+
+from references import normalize_reference, split_reference
+
+# How duplicates are merged. keep: which entry of a group survives
+# ("longest_proof", "longest_statement" or "first"); list fields are either
+# taken from that entry ("keep") or the union over the group ("union").
+DEFAULT_POLICY = {
+    "keep": "longest_proof",
+    "previous_results": "union",
+    "preconditions": "union",
+}
+
+# Statements are compared as sets of word shingles of this many words
+shingle_words = 3
+# Statements with fewer shingles are only merged on their id
+min_shingles = 4
+# Jaccard similarity of shingle sets at which two statements are the same,
+# and the stricter one for statements numbered differently ("Lemma 3.1" and
+# "Lemma 3.2" are often worded alike)
+near_duplicate_threshold = 0.7
+renumbered_duplicate_threshold = 0.9
+# MinHash signature of bands * rows hashes; LSH candidates share a band
+lsh_bands = 16
+lsh_rows = 4
+# Candidates in one LSH bucket are checked against at most this many
+# earlier members, so a crowded bucket stays linear
+max_bucket_checks = 8
+# Shingle hashes processed per block when computing signatures
+signature_block = 1 << 16
+
+mersenne_prime = (1 << 31) - 1
+word_pattern = re.compile(r"\w+")
+
+
+def shingles(text):
+    words = word_pattern.findall(text.lower())
+    return {
+        " ".join(words[i : i + shingle_words])
+        for i in range(max(len(words) - shingle_words + 1, 0))
+    }
+
+
+def minhash_signatures(shingle_sets, seed=0):
+    """(len(shingle_sets), bands * rows) MinHash signatures. Shingles are
+    hashed with crc32, so signatures are the same in every process."""
+    rng = np.random.default_rng(seed)
+    n_hashes = lsh_bands * lsh_rows
+    a = rng.integers(1, mersenne_prime, n_hashes, dtype=np.uint64)[:, None]
+    b = rng.integers(0, mersenne_prime, n_hashes, dtype=np.uint64)[:, None]
+    signatures = np.empty((len(shingle_sets), n_hashes), dtype=np.uint64)
+
+    start = 0
+    while start < len(shingle_sets):
+        # A block of whole statements with about signature_block shingles
+        stop, total = start, 0
+        while stop < len(shingle_sets) and (stop == start or total < signature_block):
+            total += len(shingle_sets[stop])
+            stop += 1
+        hashes = np.fromiter(
+            (
+                zlib.crc32(shingle.encode("utf-8")) % mersenne_prime
+                for shingle_set in shingle_sets[start:stop]
+                for shingle in shingle_set
+            ),
+            dtype=np.uint64,
+            count=total,
+        )
+        offsets = np.cumsum([0] + [len(s) for s in shingle_sets[start : stop - 1]])
+        permuted = (a * hashes + b) % mersenne_prime
+        signatures[start:stop] = np.minimum.reduceat(permuted, offsets, axis=1).T
+        start = stop
+    return signatures
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+def statement_number(id):
+    split = split_reference(str(id))
+    return None if split is None else split[0].split(" ", 1)[1]
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def union(self, i, j):
+        """Merge the groups of i and j and return the root that was merged
+        into the other, or None if they were already one group. The earlier
+        entry stays the root, so groups keep document order."""
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return None
+        self.parent[max(i, j)] = min(i, j)
+        return max(i, j)
+
+
+def near_duplicate_pairs(texts):
+    """(i, j, similarity) for statements whose shingle sets are at least
+    near_duplicate_threshold similar, found through MinHash LSH."""
+    sets = [shingles(text) for text in texts]
+    candidates = [i for i, s in enumerate(sets) if len(s) >= min_shingles]
+    if len(candidates) < 2:
+        return []
+    signatures = minhash_signatures([sets[i] for i in candidates])
+
+    pairs = []
+    checked = set()
+    for band in range(lsh_bands):
+        buckets = {}
+        rows = signatures[:, band * lsh_rows : (band + 1) * lsh_rows]
+        for k, key in enumerate(map(bytes, rows)):
+            bucket = buckets.setdefault(key, [])
+            for other in bucket[:max_bucket_checks]:
+                pair = (candidates[other], candidates[k])
+                if pair in checked:
+                    continue
+                checked.add(pair)
+                similarity = jaccard(sets[pair[0]], sets[pair[1]])
+                if similarity >= near_duplicate_threshold:
+                    pairs.append((*pair, similarity))
+            bucket.append(k)
+    return pairs
+
+
+def merge_group(group, policy):
+    if policy["keep"] == "longest_proof":
+        kept = max(group, key=lambda elem: len(elem["proof"]))
+    elif policy["keep"] == "longest_statement":
+        kept = max(group, key=lambda elem: len(elem["statement"]))
+    else:
+        kept = group[0]
+    merged = dict(kept)
+    for field in ("previous_results", "preconditions"):
+        if policy.get(field) == "union":
+            values = [
+                value
+                for elem in group
+                if isinstance(elem.get(field), list)
+                for value in elem[field]
+            ]
+            merged[field] = list(dict.fromkeys(map(str, values)))
+    return merged
+
+
+def deduplicate(elems, policy=None):
+    """Merge entries that are the same statement: ids equal after
+    normalization ("Thm 2.4" / "Theorem 2.4"), or statements that are near
+    duplicates by shingle similarity.
+
+    Returns (merged entries in document order, report). References to the
+    ids of dropped entries are rewritten to the id that was kept."""
+    policy = dict(DEFAULT_POLICY, **(policy or {}))
+    groups = UnionFind(len(elems))
+    # Why each absorbed group root joined the group before it
+    reasons = {}
+
+    first_with_id = {}
+    for i, elem in enumerate(elems):
+        key = normalize_reference(str(elem["id"]))
+        if key in first_with_id:
+            absorbed = groups.union(first_with_id[key], i)
+            if absorbed is not None:
+                reasons[absorbed] = {"reason": "id"}
+        else:
+            first_with_id[key] = i
+
+    texts = [str(elem["statement"]) for elem in elems]
+    for i, j, similarity in near_duplicate_pairs(texts):
+        numbers = {statement_number(elems[i]["id"]), statement_number(elems[j]["id"])}
+        if len(numbers - {None}) > 1 and similarity < renumbered_duplicate_threshold:
+            continue
+        absorbed = groups.union(i, j)
+        if absorbed is not None:
+            reasons[absorbed] = {
+                "reason": "near_duplicate",
+                "similarity": round(similarity, 3),
+                "matched": [elems[i]["id"], elems[j]["id"]],
+            }
+
+    members = {}
+    for i in range(len(elems)):
+        members.setdefault(groups.find(i), []).append(i)
+
+    merged, report, renamed = [], [], {}
+    for root in sorted(members):
+        group = [elems[i] for i in members[root]]
+        elem = merge_group(group, policy)
+        merged.append(elem)
+        if len(group) == 1:
+            continue
+        for other in group:
+            if other["id"] != elem["id"]:
+                renamed[normalize_reference(str(other["id"]))] = elem["id"]
+        report.append(
+            {
+                "kept": elem["id"],
+                "ids": [other["id"] for other in group],
+                "merges": [
+                    dict(id=elems[i]["id"], **reasons[i])
+                    for i in members[root]
+                    if i in reasons
+                ],
+            }
+        )
+
+    # A dropped id can also be the normalized id of an entry that was kept
+    kept_ids = {normalize_reference(str(elem["id"])) for elem in merged}
+    renamed = {key: kept for key, kept in renamed.items() if key not in kept_ids}
+    for elem in merged:
+        if not isinstance(elem.get("previous_results"), list):
+            continue
+        references = []
+        for reference in elem["previous_results"]:
+            reference = renamed.get(normalize_reference(str(reference)), reference)
+            if reference != elem["id"]:
+                references.append(reference)
+        elem["previous_results"] = list(dict.fromkeys(references))
+    return merged, report
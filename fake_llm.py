@@ -0,0 +1,274 @@
+"""Local stand-in for the Anthropic messages API, for measuring pipeline
+throughput without the network.
+
+    python fake_llm.py --requests 200 --concurrency 16 --latency 0.5
+
+starts a server, pushes requests through llm.create_messages and prints
+the achieved throughput. Point the real pipeline at a running server with
+ANTHROPIC_BASE_URL=http://127.0.0.1:<port> and any
+ANTHROPIC_API_KEY. Serving with reply=pipeline_reply answers every
+ingestion prompt plausibly, so a whole pipeline runs against it.
+"""
+
+import argparse
+import ast
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A statement's header, and "by Lemma 2.3" style references in its proof
+header_pattern = re.compile(r"^\s*([A-Z][a-z]+) (\d+(?:\.\d+)*)\.?\s*")
+reference_pattern = re.compile(
+    r"\b(Theorem|Proposition|Lemma|Corollary|Definition|Example) (\d+(?:\.\d+)*)"
+)
+# How statements state their conditions ("Let f be ...", "Suppose x is ...")
+condition_pattern = re.compile(r"\b(?:Let|Suppose|Assume) ([^.;]+?)(?: and |[.;])")
+# cluster_topics replies group the topics into this many
+topic_groups = 6
+
+
+def echo_reply(request):
+    return request["messages"][-1]["content"][0]["text"]
+
+
+def summary_object(text):
+    # What get_big_json asks for, read off the statement text itself
+    header = header_pattern.match(text)
+    kind, number = header.groups() if header else ("Theorem", "0")
+    statement, _, proof = text[header.end() if header else 0 :].partition("\nProof.")
+    id = f"{kind} {number}"
+    return {
+        "type": kind.lower(),
+        "id": id,
+        "name": " ".join(statement.split()[:3]) or id,
+        "topic": f"chapter {number.split('.')[0]}",
+        "previous_results": list(
+            dict.fromkeys(
+                f"{k} {n}"
+                for k, n in reference_pattern.findall(proof)
+                if f"{k} {n}" != id
+            )
+        ),
+        "statement": statement.strip(),
+        "proof": proof.strip(),
+    }
+
+
+def pipeline_reply(request):
+    """A reply of the form each ingestion stage expects: the conditions in
+    the notes as preconditions, summaries read off the statements, the
+    candidates a statement spells out, topics dealt round-robin."""
+    system = request.get("system", [{}])[0].get("text", "")
+    text = request["messages"][-1]["content"][0]["text"]
+    if "find connections" in system:
+        return repr(sorted(set(condition_pattern.findall(system))))
+    if "document processing" in system:
+        batch = ast.literal_eval(text[: text.index("]. For each") + 1])
+        return json.dumps([summary_object(str(s)) for s in batch], indent=1)
+    if "numbers of the chosen preconditions" in system:
+        listing = request["system"][1]["text"].split("\n")[1:]
+        preconditions = [line.split(". ", 1)[1] for line in listing]
+        chosen = []
+        for block in re.split(r"\n\n(?=Statement \d+:\n)", text):
+            statement = block.rpartition("\nLikely preconditions: ")[0]
+            chosen.append([n for n, p in enumerate(preconditions, 1) if p in statement])
+        return json.dumps(chosen)
+    if "group topics" in system:
+        topics = ast.literal_eval(text[text.index("[") : text.index("]. You'll") + 1])
+        groups = [[] for _ in range(min(topic_groups, len(topics)) or 1)]
+        for k, topic in enumerate(topics):
+            groups[k % len(groups)].append(topic)
+        return repr([(f"area {k + 1}", group) for k, group in enumerate(groups)])
+    return echo_reply(request)
+
+
+class FakeMessagesServer:
+    """Serves POST /v1/messages on 127.0.0.1.
+
+    latency: seconds slept per request. rate_limit_rate: probability of
+    answering 429 with a retry-after header. reply: function of the request
+    JSON returning the response text. failure_rate: probability of
+    answering 529 (overloaded), also with a retry-after header. Replies
+    longer than the request's max_tokens (at ~4 characters a token) are
+    cut off with stop_reason "max_tokens"."""
+
+    def __init__(
+        self,
+        latency=0.0,
+        rate_limit_rate=0.0,
+        retry_after=1,
+        reply=echo_reply,
+        seed=0,
+        failure_rate=0.0,
+    ):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.reply = reply
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.failed = 0
+        # System prompts marked cache_control, as prompt caching would hold
+        self.cached_prompts = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["content-length"]))
+                fake.handle(self, json.loads(body))
+
+        return Handler
+
+    def handle(self, handler, request):
+        with self.lock:
+            self.requests += 1
+            limited = self.random.random() < self.rate_limit_rate
+            self.rate_limited += limited
+            failed = not limited and self.random.random() < self.failure_rate
+            self.failed += failed
+        if limited:
+            self.send(
+                handler,
+                429,
+                {
+                    "type": "error",
+                    "error": {"type": "rate_limit_error", "message": "fake 429"},
+                },
+                {"retry-after": str(self.retry_after)},
+            )
+            return
+
+        time.sleep(self.latency)
+        if failed:
+            self.send(
+                handler,
+                529,
+                {
+                    "type": "error",
+                    "error": {"type": "overloaded_error", "message": "fake 529"},
+                },
+                {"retry-after": str(self.retry_after)},
+            )
+            return
+        text = self.reply(request)
+        stop_reason = "end_turn"
+        if len(text) // 4 > request["max_tokens"]:
+            text, stop_reason = text[: request["max_tokens"] * 4], "max_tokens"
+        input_chars = sum(
+            len(block["text"])
+            for message in request["messages"]
+            for block in message["content"]
+        )
+        # Like prompt caching: a cache_control system prompt is written to
+        # the cache the first time and read from it after that
+        cache_read = cache_creation = 0
+        for block in request.get("system", []):
+            if "cache_control" not in block:
+                input_chars += len(block["text"])
+                continue
+            with self.lock:
+                seen = block["text"] in self.cached_prompts
+                self.cached_prompts.add(block["text"])
+            if seen:
+                cache_read += len(block["text"]) // 4
+            else:
+                cache_creation += len(block["text"]) // 4
+        self.send(
+            handler,
+            200,
+            {
+                "id": "msg_" + uuid.uuid4().hex,
+                "type": "message",
+                "role": "assistant",
+                "model": request["model"],
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": stop_reason,
+                "stop_sequence": None,
+                "usage": {
+                    "input_tokens": input_chars // 4 + 1,
+                    "output_tokens": len(text) // 4 + 1,
+                    "cache_read_input_tokens": cache_read,
+                    "cache_creation_input_tokens": cache_creation,
+                },
+            },
+        )
+
+    def send(self, handler, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("content-type", "application/json")
+        handler.send_header("content-length", str(len(body)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    import llm
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=100000)
+    parser.add_argument("--tpm", type=int, default=100000000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("ANTHROPIC_API_KEY", "fake")
+    llm.configure(args.concurrency, args.rpm, args.tpm)
+    requests = [
+        {
+            "model": "claude-3-7-sonnet-20250219",
+            "max_tokens": 1024,
+            "messages": [
+                {"role": "user", "content": [{"type": "text", "text": f"request {i}"}]}
+            ],
+        }
+        for i in range(args.requests)
+    ]
+    with FakeMessagesServer(args.latency, args.rate_limit_rate) as server:
+        start = time.perf_counter()
+        messages = llm.create_messages(requests, base_url=server.base_url)
+        elapsed = time.perf_counter() - start
+
+    in_order = all(
+        message.content[0].text == f"request {i}" for i, message in enumerate(messages)
+    )
+    print(
+        f"{len(requests)} requests in {elapsed:.2f}s "
+        f"({len(requests) / elapsed:.1f} req/s), "
+        f"{server.rate_limited} rate limited, in order: {in_order}"
+    )
+
+
+if __name__ == "__main__":
+    main()
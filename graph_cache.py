@@ -0,0 +1,99 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+class CourseCache:
+    """Serialized responses for course files.
+
+    A file is identified by its (path, mtime, size) fingerprint, which maps
+    to the SHA-256 of its contents. Payloads are stored per (content hash,
+    variant), so touching a file without changing it only costs a re-hash,
+    and the content hash doubles as the HTTP ETag. Builders read the files
+    themselves."""
+
+    def __init__(self, max_bytes, digest_hint=None):
+        self.digests = LRUCache(max_bytes // 64)
+        self.payloads = LRUCache(max_bytes)
+        # digest_hint(path, fingerprint) -> a known content hash or None,
+        # to avoid reading files just to hash them
+        self.digest_hint = digest_hint
+
+    def digest(self, path):
+        fingerprint = file_fingerprint(path)
+        digest = self.digests.get(fingerprint)
+        if digest is not None:
+            return digest
+        if self.digest_hint is not None:
+            digest = self.digest_hint(path, fingerprint)
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+        self.digests.put(fingerprint, digest, len(fingerprint[0]) + 96)
+        return digest
+
+    def get(self, path, variant, build, size=len):
+        """Return (body, etag) for path, calling build() -> body only on a
+        miss. size(body) is what the body counts against max_bytes."""
+        return self.get_many([path], variant, build, size)
+
+    def get_many(self, paths, variant, build, size=len):
+        """Like get for a response built from several files, keyed on all
+        their hashes."""
+        digests = [self.digest(path) for path in paths]
+        key = (
+            digests[0]
+            if len(digests) == 1
+            else hashlib.sha256(":".join(digests).encode()).hexdigest()
+        )
+
+        cached = self.payloads.get((key, variant))
+        if cached is None:
+            body = build()
+            etag = hashlib.sha256(f"{key}:{variant}".encode()).hexdigest()[:32]
+            cached = (body, etag)
+            self.payloads.put((key, variant), cached, size(body))
+        return cached
@@ -0,0 +1,182 @@
+"""Batch ingestion: run the pipeline on every PDF in a directory.
+
+    python ingest.py lecture_notes/ --courses 4 --concurrency 16
+
+Each PDF becomes saved_course_jsons/<file name>.json. Courses run side by
+side on threads sharing one process pool for PDF extraction and the
+process-wide LLM limiter, so --concurrency, --rpm and --tpm budget all of
+them together. Every course works in its own workspace under
+temp/ingest/<name>, where a rerun resumes where it stopped (see
+pipeline.run_pipeline) and ingest.log records its progress and failures;
+temp/ingest/report.json sums up the last run.
+"""
+
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import llm
+from claude import temp_dir
+from course_edit import write_atomically
+from pipeline import PIPELINE_STAGES, extract_pdf_text, run_pipeline
+
+ingest_dir = os.path.join(temp_dir, "ingest")
+
+
+class CourseLog:
+    """Appends timestamped lines to a course's ingest.log and echoes them
+    to stdout prefixed with the course name."""
+
+    lock = threading.Lock()
+
+    def __init__(self, name, workspace):
+        self.name = name
+        self.path = os.path.join(workspace, "ingest.log")
+
+    def write(self, message):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        with self.lock:
+            print(f"[{self.name}] {message}", flush=True)
+
+
+def ingest_course(pdf_path, output_dir, stages, force=()):
+    """Run stages on one PDF in its workspace and move the result into
+    output_dir. Returns the course's entry for the report."""
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    workspace = os.path.join(ingest_dir, name)
+    os.makedirs(workspace, exist_ok=True)
+    log = CourseLog(name, workspace)
+    # Copied over the last upload, whose hash tells the manifest whether
+    # extraction has to run again
+    shutil.copyfile(pdf_path, os.path.join(workspace, "upload.pdf"))
+    start = time.time()
+    entry = dict(pdf=pdf_path, workspace=workspace, status="running", stage=None)
+
+    def on_stage(i, stage_name):
+        entry["stage"] = stage_name
+        log.write(f"stage {i + 1}/{len(stages)}: {stage_name}")
+
+    log.write(f"started {pdf_path}")
+    try:
+        run_pipeline(stages, workspace, on_stage, force=force)
+        with open(os.path.join(workspace, "final_summary.json"), "rb") as f:
+            data = f.read()
+        output = os.path.join(output_dir, name + ".json")
+        write_atomically(output, data)
+    except Exception as e:
+        log.write(f"failed in {entry['stage']}: {e!r}\n{traceback.format_exc()}")
+        return dict(entry, status="failed", error=str(e), seconds=time.time() - start)
+    statements = len(json.loads(data))
+    log.write(f"done: {statements} statements written to {output}")
+    return dict(
+        entry,
+        status="done",
+        stage=None,
+        output=output,
+        statements=statements,
+        seconds=time.time() - start,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("pdf_dir", help="directory of lecture-note PDFs")
+    parser.add_argument("--output", default="saved_course_jsons")
+    parser.add_argument(
+        "--courses", type=int, default=4, help="courses ingested at once"
+    )
+    parser.add_argument(
+        "--pdf-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="processes extracting PDF text, shared by every course",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="LLM requests in flight, in all"
+    )
+    parser.add_argument("--rpm", type=int, default=50, help="LLM requests per minute")
+    parser.add_argument("--tpm", type=int, default=40000, help="LLM tokens per minute")
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        help="leave PDFs whose course is already in --output alone",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rerun every stage regardless"
+    )
+    args = parser.parse_args()
+
+    pdfs = sorted(
+        os.path.join(args.pdf_dir, file)
+        for file in os.listdir(args.pdf_dir)
+        if file.lower().endswith(".pdf")
+    )
+    if args.skip_existing:
+        pdfs = [
+            pdf
+            for pdf in pdfs
+            if not os.path.exists(
+                os.path.join(
+                    args.output, os.path.splitext(os.path.basename(pdf))[0] + ".json"
+                )
+            )
+        ]
+    if not pdfs:
+        print("No PDFs to ingest in", args.pdf_dir)
+        return 0
+    os.makedirs(args.output, exist_ok=True)
+    llm.configure(args.concurrency, args.rpm, args.tpm)
+    force = [stage.name for stage in PIPELINE_STAGES] if args.force else ()
+    print(f"Ingesting {len(pdfs)} PDFs, {args.courses} at a time")
+
+    start = time.time()
+    # spawn rather than fork: the course threads are already running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.pdf_workers, mp_context=context) as pool:
+        stages = [
+            (
+                stage._replace(function=functools.partial(extract_pdf_text, pool=pool))
+                if stage.function is extract_pdf_text
+                else stage
+            )
+            for stage in PIPELINE_STAGES
+        ]
+        with ThreadPoolExecutor(args.courses, thread_name_prefix="ingest") as courses:
+            entries = list(
+                courses.map(
+                    lambda pdf: ingest_course(pdf, args.output, stages, force), pdfs
+                )
+            )
+
+    failed = [entry for entry in entries if entry["status"] == "failed"]
+    report = dict(
+        started=start,
+        seconds=time.time() - start,
+        courses={os.path.basename(entry["workspace"]): entry for entry in entries},
+    )
+    os.makedirs(ingest_dir, exist_ok=True)
+    write_atomically(
+        os.path.join(ingest_dir, "report.json"),
+        json.dumps(report, indent=4).encode("utf-8"),
+    )
+    print(
+        f"{len(entries) - len(failed)} of {len(entries)} courses ingested in "
+        f"{report['seconds']:.1f}s"
+    )
+    for entry in failed:
+        print(f"FAILED {entry['pdf']} in {entry['stage']}: {entry['error']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
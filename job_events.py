@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+
+from course_edit import EditableCourse
+from layout import DEFAULT_LAYOUT, LAYOUTS
+from references import resolve_references
+
+
+class EventLog:
+    """Append-only log of the events a job publishes. Events are numbered
+    from 1, so a reader that has seen n events (e.g. an SSE client sending
+    Last-Event-ID: n) resumes with read(n)."""
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, event, data, last=False):
+        with self.condition:
+            self.events.append((len(self.events) + 1, event, data))
+            self.closed = self.closed or last
+            self.condition.notify_all()
+
+    def read(self, after, timeout=None):
+        """Wait until there are events after the first `after` ones or the
+        log is closed. Returns (events, closed)."""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.events) > after or self.closed, timeout
+            )
+            return self.events[after:], self.closed
+
+
+def load_statements(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_statement(thingy):
+    # What the reference index can take; anything else isn't streamed
+    return (
+        isinstance(thingy, dict)
+        and isinstance(thingy.get("id"), str)
+        and isinstance(thingy.get("name", ""), str)
+        and isinstance(thingy.get("previous_results", []), list)
+    )
+
+
+def final_positions(claude_list):
+    # Laid out as app.build_graph_bfs lays out a job's final summary
+    vertices = list(dict.fromkeys(thingy["id"] for thingy in claude_list))
+    edges, _ = resolve_references(claude_list)
+    positions = LAYOUTS[DEFAULT_LAYOUT](vertices, edges)
+    return {vertex: list(positions[vertex]) for vertex in vertices}
+
+
+class GraphStream:
+    """Turns a job's partial results into graph deltas on its EventLog.
+
+    "statements": new or updated nodes, the links added and removed, and
+    the layered positions of nodes that are new or moved. References and
+    the layout are updated incrementally (see course_edit.EditableCourse),
+    so each batch costs about what it touches, not the whole course.
+    "preconditions" and "topics": per-id updates once those stages finish.
+    "removed": ids the final summary dropped. "layout": the positions of
+    every node in the result /jobs/<id> serves (default layout), which the
+    incremental layout can differ from, so nodes don't jump when a client
+    swaps in the final graph."""
+
+    def __init__(self, log):
+        self.log = log
+        self.course = EditableCourse([])
+
+    @property
+    def statements(self):
+        return self.course.elems
+
+    def on_event(self, event, data):
+        if event == "statements":
+            self.add_statements(data)
+
+    def add_statements(self, theorems):
+        new = {
+            thingy["id"]: thingy for thingy in theorems if is_statement(thingy)
+        }.values()
+        if not new:
+            return
+        moved, _, links_added, links_removed = self.course.put(new)
+        if moved is None:
+            # Laid out again from scratch (the references have a cycle)
+            moved = list(self.statements)
+        positions = self.course.positions
+        nodes = [
+            dict(
+                id=thingy["id"],
+                type=thingy.get("type"),
+                name=thingy.get("name"),
+                topic=thingy.get("topic"),
+                statement=thingy.get("statement", ""),
+                proof=thingy.get("proof", ""),
+                x=positions[thingy["id"]][0],
+                y=positions[thingy["id"]][1],
+            )
+            for thingy in new
+        ]
+        self.log.publish(
+            "statements",
+            dict(
+                nodes=nodes,
+                links=[{"source": s, "target": t} for s, t in links_added],
+                links_removed=[{"source": s, "target": t} for s, t in links_removed],
+                positions={node: list(positions[node]) for node in moved},
+            ),
+        )
+
+    def stage_done(self, stage, workspace):
+        # Later stages rewrite the whole summary; only their changes are sent
+        for output in stage.outputs:
+            path = os.path.join(workspace, output)
+            if output in ("summary.json", "final_summary.json"):
+                theorems = [
+                    thingy for thingy in load_statements(path) if is_statement(thingy)
+                ]
+                # Statements not streamed yet (stage skipped on resume, or DEV)
+                self.add_statements(
+                    [
+                        thingy
+                        for thingy in theorems
+                        if thingy["id"] not in self.statements
+                    ]
+                )
+                if output == "final_summary.json":
+                    # remove_dups drops incomplete statements
+                    kept = {thingy["id"] for thingy in theorems}
+                    removed = [node for node in self.statements if node not in kept]
+                    if removed:
+                        self.log.publish("removed", removed)
+                    self.log.publish("layout", final_positions(load_statements(path)))
+            elif output == "summary_preconditions.json":
+                self.log.publish(
+                    "preconditions",
+                    {
+                        thingy["id"]: thingy["preconditions"]
+                        for thingy in load_statements(path)
+                        if "id" in thingy and "preconditions" in thingy
+                    },
+                )
+            elif output == "topic_modded_summary.json":
+                self.log.publish(
+                    "topics",
+                    {
+                        thingy["id"]: thingy["topic"]
+                        for thingy in load_statements(path)
+                        if "id" in thingy and "topic" in thingy
+                    },
+                )
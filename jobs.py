@@ -0,0 +1,145 @@
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from claude import temp_dir
+from job_events import EventLog, GraphStream
+from pipeline import run_pipeline
+
+jobs_dir = os.path.join(temp_dir, "jobs")
+# Finished jobs (and their workspaces) are dropped after this many seconds
+job_ttl = 24 * 60 * 60
+
+
+def new_workspace():
+    workspace = os.path.join(jobs_dir, uuid.uuid4().hex)
+    os.makedirs(workspace)
+    return workspace
+
+
+class JobManager:
+    """Runs ingestion pipelines on a bounded pool of background threads.
+
+    Each job gets its own workspace directory under temp/jobs, so the
+    stage files of concurrent uploads never collide."""
+
+    def __init__(self, stages, max_workers=2, max_pending=32):
+        self.stages = stages
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ingest"
+        )
+        self.jobs = {}
+        # Kept apart from self.jobs, which is what GET /jobs/<id> serializes
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, pdf_bytes):
+        """Queue a PDF for ingestion. Returns the job id, or None when too
+        many jobs are already waiting."""
+        with self.lock:
+            self.prune()
+            pending = sum(
+                job["status"] in ("queued", "running") for job in self.jobs.values()
+            )
+            if pending >= self.max_pending:
+                return None
+            workspace = new_workspace()
+            job_id = os.path.basename(workspace)
+            self.jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "stage": None,
+                "stages_done": [],
+                "progress": 0,
+                "error": None,
+                "created": time.time(),
+                "finished": None,
+                "workspace": workspace,
+            }
+            self.logs[job_id] = EventLog()
+
+        with open(os.path.join(workspace, "upload.pdf"), "wb") as f:
+            f.write(pdf_bytes)
+        self.executor.submit(self.run, job_id)
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return (
+                None if job is None else dict(job, stages_done=list(job["stages_done"]))
+            )
+
+    def event_log(self, job_id):
+        with self.lock:
+            return self.logs.get(job_id)
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def run(self, job_id):
+        job = self.get(job_id)
+        log = self.event_log(job_id)
+        stream = GraphStream(log)
+        stage_names = [stage.name for stage in self.stages]
+
+        def stage_done(i):
+            try:
+                stream.stage_done(self.stages[i], job["workspace"])
+            except Exception:
+                # Streaming is best effort, the job result is what counts
+                traceback.print_exc()
+
+        def on_stage(i, name):
+            if i > 0:
+                stage_done(i - 1)
+            progress = int(100 * i / len(stage_names))
+            self.update(
+                job_id,
+                status="running",
+                stage=name,
+                stages_done=stage_names[:i],
+                progress=progress,
+            )
+            log.publish("stage", {"stage": name, "progress": progress})
+
+        def on_event(event, data):
+            try:
+                stream.on_event(event, data)
+            except Exception:
+                traceback.print_exc()
+
+        try:
+            run_pipeline(self.stages, job["workspace"], on_stage, on_event=on_event)
+        except Exception as e:
+            traceback.print_exc()
+            self.update(job_id, status="failed", error=str(e), finished=time.time())
+            log.publish("failed", {"error": str(e)}, last=True)
+            return
+        stage_done(len(self.stages) - 1)
+        self.update(
+            job_id,
+            status="done",
+            stage=None,
+            stages_done=stage_names,
+            progress=100,
+            finished=time.time(),
+        )
+        log.publish(
+            "done", {"job_id": job_id, "statements": len(stream.statements)}, last=True
+        )
+
+    def prune(self):
+        # Called with the lock held
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job["finished"] is not None and now - job["finished"] > job_ttl:
+                shutil.rmtree(job["workspace"], ignore_errors=True)
+                del self.jobs[job_id]
+                del self.logs[job_id]
@@ -0,0 +1,199 @@
+import random
+from collections import deque
+
+import numpy as np
+
+x_center = 800
+x_spacing = 250
+y_spacing = 200
+# Number of alternating down/up barycenter sweeps
+crossing_sweeps = 4
+
+
+def bfs_layout(vertices, edges):
+    """The original layout: depth is the BFS distance from the first
+    unvisited vertex and x is a jitter around the centre. The jitter is
+    seeded so the same course always gets the same picture."""
+    children = {vertex: [] for vertex in vertices}
+    for source, target in edges:
+        children[source].append(target)
+
+    searched_set = {vertex: False for vertex in vertices}
+    depths = {}
+    for vertex in vertices:
+        if searched_set[vertex]:
+            continue
+        searched_set[vertex] = True
+        queue = deque([(vertex, 1)])
+        while queue:
+            current_vertex, current_depth = queue.popleft()
+            depths[current_vertex] = current_depth
+            for next_vertex in children[current_vertex]:
+                if not searched_set[next_vertex]:
+                    searched_set[next_vertex] = True
+                    queue.append((next_vertex, current_depth + 1))
+
+    rng = random.Random(0)
+    return {
+        vertex: (x_center + rng.randint(-200, 200), y_spacing * depths[vertex])
+        for vertex in vertices
+    }
+
+
+def index_edges(vertices, edges):
+    position = {vertex: i for i, vertex in enumerate(vertices)}
+    src = np.fromiter((position[s] for s, _ in edges), dtype=np.int64, count=len(edges))
+    dst = np.fromiter((position[t] for _, t in edges), dtype=np.int64, count=len(edges))
+    return src, dst
+
+
+def longest_path_layers(n, src, dst):
+    """Layer of each vertex (starting at 1) = length of the longest path
+    reaching it, computed as rounds of Kahn's algorithm. If only cycles are
+    left the unplaced vertex with the fewest pending predecessors is
+    released so cyclic input still gets a layering."""
+    order = np.argsort(src, kind="stable")
+    out_dst = dst[order]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    indeg = np.bincount(dst, minlength=n)
+
+    layers = np.zeros(n, dtype=np.int64)
+    frontier = np.flatnonzero(indeg == 0)
+    remaining = n
+    layer = 1
+    while remaining:
+        if frontier.size == 0:
+            unplaced = np.flatnonzero(layers == 0)
+            frontier = unplaced[[np.argmin(indeg[unplaced])]]
+        layers[frontier] = layer
+        remaining -= frontier.size
+        layer += 1
+
+        # Out-edges of the whole frontier gathered from the CSR arrays
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            frontier = np.empty(0, dtype=np.int64)
+            continue
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        targets = out_dst[offsets + np.arange(total)]
+        np.subtract.at(indeg, targets, 1)
+        candidates = np.unique(targets)
+        frontier = candidates[(indeg[candidates] == 0) & (layers[candidates] == 0)]
+    return layers
+
+
+def group_by(keys, values):
+    """values sorted by keys plus the slice boundaries of each key."""
+    order = np.argsort(keys, kind="stable")
+    boundaries = np.searchsorted(keys[order], np.arange(keys.max() + 2))
+    return values[order], boundaries
+
+
+def barycenter_sweep(
+    layer_nodes, layer_bounds, slot, rank, anchor, other, edge_bounds, layer_range
+):
+    """Reorder each layer in layer_range by the mean rank of its neighbours
+    in already-swept layers. Vertices with no such neighbours keep their
+    current rank."""
+    for layer in layer_range:
+        lo, hi = layer_bounds[layer], layer_bounds[layer + 1]
+        width = hi - lo
+        if width < 2:
+            continue
+        e_lo, e_hi = edge_bounds[layer], edge_bounds[layer + 1]
+        local = slot[anchor[e_lo:e_hi]] - lo
+        sums = np.bincount(local, weights=rank[other[e_lo:e_hi]], minlength=width)
+        counts = np.bincount(local, minlength=width)
+        nodes = layer_nodes[lo:hi]
+        current = rank[nodes]
+        bary = np.where(counts > 0, sums / np.maximum(counts, 1), current)
+        order = np.lexsort((current, bary))
+        layer_nodes[lo:hi] = nodes[order]
+        slot[nodes[order]] = np.arange(lo, hi)
+        rank[nodes[order]] = np.arange(width) - (width - 1) / 2
+
+
+def layered_layout(vertices, edges):
+    """Sugiyama-style layout: longest-path layering, barycentric crossing
+    reduction and order-preserving coordinate assignment. Deterministic for
+    a given vertex and edge order."""
+    n = len(vertices)
+    if n == 0:
+        return {}
+    src, dst = index_edges(vertices, edges)
+    layers = longest_path_layers(n, src, dst)
+
+    # Only edges pointing down the layering take part in the sweeps
+    down = layers[src] < layers[dst]
+    src, dst = src[down], dst[down]
+
+    layer_nodes, layer_bounds = group_by(layers, np.arange(n))
+    slot = np.empty(n, dtype=np.int64)
+    slot[layer_nodes] = np.arange(n)
+    widths = np.diff(layer_bounds)
+    rank = slot - layer_bounds[layers] - (widths[layers] - 1) / 2
+
+    # Edges grouped by the layer of the head (down sweep) and tail (up sweep)
+    order = np.argsort(layers[dst], kind="stable")
+    down_anchor, down_other = dst[order], src[order]
+    down_bounds = np.searchsorted(layers[down_anchor], np.arange(layers.max() + 2))
+    order = np.argsort(layers[src], kind="stable")
+    up_anchor, up_other = src[order], dst[order]
+    up_bounds = np.searchsorted(layers[up_anchor], np.arange(layers.max() + 2))
+
+    top = int(layers.max())
+    for sweep in range(crossing_sweeps):
+        if sweep % 2 == 0:
+            barycenter_sweep(
+                layer_nodes,
+                layer_bounds,
+                slot,
+                rank,
+                down_anchor,
+                down_other,
+                down_bounds,
+                range(2, top + 1),
+            )
+        else:
+            barycenter_sweep(
+                layer_nodes,
+                layer_bounds,
+                slot,
+                rank,
+                up_anchor,
+                up_other,
+                up_bounds,
+                range(top - 1, 0, -1),
+            )
+
+    # Coordinates: each vertex sits over the mean x of its predecessors,
+    # then the layer is pushed apart to x_spacing keeping the sweep order
+    x = rank * x_spacing + x_center
+    for layer in range(2, top + 1):
+        lo, hi = layer_bounds[layer], layer_bounds[layer + 1]
+        if lo == hi:
+            continue
+        e_lo, e_hi = down_bounds[layer], down_bounds[layer + 1]
+        local = slot[down_anchor[e_lo:e_hi]] - lo
+        sums = np.bincount(local, weights=x[down_other[e_lo:e_hi]], minlength=hi - lo)
+        counts = np.bincount(local, minlength=hi - lo)
+        nodes = layer_nodes[lo:hi]
+        desired = np.where(counts > 0, sums / np.maximum(counts, 1), x[nodes])
+        steps = np.arange(hi - lo) * x_spacing
+        placed = np.maximum.accumulate(desired - steps) + steps
+        x[nodes] = placed - placed.mean() + desired.mean()
+
+    return {
+        vertex: (float(x[i]), int(y_spacing * layers[i]))
+        for i, vertex in enumerate(vertices)
+    }
+
+
+LAYOUTS = {
+    "layered": layered_layout,
+    "bfs": bfs_layout,
+}
+DEFAULT_LAYOUT = "layered"
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import threading
+import time
+
+import anthropic
+from tqdm import tqdm
+
+import metrics
+from llm_cache import LLMCache, request_key
+
+# Requests retried on 429 / overload / connection errors before giving up
+max_attempts = 5
+
+cache = LLMCache(os.path.join("temp", "llm_cache.sqlite3"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute.
+
+    reserve() always succeeds and returns how long the caller has to wait
+    before spending, so the bucket can be shared by every thread and event
+    loop in the process."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def adjust(self, amount):
+        # Correct an earlier reservation once the real cost is known
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """Process-wide LLM budget: concurrent requests, requests per minute and
+    tokens per minute. A 429 pauses every caller until retry-after."""
+
+    def __init__(self, concurrency, requests_per_minute, tokens_per_minute):
+        self.concurrency = concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.active = 0
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    async def acquire(self, estimated_tokens):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.active < self.concurrency and now >= self.paused_until:
+                    self.active += 1
+                    break
+                delay = max(self.paused_until - now, 0.02)
+            await asyncio.sleep(delay)
+        await asyncio.sleep(
+            max(self.requests.reserve(1), self.tokens.reserve(estimated_tokens))
+        )
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+limiter = RateLimiter(concurrency=8, requests_per_minute=50, tokens_per_minute=40000)
+
+
+def configure(concurrency, requests_per_minute, tokens_per_minute):
+    global limiter
+    limiter = RateLimiter(concurrency, requests_per_minute, tokens_per_minute)
+
+
+def new_async_client(base_url=None):
+    # api_key defaults to os.environ.get("ANTHROPIC_API_KEY")
+    return anthropic.AsyncAnthropic(
+        # base_url defaults to os.environ.get("ANTHROPIC_BASE_URL")
+        base_url=base_url,
+        # Retries go through the shared limiter instead
+        max_retries=0,
+    )
+
+
+def estimate_tokens(request):
+    """Rough input token count of a messages.create request (~4 chars per
+    token)."""
+    chars = sum(len(block["text"]) for block in request.get("system", []))
+    for message in request["messages"]:
+        chars += sum(len(block["text"]) for block in message["content"])
+    return chars // 4 + 1
+
+
+def retry_delay(error, attempt):
+    retry_after = None
+    if isinstance(error, anthropic.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(2**attempt, 60)
+
+
+async def send_request(client, request, progress, key, refresh, counts):
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            counts["cached"] += 1
+            metrics.record_llm_cached()
+            progress.update(1)
+            return cached
+
+    estimate = estimate_tokens(request)
+    start = time.perf_counter()
+    for attempt in range(max_attempts):
+        await limiter.acquire(estimate)
+        try:
+            message = await client.messages.create(**request)
+        except anthropic.RateLimitError as e:
+            limiter.pause(retry_delay(e, attempt))
+            metrics.record_api_error("rate_limit")
+            continue
+        except (
+            anthropic.APIConnectionError,
+            anthropic.InternalServerError,
+        ) as e:
+            metrics.record_api_error(
+                "connection"
+                if isinstance(e, anthropic.APIConnectionError)
+                else "server"
+            )
+            await asyncio.sleep(retry_delay(e, attempt))
+            continue
+        finally:
+            limiter.release()
+        usage = message.usage
+        limiter.tokens.adjust(usage.input_tokens + usage.output_tokens - estimate)
+        cache.put(key, message)
+        metrics.record_llm_response(message, time.perf_counter() - start)
+        progress.update(1)
+        return message
+    metrics.record_llm_unreachable()
+    progress.update(1)
+    print("CLAUDE UNREACHABLE after", max_attempts, "attempts")
+    return None
+
+
+async def run_requests(
+    requests, concurrency, base_url, keys, refresh, counts, on_result
+):
+    semaphore = asyncio.Semaphore(concurrency or len(requests) or 1)
+
+    async def bounded(client, i, progress):
+        async with semaphore:
+            message = await send_request(
+                client, requests[i], progress, keys[i], refresh[i], counts
+            )
+        if on_result is not None:
+            on_result(i, message)
+        return message
+
+    async with new_async_client(base_url) as client:
+        with tqdm(total=len(requests)) as progress:
+            return await asyncio.gather(
+                *(bounded(client, i, progress) for i in range(len(requests)))
+            )
+
+
+def create_messages(
+    requests,
+    concurrency=None,
+    base_url=None,
+    cache_keys=None,
+    refresh=False,
+    on_result=None,
+):
+    """Run messages.create for every request (a dict of keyword arguments)
+    concurrently under the shared rate limiter.
+
+    Responses are read from and written to the persistent cache under
+    cache_keys (default: the hash of each whole request). refresh=True
+    skips the lookup, e.g. when retrying a response that failed to parse;
+    a list of booleans does so per request.
+    on_result(i, message) is called as soon as request i has finished.
+
+    Returns the messages in the order of requests, with None for requests
+    that still failed after max_attempts."""
+    if not requests:
+        return []
+    if cache_keys is None:
+        cache_keys = [request_key(request) for request in requests]
+    if isinstance(refresh, bool):
+        refresh = [refresh] * len(requests)
+    counts = {"cached": 0}
+    messages = asyncio.run(
+        run_requests(
+            requests, concurrency, base_url, cache_keys, refresh, counts, on_result
+        )
+    )
+    print("LLM cache:", counts["cached"], "of", len(requests), "requests cached")
+    return messages
+
+
+def create_message(request, refresh=False):
+    """create_messages for one request. Raises RuntimeError if it still
+    failed after max_attempts, so single-request stages fail visibly."""
+    message = create_messages([request], refresh=refresh)[0]
+    if message is None:
+        raise RuntimeError(f"LLM request failed after {max_attempts} attempts")
+    return message
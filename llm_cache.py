@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import anthropic
+
+# Entries are evicted when older than max_age seconds, and oldest-used first
+# once the stored responses exceed max_bytes
+max_age = 180 * 24 * 60 * 60
+max_bytes = 512 * 1024 * 1024
+# Eviction runs on open and then after every this many writes
+evict_every = 200
+
+
+def request_key(request):
+    """SHA-256 of a messages.create request: model, temperature, max_tokens,
+    system prompt and messages."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Disk-backed cache of LLM responses keyed by request_key, stored in
+    SQLite so it survives restarts and is shared by every worker."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+            self.local.connection = connection
+            self.evict()
+        return self.local.connection
+
+    def get(self, key):
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        with connection:
+            connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        return anthropic.types.Message.model_validate_json(row[0])
+
+    def put(self, key, message):
+        response = message.model_dump_json()
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response), now, now),
+            )
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        connection = self.connection()
+        with connection:
+            connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - max_age,)
+            )
+            total = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+            if total > max_bytes:
+                # Drop least recently used entries until under the limit
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER "
+                    "(ORDER BY accessed DESC) AS running FROM responses) "
+                    "WHERE running > ?)",
+                    (max_bytes,),
+                )
+
+    def stats(self):
+        entries, size = (
+            self.connection()
+            .execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+            .fetchone()
+        )
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def clear(self):
+        with self.connection() as connection:
+            connection.execute("DELETE FROM responses")
+
+
+if __name__ == "__main__":
+    # python llm_cache.py [stats|evict|clear]
+    from llm import cache
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "evict":
+        cache.evict()
+    elif command == "clear":
+        cache.clear()
+    print(cache.stats())
@@ -0,0 +1,123 @@
+import re
+
+from references import build_reference_index, resolve_reference, split_reference
+
+# Merged ids are "<course>::<id>", course being the file name without .json
+separator = "::"
+
+# Words that don't tell named results or concepts apart
+name_stop_words = {
+    "a",
+    "an",
+    "the",
+    "of",
+    "s",
+    "theorem",
+    "lemma",
+    "proposition",
+    "corollary",
+    "definition",
+}
+name_word_pattern = re.compile(r"[a-z0-9]+")
+
+
+def course_label(file_name):
+    return file_name[: -len(".json")] if file_name.endswith(".json") else file_name
+
+
+def namespaced(course, id):
+    return f"{course}{separator}{id}"
+
+
+def name_key(text):
+    """Loose key for names of results and concepts, so "Fubini's Theorem"
+    matches "Fubini theorem" and "Banach spaces" matches "Banach space"."""
+    words = []
+    for word in name_word_pattern.findall(str(text).lower().replace("'s", "")):
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word not in name_stop_words:
+            words.append(word)
+    return " ".join(words)
+
+
+def reference_name_key(reference):
+    # "Theorem 3.1" only makes sense inside its own course; "Theorem 3.1
+    # (Hahn-Banach)" and "the Hahn-Banach theorem" name a result
+    split = split_reference(str(reference))
+    if split is not None:
+        return name_key(split[1]) if split[1] else ""
+    return name_key(reference)
+
+
+def merge_courses(courses):
+    """Merge courses, a list of (file name, statements), into one list of
+    statements with namespaced ids.
+
+    References are first resolved within their own course. Cross-course
+    links come from two inverted indexes over every merged course: named
+    results (a reference its course can't resolve, matched to a statement
+    of that name elsewhere) and preconditions (matched to a definition of
+    that concept in another course, when the statement's own course defines
+    none). They are added to previous_results and listed in the returned
+    cross_links as {source, target, via, key}."""
+    labels = [course_label(name) for name, _ in courses]
+    named, defined = {}, {}
+    for course, (_, claude_list) in zip(labels, courses):
+        for thingy in claude_list:
+            key = name_key(thingy.get("name", ""))
+            if not key:
+                continue
+            id = namespaced(course, thingy["id"])
+            named.setdefault(key, []).append((course, id))
+            if str(thingy.get("type", "")).lower() == "definition":
+                defined.setdefault(key, []).append((course, id))
+
+    merged, cross_links = [], []
+    for course, (_, claude_list) in zip(labels, courses):
+        index = build_reference_index(claude_list)
+        for thingy in claude_list:
+            id = namespaced(course, thingy["id"])
+            previous_results = []
+            for reference in thingy.get("previous_results", []):
+                source = resolve_reference(index, str(reference))
+                if source is not None:
+                    previous_results.append(namespaced(course, source))
+                    continue
+                key = reference_name_key(reference)
+                providers = [p for c, p in named.get(key, []) if c != course]
+                if key and providers:
+                    previous_results.append(providers[0])
+                    cross_links.append(
+                        dict(source=providers[0], target=id, via="name", key=reference)
+                    )
+                else:
+                    # Left as is, so it is still reported as unresolved
+                    previous_results.append(reference)
+
+            for precondition in thingy.get("preconditions", []):
+                providers = defined.get(name_key(precondition), [])
+                if not providers or any(c == course for c, _ in providers):
+                    continue
+                source = providers[0][1]
+                if source not in previous_results:
+                    previous_results.append(source)
+                    cross_links.append(
+                        dict(
+                            source=source,
+                            target=id,
+                            via="precondition",
+                            key=precondition,
+                        )
+                    )
+
+            merged.append(
+                dict(
+                    thingy,
+                    id=id,
+                    course=course,
+                    local_id=thingy["id"],
+                    previous_results=previous_results,
+                )
+            )
+    return merged, cross_links
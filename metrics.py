@@ -0,0 +1,297 @@
+"""Counters and histograms for ingestion and serving, rendered in the
+Prometheus text format, plus per-stage records for each job's report.
+
+run_stage runs every pipeline stage inside stage(name), so whatever the
+stage's thread records (LLM calls, API errors, replies that fail to parse)
+is labelled with the stage and added to that run's StageMetrics."""
+
+import contextvars
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets for durations and sizes
+seconds_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+bytes_buckets = (1 << 10, 1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20, 1 << 22, 1 << 24)
+
+registry = []
+
+
+def label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def selector(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{label_value(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key in sorted(self.values):
+                lines += self.sample_lines(key, self.values[key])
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def sample_lines(self, key, value):
+        return [f"{self.name}{self.selector(key)} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=seconds_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # Count per bucket (the last one is +Inf), sum, count
+            counts, total, n = self.values.get(
+                key, ([0] * (len(self.buckets) + 1), 0, 0)
+            )
+            bucket = next(
+                (i for i, bound in enumerate(self.buckets) if value <= bound),
+                len(self.buckets),
+            )
+            counts[bucket] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    def sample_lines(self, key, value):
+        counts, total, n = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            selector = self.selector(key, [("le", bound)])
+            lines.append(f"{self.name}_bucket{selector} {cumulative}")
+        lines.append(f"{self.name}_sum{self.selector(key)} {total}")
+        lines.append(f"{self.name}_count{self.selector(key)} {n}")
+        return lines
+
+
+def render():
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+stage_seconds = Histogram(
+    "ingest_stage_seconds", "Wall time of pipeline stage runs.", ["stage", "status"]
+)
+stage_skips = Counter(
+    "ingest_stage_skips_total",
+    "Pipeline stages skipped because their inputs were unchanged.",
+    ["stage"],
+)
+llm_requests = Counter(
+    "llm_requests_total",
+    "LLM requests by outcome: ok, cached (served from the response cache) "
+    "or unreachable (failed max_attempts times).",
+    ["stage", "outcome"],
+)
+llm_request_seconds = Histogram(
+    "llm_request_seconds",
+    "Wall time of answered LLM requests, queueing and retries included.",
+    ["stage"],
+)
+llm_api_errors = Counter(
+    "llm_api_errors_total",
+    "Failed LLM API calls (each retried until max_attempts) by reason.",
+    ["stage", "reason"],
+)
+llm_parse_failures = Counter(
+    "llm_parse_failures_total",
+    "LLM replies that could not be parsed as the stage expected.",
+    ["stage"],
+)
+llm_tokens = Counter(
+    "llm_tokens_total",
+    "Tokens billed by kind: input (uncached), output, cache_read and "
+    "cache_creation (prompt caching).",
+    ["stage", "kind"],
+)
+http_request_seconds = Histogram(
+    "http_request_seconds",
+    "Latency of HTTP requests until the response is ready.",
+    ["endpoint", "method", "status"],
+)
+http_response_bytes = Histogram(
+    "http_response_bytes",
+    "Size of HTTP response bodies as sent (compressed if they are).",
+    ["endpoint"],
+    bytes_buckets,
+)
+graph_build_seconds = Histogram(
+    "graph_build_seconds",
+    "Time to build and serialize a graph response body.",
+    ["layout", "compact"],
+)
+graph_payload_bytes = Histogram(
+    "graph_payload_bytes",
+    "Size of graph response bodies as built, before compression.",
+    ["layout", "compact"],
+    bytes_buckets,
+)
+
+
+class StageMetrics:
+    """What one run of a pipeline stage did, for the job's report."""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = dict(
+            llm_requests=0,
+            cached_requests=0,
+            unreachable_requests=0,
+            api_errors=0,
+            parse_failures=0,
+            llm_seconds=0.0,
+            input_tokens=0,
+            output_tokens=0,
+            cache_read_input_tokens=0,
+            cache_creation_input_tokens=0,
+        )
+        self.lock = threading.Lock()
+
+    def add(self, **amounts):
+        with self.lock:
+            for key, amount in amounts.items():
+                self.counts[key] += amount
+
+
+current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+@contextmanager
+def stage(name):
+    # asyncio tasks copy the context, so LLM calls made under
+    # llm.create_messages are still attributed to this stage
+    record = StageMetrics(name)
+    token = current_stage.set(record)
+    try:
+        yield record
+    finally:
+        current_stage.reset(token)
+
+
+def record(**amounts):
+    current = current_stage.get()
+    if current is not None:
+        current.add(**amounts)
+
+
+def stage_label():
+    current = current_stage.get()
+    return "none" if current is None else current.name
+
+
+def record_llm_response(message, seconds):
+    usage = message.usage
+    tokens = dict(
+        input=usage.input_tokens,
+        output=usage.output_tokens,
+        cache_read=usage.cache_read_input_tokens or 0,
+        cache_creation=usage.cache_creation_input_tokens or 0,
+    )
+    label = stage_label()
+    llm_requests.inc(stage=label, outcome="ok")
+    llm_request_seconds.observe(seconds, stage=label)
+    for kind, amount in tokens.items():
+        llm_tokens.inc(amount, stage=label, kind=kind)
+    record(
+        llm_requests=1,
+        llm_seconds=seconds,
+        input_tokens=tokens["input"],
+        output_tokens=tokens["output"],
+        cache_read_input_tokens=tokens["cache_read"],
+        cache_creation_input_tokens=tokens["cache_creation"],
+    )
+
+
+def record_llm_cached():
+    llm_requests.inc(stage=stage_label(), outcome="cached")
+    record(cached_requests=1)
+
+
+def record_llm_unreachable():
+    llm_requests.inc(stage=stage_label(), outcome="unreachable")
+    record(unreachable_requests=1)
+
+
+def record_api_error(reason):
+    llm_api_errors.inc(stage=stage_label(), reason=reason)
+    record(api_errors=1)
+
+
+def record_parse_failure():
+    llm_parse_failures.inc(stage=stage_label())
+    record(parse_failures=1)
+
+
+def save_stage_report(workspace, stage, status, seconds):
+    """Record a stage run in the workspace's metrics.json, which keeps the
+    last run of every stage."""
+    path = os.path.join(workspace, "metrics.json")
+    stages = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            stages = json.load(f)
+    stages[stage.name] = dict(status=status, seconds=seconds, **stage.counts)
+    with open(path + ".tmp", "w") as f:
+        json.dump(stages, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def job_report(workspace):
+    """The stages of metrics.json with their totals, and the share of
+    prompt tokens read from the prompt cache. None if no stage has run."""
+    path = os.path.join(workspace, "metrics.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        stages = json.load(f)
+    totals = {}
+    for counts in stages.values():
+        for key, value in counts.items():
+            if key != "status":
+                totals[key] = totals.get(key, 0) + value
+    prompt_tokens = sum(
+        totals.get(key, 0)
+        for key in (
+            "input_tokens",
+            "cache_read_input_tokens",
+            "cache_creation_input_tokens",
+        )
+    )
+    cache_read = totals.get("cache_read_input_tokens", 0)
+    return dict(
+        stages=stages,
+        totals=totals,
+        prompt_cache_hit_ratio=(
+            round(cache_read / prompt_tokens, 4) if prompt_tokens else None
+        ),
+    )
@@ -0,0 +1,114 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+# Pages handed to a worker at a time
+pages_per_chunk = 8
+# Starting a pool of spawned workers (each importing pdfminer and opening
+# the document) costs about as much as extracting this many pages, so
+# shorter documents are extracted in this process unless a pool is given
+min_parallel_pages = 200
+
+# Documents last opened by this process, least recently used first.
+# Workers are reused across chunks (and documents, when a pool is shared),
+# so each one walks a page tree once instead of once per chunk.
+open_documents = {}
+max_open_documents = 4
+
+
+def count_pages(path):
+    # Walks the page tree as extract_text does rather than trusting the
+    # catalog's /Count, which can be wrong; get_pages also applies
+    # extract_text's extractability check (a warning) once per document
+    with open(path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def document_pages(path):
+    key = (path, os.path.getmtime(path))
+    if key in open_documents:
+        open_documents[key] = open_documents.pop(key)
+    else:
+        f = open(path, "rb")
+        open_documents[key] = (f, list(PDFPage.create_pages(PDFDocument(PDFParser(f)))))
+        while len(open_documents) > max_open_documents:
+            open_documents.pop(next(iter(open_documents)))[0].close()
+    return open_documents[key][1]
+
+
+def extract_pages(pages):
+    # Same text (including the form feed after every page) that
+    # pdfminer's extract_text produces for these pages
+    with StringIO() as output:
+        manager = PDFResourceManager(caching=True)
+        device = TextConverter(manager, output, codec="utf-8", laparams=LAParams())
+        interpreter = PDFPageInterpreter(manager, device)
+        for page in pages:
+            interpreter.process_page(page)
+        return output.getvalue()
+
+
+def extract_page_range(path, start, stop):
+    return extract_pages(document_pages(path)[start:stop])
+
+
+def iter_page_chunks(path, workers=None, chunk_pages=pages_per_chunk, pool=None):
+    """Yield the text of path in order, chunk_pages pages at a time,
+    extracting chunks in parallel worker processes. At most two chunks per
+    worker are in flight, so memory stays bounded on long documents.
+    "".join() of the chunks equals extract_text(path).
+
+    pool: a process pool to extract in instead of starting one, e.g. one
+    shared by several documents (workers then sets how many chunks of this
+    document may be in flight). Without one, documents shorter than
+    min_parallel_pages are extracted serially."""
+    n_pages = count_pages(path)
+    ranges = [
+        (start, min(start + chunk_pages, n_pages))
+        for start in range(0, n_pages, chunk_pages)
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+    if pool is not None:
+        yield from chunks_in_order(pool, path, ranges, 2 * workers)
+        return
+    if workers <= 1 or n_pages < min_parallel_pages or len(ranges) < 2 * workers:
+        with open(path, "rb") as f:
+            pages = PDFPage.get_pages(f)
+            chunk = []
+            for page in pages:
+                chunk.append(page)
+                if len(chunk) == chunk_pages:
+                    yield extract_pages(chunk)
+                    chunk = []
+            if chunk:
+                yield extract_pages(chunk)
+        return
+
+    # spawn rather than fork: the server process has other threads running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        yield from chunks_in_order(pool, path, ranges, 2 * workers)
+
+
+def chunks_in_order(pool, path, ranges, in_flight):
+    pending = deque()
+    ranges = iter(ranges)
+    for start, stop in ranges:
+        pending.append(pool.submit(extract_page_range, path, start, stop))
+        if len(pending) >= in_flight:
+            break
+    while pending:
+        text = pending.popleft().result()
+        for start, stop in ranges:
+            pending.append(pool.submit(extract_page_range, path, start, stop))
+            break
+        yield text
@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import metrics
+from claude import (
+    apply_preconditions,
+    cluster_topics,
+    get_big_json,
+    get_preconditions,
+    regex_on_theorems,
+    remove_dups,
+    temp_dir,
+)
+from pdf_text import iter_page_chunks
+
+# function is called with the workspace directory; inputs and outputs are
+# file names inside it. Stages with events=True are also passed on_event,
+# which they call with (event, data) for partial results.
+Stage = namedtuple(
+    "Stage", ["name", "function", "inputs", "outputs", "events"], defaults=[False]
+)
+
+
+def extract_pdf_text(workspace, pool=None):
+    # Pages are extracted in parallel (in pool, if given) and streamed to
+    # text.txt while the statements in them are detected, so the text is
+    # never held whole
+    with open(os.path.join(workspace, "text.txt"), "w", encoding="utf-8") as f:
+
+        def pages():
+            path = os.path.join(workspace, "upload.pdf")
+            for chunk in iter_page_chunks(path, pool=pool):
+                f.write(chunk)
+                yield chunk
+
+        regex_on_theorems(pages(), workspace)
+
+
+def use_saved_summary(workspace):
+    # DEV: skip the LLM stages and serve the last summary built in temp/
+    shutil.copy(
+        os.path.join(temp_dir, "final_summary.json"),
+        os.path.join(workspace, "final_summary.json"),
+    )
+
+
+PIPELINE_STAGES = [
+    Stage(
+        "extract_text",
+        extract_pdf_text,
+        ["upload.pdf"],
+        ["text.txt", "data.json", "statements.json"],
+    ),
+    Stage("get_preconditions", get_preconditions, ["data.json"], ["preconditions.txt"]),
+    Stage(
+        "get_big_json",
+        get_big_json,
+        ["data.json"],
+        ["summary.json", "summary_report.json"],
+        events=True,
+    ),
+    Stage(
+        "apply_preconditions",
+        apply_preconditions,
+        ["summary.json", "preconditions.txt"],
+        ["summary_preconditions.json", "precondition_report.json"],
+    ),
+    Stage(
+        "cluster_topics",
+        cluster_topics,
+        ["summary_preconditions.json"],
+        ["topic_modded_summary.json"],
+    ),
+    Stage(
+        "remove_dups",
+        remove_dups,
+        ["topic_modded_summary.json"],
+        ["final_summary.json", "dedup_report.json"],
+    ),
+]
+DEV_STAGES = [
+    Stage(
+        "extract_text",
+        extract_pdf_text,
+        ["upload.pdf"],
+        ["text.txt", "data.json", "statements.json"],
+    ),
+    Stage("use_saved_summary", use_saved_summary, [], ["final_summary.json"]),
+]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(workspace):
+    path = os.path.join(workspace, "manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(workspace, manifest):
+    path = os.path.join(workspace, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def input_hashes(stage, workspace):
+    return {name: file_hash(os.path.join(workspace, name)) for name in stage.inputs}
+
+
+def is_up_to_date(stage, workspace, manifest):
+    """A stage can be skipped when it last succeeded on inputs with the same
+    hashes as now and its outputs are still there."""
+    record = manifest.get(stage.name)
+    if record is None or record["status"] != "done":
+        return False
+    if any(not os.path.exists(os.path.join(workspace, name)) for name in stage.outputs):
+        return False
+    return record["inputs"] == input_hashes(stage, workspace)
+
+
+def run_stage(stage, workspace, manifest, on_event=None):
+    inputs = input_hashes(stage, workspace)
+    start = time.time()
+    manifest[stage.name] = {"status": "running", "inputs": inputs, "started": start}
+    save_manifest(workspace, manifest)
+    # Outputs from an earlier run must not count as this run's result
+    for name in stage.outputs:
+        if os.path.exists(os.path.join(workspace, name)):
+            os.remove(os.path.join(workspace, name))
+
+    # LLM calls and parse failures inside the stage are recorded in record
+    with metrics.stage(stage.name) as record:
+        try:
+            if stage.events:
+                stage.function(workspace, on_event=on_event)
+            else:
+                stage.function(workspace)
+            missing = [
+                name
+                for name in stage.outputs
+                if not os.path.exists(os.path.join(workspace, name))
+            ]
+            if missing:
+                raise RuntimeError(f"{stage.name} did not write {', '.join(missing)}")
+        except Exception as e:
+            seconds = time.time() - start
+            manifest[stage.name].update(status="failed", error=str(e), seconds=seconds)
+            save_manifest(workspace, manifest)
+            record_stage(workspace, record, "failed", seconds)
+            raise
+
+    seconds = time.time() - start
+    manifest[stage.name].update(
+        status="done",
+        outputs={
+            name: file_hash(os.path.join(workspace, name)) for name in stage.outputs
+        },
+        seconds=seconds,
+    )
+    save_manifest(workspace, manifest)
+    record_stage(workspace, record, "done", seconds)
+
+
+def record_stage(workspace, record, status, seconds):
+    metrics.stage_seconds.observe(seconds, stage=record.name, status=status)
+    metrics.save_stage_report(workspace, record, status, seconds)
+
+
+def run_pipeline(stages, workspace, on_stage=None, force=(), on_event=None):
+    """Run stages in order, skipping those whose inputs are unchanged since
+    their last successful run. After a failure, calling this again resumes
+    at the failed stage. Stage names in force always rerun.
+
+    on_stage(i, name) is called before each stage, on_event(event, data)
+    with the partial results of stages that stream them."""
+    manifest = load_manifest(workspace)
+    for i, stage in enumerate(stages):
+        if on_stage is not None:
+            on_stage(i, stage.name)
+        if stage.name not in force and is_up_to_date(stage, workspace, manifest):
+            print("Skipping", stage.name, "(inputs unchanged)")
+            metrics.stage_skips.inc(stage=stage.name)
+            continue
+        print("Running", stage.name)
+        run_stage(stage, workspace, manifest, on_event)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the ingestion pipeline in a workspace directory, "
+        "skipping stages whose inputs have not changed."
+    )
+    parser.add_argument("workspace", nargs="?", default=temp_dir)
+    parser.add_argument("--pdf", help="copy this PDF into the workspace first")
+    parser.add_argument(
+        "--stage",
+        choices=[stage.name for stage in PIPELINE_STAGES],
+        help="rerun only this stage",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="rerun every stage regardless"
+    )
+    parser.add_argument("--status", action="store_true", help="print the manifest")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(load_manifest(args.workspace), indent=4))
+        return
+    os.makedirs(args.workspace, exist_ok=True)
+    if args.pdf:
+        shutil.copy(args.pdf, os.path.join(args.workspace, "upload.pdf"))
+
+    if args.stage:
+        stage = next(stage for stage in PIPELINE_STAGES if stage.name == args.stage)
+        run_stage(stage, args.workspace, load_manifest(args.workspace))
+    else:
+        force = [stage.name for stage in PIPELINE_STAGES] if args.force else ()
+        run_pipeline(PIPELINE_STAGES, args.workspace, force=force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import ast
+import json
+import re
+
+import numpy as np
+from json_repair import repair_json
+
+# Texts are compared on character n-grams of their words (padded with
+# spaces), so "martingales" still matches "martingale"
+ngram_size = 4
+# A precondition's score for a statement is the IDF-weighted fraction of its
+# n-grams found in the statement. Scores disagree with the LLM too often to
+# take any match on them alone (on the saved courses a score of 1.0 is right
+# 45-91% of the time), so they only rank the preconditions pointed out to
+# the LLM: at most shortlist_size of those scoring min_score or more.
+min_score = 0.2
+shortlist_size = 10
+# Statements scored per block of the similarity product
+score_block = 1024
+
+word_pattern = re.compile(r"[^\W\d_]+")
+
+
+def ngrams(text):
+    grams = set()
+    for word in word_pattern.findall(text.lower()):
+        word = f" {word} "
+        grams.update(
+            word[i : i + ngram_size] for i in range(max(len(word) - ngram_size, 0) + 1)
+        )
+    return grams
+
+
+def parse_precondition_list(raw_string):
+    # preconditions.txt holds the LLM's Python (or JSON) list of strings
+    try:
+        preconditions = ast.literal_eval(raw_string.strip())
+    except (ValueError, SyntaxError):
+        preconditions = json.loads(repair_json(raw_string))
+    return list(dict.fromkeys(str(p) for p in preconditions if str(p).strip()))
+
+
+def containment_scores(statements, preconditions):
+    """(len(statements), len(preconditions)) float32 matrix of weighted
+    containment: the share of each precondition's n-grams, weighted by their
+    inverse document frequency over the statements, found in each statement."""
+    precondition_grams = [ngrams(p) for p in preconditions]
+    vocabulary = {
+        gram: i for i, gram in enumerate(sorted(set().union(*precondition_grams)))
+    }
+    # Only n-grams that occur in some precondition matter
+    statement_columns = [
+        np.array([vocabulary[g] for g in ngrams(s) if g in vocabulary], dtype=np.int64)
+        for s in statements
+    ]
+    document_frequency = np.bincount(
+        np.concatenate([np.zeros(0, dtype=np.int64)] + statement_columns),
+        minlength=len(vocabulary),
+    )
+    idf = np.log((1 + len(statements)) / (1 + document_frequency)) + 1
+
+    weights = np.zeros((len(preconditions), len(vocabulary)), dtype=np.float32)
+    for row, grams in enumerate(precondition_grams):
+        columns = [vocabulary[g] for g in grams]
+        weights[row, columns] = idf[columns]
+    weights /= np.maximum(weights.sum(axis=1, keepdims=True), 1e-12)
+
+    scores = np.empty((len(statements), len(preconditions)), dtype=np.float32)
+    for start in range(0, len(statements), score_block):
+        block = statement_columns[start : start + score_block]
+        present = np.zeros((len(block), len(vocabulary)), dtype=np.float32)
+        rows = np.repeat(np.arange(len(block)), [len(c) for c in block])
+        present[rows, np.concatenate([np.zeros(0, dtype=np.int64)] + block)] = 1
+        scores[start : start + len(block)] = present @ weights.T
+    # Rounding so an exact match scores exactly 1.0
+    return np.round(scores, 4)
+
+
+def shortlists(scores):
+    """For each statement (row of scores), the indices of the preconditions
+    most likely to apply, best first. The LLM is pointed at these but
+    chooses from the whole list, so one the matcher misses can still be
+    chosen."""
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :shortlist_size]
+    return [
+        [int(c) for c in ranked if row[c] >= min_score]
+        for row, ranked in zip(scores, order)
+    ]
+
+
+def agreement(predicted, reference):
+    """How closely per-statement precondition lists match reference lists:
+    micro precision/recall/F1 over (statement, precondition) pairs, the
+    share of statements with identical sets and the mean Jaccard index."""
+    true_positives = predicted_total = reference_total = exact = 0
+    jaccard_total = 0.0
+    for mine, theirs in zip(predicted, reference):
+        mine, theirs = set(mine), set(theirs)
+        true_positives += len(mine & theirs)
+        predicted_total += len(mine)
+        reference_total += len(theirs)
+        exact += mine == theirs
+        jaccard_total += len(mine & theirs) / len(mine | theirs) if mine | theirs else 1
+    precision = true_positives / predicted_total if predicted_total else 1.0
+    recall = true_positives / reference_total if reference_total else 1.0
+    return {
+        "statements": len(reference),
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / (precision + recall or 1), 4),
+        "exact_match": round(exact / max(len(reference), 1), 4),
+        "mean_jaccard": round(jaccard_total / max(len(reference), 1), 4),
+    }
@@ -0,0 +1,128 @@
+from collections import deque
+
+import numpy as np
+
+from dag import condensation
+
+
+def packed_closure(n, sources, order):
+    """Row c: packed bitset (np.packbits bit order) of c and every component
+    with a path to it through sources, where sources[c] lists the
+    components whose rows are OR-ed into c. order visits each component
+    after all of its sources."""
+    # Rows padded to whole 64-bit words so they can be OR-ed as uint64
+    width = (n + 63) // 64 * 8
+    closure = np.zeros((n, width), dtype=np.uint8)
+    components = np.arange(n)
+    closure[components, components >> 3] = 0x80 >> (components & 7)
+    words = closure.view(np.uint64)
+    for c in order:
+        if sources[c]:
+            words[c] |= np.bitwise_or.reduce(words[sources[c]], axis=0)
+    return closure
+
+
+class ReachabilityIndex:
+    """Transitive prerequisites and consequences of every statement.
+
+    Cycles of references are collapsed into strongly connected components,
+    numbered in topological order (prerequisites first). For each component,
+    one packed bitset holds the components that reach it and another the
+    components it reaches, so closures are a row lookup and reachability
+    is a bit test."""
+
+    def __init__(self, vertices, edges):
+        self.ids = list(vertices)
+        self.position = {id: i for i, id in enumerate(self.ids)}
+        pairs = [
+            (self.position[source], self.position[target]) for source, target in edges
+        ]
+        self.successors = [[] for _ in self.ids]
+        for source, target in pairs:
+            self.successors[source].append(target)
+
+        self.component_of, self.components, component_edges = condensation(
+            len(self.ids), pairs
+        )
+        n = len(self.components)
+        before = [[] for _ in range(n)]
+        after = [[] for _ in range(n)]
+        for source, target in component_edges:
+            before[target].append(source)
+            after[source].append(target)
+        self.ancestors = packed_closure(n, before, range(n))
+        self.descendants = packed_closure(n, after, range(n - 1, -1, -1))
+
+        # Vertices in topological order and their components, to expand a
+        # row of component bits into ids without a Python loop
+        self.topological = np.array(
+            [v for members in self.components for v in members], dtype=np.int64
+        )
+        self.topological_component = np.array(self.component_of)[self.topological]
+        self.id_array = np.empty(len(self.ids), dtype=object)
+        self.id_array[:] = self.ids
+
+    @property
+    def nbytes(self):
+        return self.ancestors.nbytes + self.descendants.nbytes + 64 * len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.position
+
+    def expand(self, row, exclude):
+        bits = np.unpackbits(row, count=len(self.components)).view(bool)
+        vertices = self.topological[bits[self.topological_component]]
+        return self.id_array[vertices[vertices != exclude]].tolist()
+
+    def prerequisites(self, id):
+        """Everything id depends on, transitively, in topological order."""
+        v = self.position[id]
+        return self.expand(self.ancestors[self.component_of[v]], v)
+
+    def consequences(self, id):
+        """Everything that depends on id, transitively, in topological order."""
+        v = self.position[id]
+        return self.expand(self.descendants[self.component_of[v]], v)
+
+    def reaches(self, source, target):
+        # Whether target depends on source, transitively
+        c = self.component_of[self.position[source]]
+        row = self.ancestors[self.component_of[self.position[target]]]
+        return bool(row[c >> 3] & (0x80 >> (c & 7)))
+
+    def shortest_chain(self, source, target):
+        """Shortest list of ids from source to target following
+        dependencies (each depends on the one before), or None."""
+        if not self.reaches(source, target):
+            return None
+        start, goal = self.position[source], self.position[target]
+        goal_row = self.ancestors[self.component_of[goal]].tobytes()
+        parent = {start: None}
+        queue = deque([start])
+        while queue:
+            v = queue.popleft()
+            if v == goal:
+                chain = []
+                while v is not None:
+                    chain.append(self.ids[v])
+                    v = parent[v]
+                return chain[::-1]
+            for w in self.successors[v]:
+                c = self.component_of[w]
+                # Only step onto statements the target depends on
+                if w not in parent and goal_row[c >> 3] & (0x80 >> (c & 7)):
+                    parent[w] = v
+                    queue.append(w)
+        return None
+
+    def learning_path(self, id, known=()):
+        """The prerequisites of id still to learn when the known results
+        (and everything they depend on) are already understood, in an
+        order where each comes after its own prerequisites."""
+        v = self.position[id]
+        row = self.ancestors[self.component_of[v]]
+        known = [self.component_of[self.position[k]] for k in known if k in self]
+        if known:
+            # Rows include their own component, so known results drop too
+            row = row & ~np.bitwise_or.reduce(self.ancestors[known], axis=0)
+        return self.expand(row, v)
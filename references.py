@@ -0,0 +1,102 @@
+import re
+
+# Abbreviations the LLM (and lecture notes) use for statement kinds
+KIND_ALIASES = {
+    "thm": "theorem",
+    "theo": "theorem",
+    "theorem": "theorem",
+    "prop": "proposition",
+    "proposition": "proposition",
+    "lem": "lemma",
+    "lemma": "lemma",
+    "cor": "corollary",
+    "coro": "corollary",
+    "corollary": "corollary",
+    "def": "definition",
+    "defn": "definition",
+    "definition": "definition",
+    "ex": "example",
+    "example": "example",
+    "rem": "remark",
+    "rmk": "remark",
+    "remark": "remark",
+    "claim": "claim",
+}
+
+# "Thm. 2.04(ii)" -> kind "thm", number "2.04", rest "(ii)"
+numbered_pattern = re.compile(r"^([a-z]+)\.?\s*\(?(\d+(?:[.\-]\d+)*)\)?\.?\s*(.*)$")
+whitespace_pattern = re.compile(r"[\s~ ]+")
+
+
+def split_reference(reference):
+    """Return (normalized "kind number", normalized remainder) or None if
+    the reference is not of the form "Keyword N"."""
+    text = whitespace_pattern.sub(" ", reference.lower()).strip(" .,:;")
+    match = numbered_pattern.match(text)
+    if not match:
+        return None
+    kind, number, rest = match.groups()
+    kind = KIND_ALIASES.get(kind, kind)
+    number = ".".join(str(int(part)) for part in re.split(r"[.\-]", number))
+    return kind + " " + number, rest.strip(" .,:;")
+
+
+def normalize_reference(reference):
+    """Canonical form of a statement id, name or reference so that
+    "Thm. 2.04", "theorem  2.4" and "Theorem 2.4" compare equal."""
+    split = split_reference(reference)
+    if split is None:
+        return whitespace_pattern.sub(" ", reference.lower()).strip(" .,:;")
+    head, rest = split
+    return head + " " + rest if rest else head
+
+
+def build_reference_index(claude_list):
+    """Index every statement by raw id, normalized id and normalized name.
+    The first statement wins when two share a key."""
+    index = {}
+    for thingy in claude_list:
+        index.setdefault(thingy["id"], thingy["id"])
+    for thingy in claude_list:
+        index.setdefault(normalize_reference(thingy["id"]), thingy["id"])
+    for thingy in claude_list:
+        if thingy.get("name"):
+            index.setdefault(normalize_reference(thingy["name"]), thingy["id"])
+    return index
+
+
+def resolve_reference(index, reference):
+    if reference in index:
+        return index[reference]
+    normalized = normalize_reference(reference)
+    if normalized in index:
+        return index[normalized]
+    # "Theorem 2.4(ii)" or "Theorem 2.4 (Hahn-Banach)" -> "theorem 2.4"
+    split = split_reference(reference)
+    if split is not None and split[0] in index:
+        return index[split[0]]
+    return None
+
+
+def resolve_references(claude_list, index=None):
+    """Resolve every previous_results entry to a statement id in one pass.
+
+    Returns (edges, unresolved) where edges is a list of (source, target) id
+    pairs meaning target depends on source, and unresolved lists the
+    references that did not match any statement."""
+    if index is None:
+        index = build_reference_index(claude_list)
+    edges = []
+    seen = set()
+    unresolved = []
+    for thingy in claude_list:
+        for reference in thingy.get("previous_results", []):
+            source = resolve_reference(index, reference)
+            if source is None:
+                unresolved.append({"id": thingy["id"], "reference": reference})
+                continue
+            edge = (source, thingy["id"])
+            if source != thingy["id"] and edge not in seen:
+                seen.add(edge)
+                edges.append(edge)
+    return edges, unresolved
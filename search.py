@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+# Directory contents are re-checked for changed files at most this often
+refresh_interval = 2.0
+# BM25 weight of each indexed column: id, name, statement, proof,
+# preconditions (course, type and topic are stored but not searched)
+column_weights = {
+    "theorem_id": 5.0,
+    "name": 4.0,
+    "statement": 2.0,
+    "proof": 1.0,
+    "preconditions": 2.0,
+}
+term_pattern = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def match_expression(query):
+    """FTS5 MATCH expression for a user query: every word (or "quoted
+    phrase") must appear; a trailing * makes a word a prefix."""
+    terms = []
+    for phrase, word in term_pattern.findall(query):
+        text = (phrase or word).replace('"', "")
+        prefix = word.endswith("*") and len(text) > 1
+        text = text.rstrip("*").strip()
+        if text:
+            terms.append(f'"{text}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """Full-text index over the theorems of every course JSON in a
+    directory, in SQLite FTS5 with BM25 ranking. A course file is
+    re-indexed when its mtime or size changes, and dropped when it is
+    deleted."""
+
+    def __init__(self, path, courses_dir):
+        self.path = path
+        self.courses_dir = courses_dir
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.checked = 0.0
+
+    def connection(self):
+        if getattr(self.local, "connection", None) is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "course TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, "
+                "size INTEGER NOT NULL)"
+            )
+            connection.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS theorems USING fts5("
+                "course UNINDEXED, type UNINDEXED, topic UNINDEXED, "
+                + ", ".join(column_weights)
+                + ", tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            self.local.connection = connection
+        return self.local.connection
+
+    def refresh(self, force=False):
+        """Re-index course files added, changed or removed since the last
+        refresh. Returns the names of the courses re-indexed."""
+        with self.lock:
+            if not force and time.monotonic() - self.checked < refresh_interval:
+                return []
+            self.checked = time.monotonic()
+            connection = self.connection()
+            indexed = {
+                course: (mtime_ns, size)
+                for course, mtime_ns, size in connection.execute("SELECT * FROM files")
+            }
+            current = {}
+            for course in os.listdir(self.courses_dir):
+                if course.endswith(".json"):
+                    stat = os.stat(os.path.join(self.courses_dir, course))
+                    current[course] = (stat.st_mtime_ns, stat.st_size)
+
+            changed = [c for c in current if indexed.get(c) != current[c]]
+            removed = [c for c in indexed if c not in current]
+            with connection:
+                for course in changed + removed:
+                    connection.execute(
+                        "DELETE FROM theorems WHERE course = ?", (course,)
+                    )
+                    connection.execute("DELETE FROM files WHERE course = ?", (course,))
+                for course in changed:
+                    self.index_course(connection, course, *current[course])
+            return changed
+
+    def index_course(self, connection, course, mtime_ns, size):
+        with open(os.path.join(self.courses_dir, course), "r", encoding="utf-8") as f:
+            claude_list = json.load(f)
+        connection.executemany(
+            "INSERT INTO theorems VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    course,
+                    thingy.get("type"),
+                    thingy.get("topic"),
+                    thingy["id"],
+                    thingy.get("name", ""),
+                    thingy.get("statement", ""),
+                    thingy.get("proof", ""),
+                    "\n".join(map(str, thingy.get("preconditions", []))),
+                )
+                for thingy in claude_list
+            ],
+        )
+        connection.execute(
+            "INSERT INTO files VALUES (?, ?, ?)", (course, mtime_ns, size)
+        )
+
+    def search(self, query, limit=20, course=None):
+        """Best matches first: dicts with course, id, name, type, topic, a
+        snippet of the statement with matches in [brackets], and score
+        (BM25, lower is better)."""
+        self.refresh()
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = (
+            "SELECT course, theorem_id, name, type, topic, "
+            "snippet(theorems, 5, '[', ']', '...', 16), bm25(theorems, 0, 0, 0, "
+            + ", ".join(str(weight) for weight in column_weights.values())
+            + ") AS score FROM theorems WHERE theorems MATCH ?"
+        )
+        parameters = [expression]
+        if course is not None:
+            sql += " AND course = ?"
+            parameters.append(course)
+        sql += " ORDER BY score LIMIT ?"
+        parameters.append(limit)
+        return [
+            {
+                "course": row[0],
+                "id": row[1],
+                "name": row[2],
+                "type": row[3],
+                "topic": row[4],
+                "snippet": row[5],
+                "score": round(row[6], 4),
+            }
+            for row in self.connection().execute(sql, parameters)
+        ]
+
+
+if __name__ == "__main__":
+    # python search.py [query...]: rebuild the index, then search it
+    index = SearchIndex(os.path.join("temp", "search.sqlite3"), "saved_course_jsons")
+    start = time.perf_counter()
+    print("Re-indexed:", index.refresh(force=True))
+    print(f"Refresh took {time.perf_counter() - start:.3f}s")
+    if len(sys.argv) > 1:
+        start = time.perf_counter()
+        hits = index.search(" ".join(sys.argv[1:]))
+        elapsed = time.perf_counter() - start
+        for hit in hits:
+            print(
+                f"{hit['score']:9.3f}  {hit['course']}  {hit['id']}: {hit['snippet']}"
+            )
+        print(f"{len(hits)} hits in {elapsed * 1000:.2f}ms")
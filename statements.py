@@ -0,0 +1,107 @@
+import functools
+import re
+
+# Keywords that start a statement when they begin a line followed by a
+# number ("Theorem 3", "Lemma 2.42")
+STATEMENT_KINDS = (
+    "Theorem",
+    "Proposition",
+    "Lemma",
+    "Corollary",
+    "Definition",
+    "Example",
+    "Remark",
+    "Claim",
+)
+# The keywords of the original regex; segment() with these gives the same
+# statements it did
+LEGACY_KINDS = (
+    "Theorem",
+    "Proposition",
+    "Lemma",
+    "Example",
+    "Corollary",
+    "Definition",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def boundary_pattern(kinds):
+    # A statement starts at a header line and ends at the next header line,
+    # the next run of three newlines or the end of the text
+    keywords = "|".join(re.escape(kind) for kind in kinds)
+    return re.compile(r"(?m)^(%s) (\d+(?:\.\d+)*)|\n\n\n" % keywords)
+
+
+def segment(text, kinds=STATEMENT_KINDS, offset=0, first_page=1):
+    """Split text into statements in a single scan over its boundaries.
+
+    Returns dicts with the statement text, kind, number, start and end
+    character offsets (plus offset) and the page it starts on, counting
+    form feeds from first_page."""
+    statements = []
+    current = None
+    page, counted = first_page, 0
+
+    def close(end):
+        kind, number, start = current
+        body = text[start:end].rstrip()
+        nonlocal page, counted
+        page += text.count("\f", counted, start)
+        counted = start
+        statements.append(
+            {
+                "text": body,
+                "kind": kind,
+                "number": number,
+                "start": offset + start,
+                "end": offset + start + len(body),
+                "page": page,
+            }
+        )
+
+    for match in boundary_pattern(tuple(kinds)).finditer(text):
+        if current is not None:
+            close(match.start())
+            current = None
+        if match.group(1) is not None:
+            current = (match.group(1), match.group(2), match.start())
+    if current is not None:
+        close(len(text))
+    return statements
+
+
+def iter_statements(chunks, kinds=STATEMENT_KINDS):
+    """Segment an iterable of text chunks (e.g. PDF pages), yielding each
+    statement as soon as the next boundary after it has arrived. Offsets
+    and pages refer to the joined text.
+
+    Each chunk is searched for boundaries once (with the few characters
+    before it that it can complete into one), and each statement is
+    segmented once, when it is closed."""
+    pattern = boundary_pattern(tuple(kinds))
+    # A boundary that more text can still complete starts at most this far
+    # from the end of the buffer: a keyword, its space and a digit
+    overlap = max(len(kind) for kind in kinds) + 1
+    buffer, offset, page = "", 0, 1
+    # Where the search resumes, and whether buffer starts with a header
+    scan, in_statement = 0, False
+    for chunk in chunks:
+        buffer += chunk
+        keep = 0
+        # A header's number can go on in the next chunk ("Lemma 2." + "1"),
+        # but the statement it opens is segmented again from keep anyway
+        for match in pattern.finditer(buffer, scan):
+            keep, scan = match.start(), match.end()
+            in_statement = match.group(1) is not None
+        scan = max(scan, len(buffer) - overlap)
+        if not in_statement:
+            # Keep the last line, it might be the start of a header
+            keep = max(keep, buffer.rfind("\n", 0, scan) + 1)
+        # Everything before keep is closed now
+        yield from segment(buffer[:keep], kinds, offset, page)
+        page += buffer.count("\f", 0, keep)
+        offset += keep
+        buffer = buffer[keep:]
+        scan -= keep
+    yield from segment(buffer, kinds, offset, page)
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import course_edit
+from course_edit import CourseEditor, EditError
+
+course_name = "analysis3.json"
+
+
+@pytest.fixture
+def editor(tmp_path):
+    shutil.copy(os.path.join("saved_course_jsons", course_name), tmp_path)
+    return CourseEditor(str(tmp_path), str(tmp_path / "positions"))
+
+
+def load(editor):
+    with open(os.path.join(editor.courses_dir, course_name), "rb") as f:
+        return f.read()
+
+
+def ids(editor):
+    return [thingy["id"] for thingy in json.loads(load(editor))]
+
+
+def test_failed_mixed_batch_changes_nothing(editor):
+    path = os.path.join(editor.courses_dir, course_name)
+    before = load(editor)
+    first, second = ids(editor)[:2]
+    with pytest.raises(EditError) as error:
+        editor.apply(
+            path,
+            [
+                {"op": "delete_theorem", "id": first},
+                {"op": "update_theorem", "id": second, "fields": {"name": 5}},
+            ],
+        )
+    assert error.value.status == 400
+    assert load(editor) == before
+
+    # The delete from the failed batch must not come back with the next edit
+    editor.apply(
+        path, [{"op": "update_theorem", "id": second, "fields": {"name": "renamed"}}]
+    )
+    after = json.loads(load(editor))
+    assert [thingy["id"] for thingy in after] == ids(editor)
+    assert first in ids(editor)
+    assert len(after) == len(json.loads(before))
+
+
+@pytest.mark.parametrize(
+    "edit",
+    [
+        {"op": "add_theorem", "theorem": {"id": ["not", "hashable"]}},
+        {"op": "add_theorem", "theorem": {"id": "Lemma 99.1", "name": 5}},
+        {"op": "update_theorem", "id": {"a": 1}, "fields": {}},
+        {
+            "op": "update_theorem",
+            "id": "Definition 1.1",
+            "fields": {"previous_results": "Lemma 1.2"},
+        },
+        {"op": "add_edge", "source": ["x"], "target": "y"},
+    ],
+)
+def test_invalid_fields_are_rejected(editor, edit):
+    path = os.path.join(editor.courses_dir, course_name)
+    before = load(editor)
+    with pytest.raises(EditError) as error:
+        editor.apply(path, [edit])
+    assert error.value.status == 400
+    assert load(editor) == before
+
+
+def test_unexpected_error_discards_the_edited_course(editor, monkeypatch):
+    path = os.path.join(editor.courses_dir, course_name)
+    first = ids(editor)[0]
+
+    def fail(path, data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(course_edit, "write_atomically", fail)
+    with pytest.raises(OSError):
+        editor.apply(path, [{"op": "delete_theorem", "id": first}])
+    monkeypatch.undo()
+
+    editor.apply(path, [{"op": "update_theorem", "id": first, "fields": {}}])
+    assert first in ids(editor)
@@ -1,5 +1,19 @@
 import json
 import os
+import random
+from collections import namedtuple
+
+import pytest
+
+from bench import legacy_statements, synthetic_text
+from claude import chosen_preconditions, precondition_requests
+from course_store import Course, CourseStore, write_course
+from dag import condensation
+from dedup import deduplicate
+from job_events import EventLog, GraphStream
+from reachability import ReachabilityIndex
+from references import normalize_reference, resolve_references
+from statements import LEGACY_KINDS, STATEMENT_KINDS, iter_statements, segment
 
 chapters = [
     "Entropy, Divergence, and Mutual Information",
@@ -9,20 +23,289 @@ chapters = [
     "Noisy Channels with non-iid input",
 ]
 
-with open(
-    os.path.join("saved_course_jsons", "information_theory.json"),
-    "r",
-    encoding="utf-8",
-) as file:
-    theorems = json.load(file)
-
-for i, theorem in enumerate(theorems):
-    try:
-        topic_num = int(theorem["id"].split()[1][0])-1
-        theorems[i]["topic"] = chapters[topic_num]
-    except Exception as e:
-        print(f"Error processing theorem {i}: {theorem['id']}")
-        print(e)
-
-with open(os.path.join("saved_course_jsons", "information_theory_edited.json"), "w+") as f:
-    json.dump(theorems, f, indent=4)
+# Pieces random notes are made of: headers (also cut short), numbers that
+# go on after a chunk boundary, runs of newlines and page breaks
+note_pieces = [
+    "Theorem ",
+    "Lemma ",
+    "Lem",
+    "Claim",
+    "Remark 1",
+    "Definition 4.2",
+    " ",
+    "1",
+    "2.",
+    "3",
+    ".",
+    "\n",
+    "\n\n",
+    "\n\n\n",
+    "\f",
+    "x",
+    "text ",
+]
+
+
+def random_notes(rng, pieces=60):
+    return "".join(rng.choice(note_pieces) for _ in range(rng.randint(0, pieces)))
+
+
+def random_chunks(rng, text):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(len(text) + 1, 12)))
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def test_segment_matches_legacy_regex():
+    texts = [synthetic_text(200000)]
+    rng = random.Random(0)
+    texts += [random_notes(rng) for _ in range(2000)]
+    for text in texts:
+        statements = segment(text, LEGACY_KINDS)
+        assert [s["text"] for s in statements] == legacy_statements(text)
+
+
+def test_segment_records_offsets_and_pages():
+    text = "Preface\f\nLemma 2.1 Let x.\n\f\nTheorem 3 Then y.\n\n\nNotes"
+    statements = segment(text, offset=100, first_page=4)
+    assert [(s["kind"], s["number"], s["page"]) for s in statements] == [
+        ("Lemma", "2.1", 5),
+        ("Theorem", "3", 6),
+    ]
+    for s in statements:
+        assert text[s["start"] - 100 : s["end"] - 100] == s["text"]
+
+
+@pytest.mark.parametrize("kinds", [STATEMENT_KINDS, LEGACY_KINDS])
+def test_iter_statements_matches_segment(kinds):
+    rng = random.Random(1)
+    for _ in range(3000):
+        text = random_notes(rng)
+        chunks = random_chunks(rng, text)
+        assert list(iter_statements(chunks, kinds)) == segment(text, kinds)
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        # A header cut inside its keyword, or inside or right after its number
+        ["Intro\nLem", "ma 2.1 x\nTheorem 3 y"],
+        ["Lemma 2.", "1 x\nTheorem 3 y"],
+        ["Lemma 2", ".1 x\nTheorem 3 y"],
+        ["Lemma 2.1", "2 x\nTheorem 3 y"],
+        ["Lemma 2.1 x\nTheorem 3", "4 y"],
+        # Three newlines arriving in two chunks
+        ["Lemma 2.1 x\n\n", "\nnot a statement\nClaim 1 z"],
+        # One statement over many chunks, then one cut at every character
+        ["Theorem 1\n"] + ["word \f"] * 200 + ["\nLemma 2 end"],
+        list("Text\nLemma 1 a\fb\n\n\nRemark 2.10. c\nClaim 3"),
+    ],
+)
+def test_iter_statements_resumes_across_chunks(chunks):
+    text = "".join(chunks)
+    assert list(iter_statements(chunks)) == segment(text)
+
+
+def test_references_resolve_abbreviations_and_names():
+    assert normalize_reference("Thm. 2.04") == normalize_reference("theorem  2.4")
+    claude_list = [
+        {"id": "Theorem 2.4", "name": "Hahn-Banach", "previous_results": []},
+        {
+            "id": "Lemma 1",
+            "previous_results": [
+                "Thm. 2.04",
+                "hahn-banach",
+                "Theorem 2.4(ii)",
+                "Lemma 1",
+                "Lemma 7",
+            ],
+        },
+    ]
+    edges, unresolved = resolve_references(claude_list)
+    assert edges == [("Theorem 2.4", "Lemma 1")]
+    assert unresolved == [{"id": "Lemma 1", "reference": "Lemma 7"}]
+
+
+def test_condensation_collapses_cycles_in_topological_order():
+    component_of, components, component_edges = condensation(
+        5, [(0, 1), (1, 2), (2, 1), (2, 3), (4, 0)]
+    )
+    assert components == [[4], [0], [1, 2], [3]]
+    assert component_of == [1, 2, 2, 3, 0]
+    assert component_edges == [(0, 1), (1, 2), (2, 3)]
+    # Deeper than the recursion limit
+    n = 100000
+    component_of, components, _ = condensation(n, [(v, v + 1) for v in range(n - 1)])
+    assert component_of == list(range(n))
+
+
+def ancestors(predecessors, v):
+    seen, stack = {v}, [v]
+    while stack:
+        for w in predecessors[stack.pop()]:
+            if w not in seen:
+                seen.add(w)
+                stack.append(w)
+    return seen
+
+
+def test_reachability_matches_graph_search():
+    rng = random.Random(2)
+    for _ in range(200):
+        n = rng.randint(1, 25)
+        edges = sorted(
+            {(rng.randrange(n), rng.randrange(n)) for _ in range(rng.randint(0, 50))}
+        )
+        edges = [(s, t) for s, t in edges if s != t]
+        predecessors = {v: [] for v in range(n)}
+        successors = {v: [] for v in range(n)}
+        for s, t in edges:
+            predecessors[t].append(s)
+            successors[s].append(t)
+        index = ReachabilityIndex(range(n), edges)
+        v, w = rng.randrange(n), rng.randrange(n)
+        known = rng.sample(range(n), min(n, 3))
+
+        assert set(index.prerequisites(v)) == ancestors(predecessors, v) - {v}
+        assert set(index.consequences(v)) == ancestors(successors, v) - {v}
+        assert index.reaches(w, v) == (w in ancestors(predecessors, v))
+        to_learn = ancestors(predecessors, v) - {v}
+        for k in known:
+            to_learn -= ancestors(predecessors, k)
+        path = index.learning_path(v, known)
+        assert set(path) == to_learn and len(path) == len(to_learn)
+        # Each comes after its prerequisites (outside its own cycle)
+        order = {u: i for i, u in enumerate(path)}
+        for s, t in edges:
+            if s in order and t in order and v not in ancestors(predecessors, s):
+                assert s in ancestors(predecessors, t)
+                assert order[s] < order[t] or t in ancestors(predecessors, s)
+
+        chain = index.shortest_chain(w, v)
+        if w in ancestors(predecessors, v):
+            assert chain[0] == w and chain[-1] == v
+            assert all((s, t) in edges for s, t in zip(chain, chain[1:]))
+        else:
+            assert chain is None
+
+
+def test_dedup_merges_renamed_and_reworded_statements():
+    text = "Every bounded monotone sequence of real numbers converges to its supremum"
+    elems = [
+        {"id": "Theorem 2.4", "statement": text, "proof": "", "previous_results": []},
+        {"id": "Thm. 2.04", "statement": "short", "proof": "long proof"},
+        {"id": "Lemma 3", "statement": text + " here", "proof": ""},
+        {"id": "Lemma 4", "statement": "nothing alike at all, clearly", "proof": ""},
+        {
+            "id": "Corollary 5",
+            "statement": "follows",
+            "proof": "",
+            "previous_results": ["Lemma 3", "Lemma 4", "Corollary 5"],
+        },
+    ]
+    merged, report = deduplicate(elems)
+    assert [elem["id"] for elem in merged] == ["Thm. 2.04", "Lemma 4", "Corollary 5"]
+    assert report[0]["ids"] == ["Theorem 2.4", "Thm. 2.04", "Lemma 3"]
+    assert merged[-1]["previous_results"] == ["Thm. 2.04", "Lemma 4"]
+
+
+def test_job_stream_ends_with_the_served_layout(tmp_path):
+    import app
+
+    with open(os.path.join("saved_course_jsons", "analysis3.json")) as f:
+        final = json.load(f)
+    (tmp_path / "final_summary.json").write_text(json.dumps(final))
+    log = EventLog()
+    stream = GraphStream(log)
+    for start in range(0, len(final), 7):
+        stream.add_statements(final[::-1][start : start + 7])
+    stream.stage_done(namedtuple("Stage", "outputs")(["final_summary.json"]), tmp_path)
+    served = json.loads(app.graph_response_body(final, app.DEFAULT_LAYOUT))
+    event, positions = log.events[-1][1:]
+    assert event == "layout"
+    assert positions == {
+        node["id"]: [node["x"], node["y"]] for node in served["graph"]["nodes"]
+    }
+
+
+def test_precondition_requests_offer_the_whole_list():
+    preconditions = ["f is continuous", "x is compact", "unrelated wording"]
+    statements = [f"Lemma {k}. Let f is continuous on [a, b]." for k in range(45)]
+    hints, batches, requests = precondition_requests(statements, preconditions)
+    assert [len(batch) for batch in batches] == [20, 20, 5]
+    assert hints[0][0] == 0
+    for request in requests:
+        listing = request["system"][1]["text"]
+        assert all(f"{n}. {p}" in listing for n, p in enumerate(preconditions, 1))
+    chosen = [3, "1", "x is compact", "not on the list", True, 9]
+    assert chosen_preconditions(chosen, preconditions) == preconditions
+    with pytest.raises(ValueError):
+        chosen_preconditions("1, 2", preconditions)
+
+
+saved_courses = sorted(
+    name for name in os.listdir("saved_course_jsons") if name.endswith(".json")
+)
+
+
+@pytest.mark.parametrize("name", saved_courses)
+def test_course_file_round_trips(name, tmp_path):
+    path = os.path.join("saved_course_jsons", name)
+    with open(path, "r", encoding="utf-8") as f:
+        expected = json.load(f)
+    store_path = str(tmp_path / "course.course")
+    write_course(path, store_path)
+    course = Course(store_path)
+    # Compared as JSON so that key order counts too
+    assert json.dumps(course.elements()) == json.dumps(expected)
+    assert course.edges() == resolve_references(expected)[0]
+
+
+def test_course_file_keeps_odd_values(tmp_path):
+    expected = [
+        {"id": "Lemma 1", "type": 5, "statement": "x", "previous_results": []},
+        {"type": None, "id": "Théorème 2", "topic": "Über", "proof": ["a", 1]},
+        {"id": "Lemma 1", "statement": "", "name": "duplicate"},
+        {"id": "", "previous_results": ["Lemma 1", "Lemma 9"]},
+    ]
+    path = tmp_path / "odd.json"
+    path.write_text(json.dumps(expected), encoding="utf-8")
+    write_course(str(path), str(tmp_path / "odd.course"))
+    course = Course(str(tmp_path / "odd.course"))
+    assert json.dumps(course.elements()) == json.dumps(expected)
+    assert course.position == {"Lemma 1": 0, "Théorème 2": 1, "": 3}
+    assert course.edges() == [("Lemma 1", "")]
+    assert course.unresolved_references == resolve_references(expected)[1]
+    stripped = course.element(0, texts=False)
+    assert stripped == dict(expected[0], statement="")
+
+
+def test_course_store_rebuilds_changed_courses(tmp_path):
+    courses = tmp_path / "courses"
+    courses.mkdir()
+    path = courses / "course.json"
+    path.write_text(json.dumps([{"id": "Lemma 1"}]))
+    store = CourseStore(str(tmp_path / "store"), str(courses))
+    assert store.open(str(path)).vertices() == ["Lemma 1"]
+    path.write_text(json.dumps([{"id": "Lemma 1"}, {"id": "Lemma 2"}]))
+    assert store.open(str(path)).vertices() == ["Lemma 1", "Lemma 2"]
+    assert store.catalog()["course.json"]["nodes"] == 2
+
+
+if __name__ == "__main__":
+    with open(
+        os.path.join("saved_course_jsons", "information_theory.json"),
+        "r",
+        encoding="utf-8",
+    ) as file:
+        theorems = json.load(file)
+
+    for i, theorem in enumerate(theorems):
+        try:
+            topic_num = int(theorem["id"].split()[1][0])-1
+            theorems[i]["topic"] = chapters[topic_num]
+        except Exception as e:
+            print(f"Error processing theorem {i}: {theorem['id']}")
+            print(e)
+
+    with open(os.path.join("saved_course_jsons", "information_theory_edited.json"), "w+") as f:
+        json.dump(theorems, f, indent=4)
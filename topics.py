@@ -0,0 +1,153 @@
+import numpy as np
+
+from layout import layered_layout
+
+# Topic of statements that have none
+untitled_topic = "(no topic)"
+
+
+def grouped(keys, n_groups):
+    """Indices of keys sorted by key, and the slice boundaries of each of
+    the n_groups keys (empty groups included)."""
+    order = np.argsort(keys, kind="stable")
+    return order, np.searchsorted(keys[order], np.arange(n_groups + 1))
+
+
+class TopicIndex:
+    """Level-of-detail view of a course: one supernode per topic (as set by
+    cluster_topics), with the references between topics counted, and each
+    topic's statements and boundary edges on demand.
+
+    Statements and edges are grouped by topic once, so the topic graph and
+    each expansion only slice arrays; the topic graph is laid out here,
+    a topic's statements when it is expanded."""
+
+    def __init__(self, statements, edges):
+        # statements: one dict per id with id, name, type and topic (texts
+        # aren't needed); edges: (source, target) ids, source the prerequisite
+        self.statements = list(statements)
+        self.position = {thingy["id"]: k for k, thingy in enumerate(self.statements)}
+        self.topics = {}
+        topic_of = [
+            self.topics.setdefault(
+                thingy.get("topic") or untitled_topic, len(self.topics)
+            )
+            for thingy in self.statements
+        ]
+        self.topic_names = list(self.topics)
+        self.topic_of = np.array(topic_of, dtype=np.int64)
+        self.members, self.member_bounds = grouped(self.topic_of, len(self.topics))
+
+        pairs = np.array(
+            [(self.position[s], self.position[t]) for s, t in edges], dtype=np.int64
+        ).reshape(-1, 2)
+        self.src, self.dst = pairs[:, 0], pairs[:, 1]
+        src_topic, dst_topic = self.topic_of[self.src], self.topic_of[self.dst]
+        self.out_edges, self.out_bounds = grouped(src_topic, len(self.topics))
+        self.in_edges, self.in_bounds = grouped(dst_topic, len(self.topics))
+
+        # References between topics: (source topic, target topic) -> count
+        n = len(self.topics)
+        between = src_topic != dst_topic
+        keys, counts = np.unique(
+            src_topic[between] * n + dst_topic[between], return_counts=True
+        )
+        self.topic_links = [
+            (self.topic_names[key // n], self.topic_names[key % n], int(count))
+            for key, count in zip(keys.tolist(), counts.tolist())
+        ]
+        self.internal_links = np.bincount(src_topic[~between], minlength=n).tolist()
+        self.topic_positions = layered_layout(
+            self.topic_names, [(s, t) for s, t, _ in self.topic_links]
+        )
+
+    @property
+    def nbytes(self):
+        # Edge arrays and their two groupings, plus the statement dicts
+        return (
+            6 * self.src.nbytes + 2 * self.topic_of.nbytes + 200 * len(self.statements)
+        )
+
+    def __contains__(self, topic):
+        return topic in self.topics
+
+    def member_positions(self, topic):
+        t = self.topics[topic]
+        return self.members[self.member_bounds[t] : self.member_bounds[t + 1]]
+
+    def topic_graph(self):
+        """node-link graph of the topics: nodes with their size, types and
+        number of references inside the topic; links with the number of
+        references between two topics (count) and that count relative to
+        the largest one (weight, in (0, 1])."""
+        nodes = []
+        for t, topic in enumerate(self.topic_names):
+            types = {}
+            for k in self.member_positions(topic).tolist():
+                kind = self.statements[k].get("type")
+                types[kind] = types.get(kind, 0) + 1
+            x, y = self.topic_positions[topic]
+            nodes.append(
+                dict(
+                    id=topic,
+                    name=topic,
+                    size=int(self.member_bounds[t + 1] - self.member_bounds[t]),
+                    types=types,
+                    internal_links=self.internal_links[t],
+                    x=x,
+                    y=y,
+                )
+            )
+        heaviest = max((count for _, _, count in self.topic_links), default=1)
+        links = [
+            dict(source=s, target=t, count=count, weight=round(count / heaviest, 4))
+            for s, t, count in self.topic_links
+        ]
+        return dict(directed=True, multigraph=False, graph={}, nodes=nodes, links=links)
+
+    def expand(self, topic):
+        """The statements of topic (compact, laid out among themselves),
+        the references between them, and its boundary links: references
+        to or from statements of other topics, labelled with that topic."""
+        t = self.topics[topic]
+        members = self.member_positions(topic).tolist()
+        outgoing = self.out_edges[self.out_bounds[t] : self.out_bounds[t + 1]]
+        incoming = self.in_edges[self.in_bounds[t] : self.in_bounds[t + 1]]
+        inside = outgoing[self.topic_of[self.dst[outgoing]] == t]
+        leaving = outgoing[self.topic_of[self.dst[outgoing]] != t]
+        entering = incoming[self.topic_of[self.src[incoming]] != t]
+
+        def id(k):
+            return self.statements[k]["id"]
+
+        links = [
+            (id(s), id(d))
+            for s, d in zip(self.src[inside].tolist(), self.dst[inside].tolist())
+        ]
+        positions = layered_layout([id(k) for k in members], links)
+        nodes = []
+        for k in members:
+            thingy = self.statements[k]
+            x, y = positions[thingy["id"]]
+            nodes.append(
+                dict(
+                    id=thingy["id"],
+                    name=thingy.get("name"),
+                    type=thingy.get("type"),
+                    topic=topic,
+                    x=x,
+                    y=y,
+                )
+            )
+        boundary = [
+            dict(source=id(s), target=id(d), topic=self.topic_names[self.topic_of[d]])
+            for s, d in zip(self.src[leaving].tolist(), self.dst[leaving].tolist())
+        ] + [
+            dict(source=id(s), target=id(d), topic=self.topic_names[self.topic_of[s]])
+            for s, d in zip(self.src[entering].tolist(), self.dst[entering].tolist())
+        ]
+        return dict(
+            nodes=nodes,
+            links=[dict(source=s, target=d) for s, d in links],
+            boundary_links=boundary,
+        )